@@ -7,16 +7,23 @@ class AgronegocioAgent(BaseAgent):
 
     def __init__(self, data_dir: str = "data"):
         super().__init__(data_dir)
+        self._carregar_configuracao()
+
+    def _carregar_configuracao(self):
         self.ramo_config = self._carregar_json(self.data_dir / "ramos_atividade.json").get("agronegocio", {})
+        self.motor_regras = self._carregar_regras("agronegocio")
+        # Implicações e recomendações dependem só da configuração do ramo: calculadas uma vez por carga.
+        self._implicacoes = tuple(self._analisar_implicacoes_fiscais())
+        self._recomendacoes = tuple(self._gerar_recomendacoes())
 
     def analisar_documento(self, cfop: str, dados_documento: Dict) -> Dict:
         """
         Realiza a análise fiscal específica para o agronegócio.
         """
         return {
-            "implicacoes_fiscais": self._analisar_implicacoes_fiscais(),
-            "recomendacoes_arquivamento": self._gerar_recomendacoes(),
-            "alertas_especificos": self._gerar_alertas_setoriais(cfop)
+            "implicacoes_fiscais": list(self._implicacoes),
+            "recomendacoes_arquivamento": list(self._recomendacoes),
+            "alertas_especificos": self._gerar_alertas_setoriais(cfop, dados_documento)
         }
 
     def _analisar_implicacoes_fiscais(self) -> List[str]:
@@ -39,12 +46,3 @@ class AgronegocioAgent(BaseAgent):
         if documentos:
             recomendacoes.append(f"Anexar os seguintes documentos de suporte: {', '.join(documentos)}.")
         return recomendacoes
-
-    def _gerar_alertas_setoriais(self, cfop: str) -> List[str]:
-        """Gera alertas específicos para o agronegócio."""
-        alertas = []
-        if cfop.startswith(("5.", "6.")):
-            alertas.append("ALERTA AGRO: Verificar o cálculo do FUNRURAL para esta operação de venda.")
-        if cfop in ["1.101", "2.101", "5.101", "6.101"]:
-            alertas.append("INFO AGRO: Operação com grãos. Verificar se há isenção ou diferimento de ICMS aplicável.")
-        return alertas
\ No newline at end of file
@@ -7,15 +7,22 @@ class AutomotivoAgent(BaseAgent):
 
     def __init__(self, data_dir: str = "data"):
         super().__init__(data_dir)
+        self._carregar_configuracao()
+
+    def _carregar_configuracao(self):
         self.ramo_config = self._carregar_json(self.data_dir / "ramos_atividade.json").get("automotivo", {})
+        self.motor_regras = self._carregar_regras("automotivo")
+        # Implicações e recomendações dependem só da configuração do ramo: calculadas uma vez por carga.
+        self._implicacoes = tuple(self._analisar_implicacoes_fiscais())
+        self._recomendacoes = tuple(self._gerar_recomendacoes())
 
     def analisar_documento(self, cfop: str, dados_documento: Dict) -> Dict:
         """
         Realiza a análise fiscal específica para o setor automotivo.
         """
         return {
-            "implicacoes_fiscais": self._analisar_implicacoes_fiscais(),
-            "recomendacoes_arquivamento": self._gerar_recomendacoes(),
+            "implicacoes_fiscais": list(self._implicacoes),
+            "recomendacoes_arquivamento": list(self._recomendacoes),
             "alertas_especificos": self._gerar_alertas_setoriais(cfop, dados_documento)
         }
 
@@ -39,17 +46,3 @@ class AutomotivoAgent(BaseAgent):
         if documentos:
             recomendacoes.append(f"Anexar os seguintes documentos de suporte: {', '.join(documentos)}.")
         return recomendacoes
-
-    def _gerar_alertas_setoriais(self, cfop: str, dados_documento: Dict) -> List[str]:
-        """Gera alertas específicos para o setor automotivo."""
-        alertas = []
-        # Exemplo de validação de peças e serviços
-        if cfop in ["5.401", "5.403", "6.401", "6.403"]:
-            alertas.append("ALERTA AUTOMOTIVO: Operação com ICMS-ST. Conferir se o item é peça automotiva e se o MVA está correto.")
-
-        # Validação de códigos de peças (simulação)
-        for item in dados_documento.get("itens", []):
-            if "pneu" in item.get("descricao", "").lower() and item.get("codigo_produto") is None:
-                 alertas.append(f"ALERTA AUTOMOTIVO: Item '{item.get('descricao')}' sem código de produto. Verificar cadastro.")
-
-        return alertas
\ No newline at end of file
@@ -1,14 +1,65 @@
 import json
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+from .motor_regras import MotorRegras, carregar_regras
+
+# Quantidade máxima de CFOPs com alertas memorizados por agente.
+TAMANHO_CACHE_REGRAS = 4096
+
+
+class RegistroSomenteLeitura(dict):
+    """
+    Dicionário que não aceita alterações depois de criado. Usado nos registros de configuração
+    compartilhados entre todas as classificações (e threads), como os da tabela de CFOPs que
+    vão em 'cfop_info'. Continua sendo um dict para `json.dumps`, pickle e `st.json`.
+    """
+
+    def _somente_leitura(self, *args, **kwargs):
+        raise TypeError("Registro de configuração compartilhado: faça uma cópia com dict(...) para alterá-lo.")
+
+    __setitem__ = __delitem__ = __ior__ = _somente_leitura
+    clear = pop = popitem = setdefault = update = _somente_leitura
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
 
 class BaseAgent:
     """
     Agente base que fornece funcionalidades comuns para outros agentes,
     como carregar arquivos de configuração JSON e normalizar CFOPs.
+
+    Os alertas dos agentes setoriais vêm do motor de regras declarativas
+    (`motor_regras.py`) e se dividem em duas partes: os que dependem só do CFOP,
+    memorizados em um LRU limitado que vive enquanto o agente existir (uma nova
+    configuração monta agentes novos), e os que leem campos do documento, avaliados
+    a cada documento se o agente tiver algum.
     """
+
     def __init__(self, data_dir: str = "data"):
         self.data_dir = Path(data_dir)
+        self.motor_regras: Optional[MotorRegras] = None
+        self._alertas_por_cfop = lru_cache(maxsize=TAMANHO_CACHE_REGRAS)(self._gerar_alertas_cfop)
+
+    def _carregar_configuracao(self):
+        """Carrega a configuração do agente (sobrescrito pelos agentes que têm uma)."""
+
+    def _carregar_regras(self, agente: str) -> MotorRegras:
+        """Compila as regras setoriais do agente (padrão + 'data/regras_setoriais.json')."""
+        return MotorRegras(carregar_regras(self.data_dir), agente)
+
+    def _gerar_alertas_cfop(self, cfop: str) -> Tuple[str, ...]:
+        """Alertas que dependem apenas do CFOP (memorizados)."""
+        return self.motor_regras.alertas_cfop(cfop) if self.motor_regras else ()
+
+    def _gerar_alertas_setoriais(self, cfop: str, dados_documento: Dict) -> List[str]:
+        """Alertas do documento: os memorizados por CFOP seguidos dos que dependem do documento."""
+        alertas = list(self._alertas_por_cfop(cfop))
+        if self.motor_regras and self.motor_regras.campos_documento:
+            alertas.extend(self.motor_regras.alertas_documento(cfop, dados_documento))
+        return alertas
 
     def _carregar_json(self, path: Path, key: str = None) -> Dict:
         """
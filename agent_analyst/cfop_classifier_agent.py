@@ -1,8 +1,10 @@
-import pandas as pd
+import csv
+import sqlite3
 from typing import Dict, List
 from pathlib import Path
 import json
-from .base_agent import BaseAgent
+from .base_agent import BaseAgent, RegistroSomenteLeitura
+from tools.cfop_artefato import FORMATO_ARTEFATO_CFOP
 
 
 class CFOPClassifierAgent(BaseAgent):
@@ -20,34 +22,64 @@ class CFOPClassifierAgent(BaseAgent):
 
     def carregar_dados_cfop(self, arquivo_cfop: str) -> bool:
         """
-        Carrega os dados de CFOP a partir de um arquivo CSV ou JSON
-        e aplica a normalização na coluna 'cfop'.
+        Carrega os dados de CFOP e monta um índice {cfop_normalizado: registro}.
+
+        Aceita o artefato SQLite pré-normalizado gerado pelo crawler (.db), que carrega
+        em milissegundos, ou os arquivos CSV/JSON, normalizados aqui na carga.
+        Nenhum dos formatos depende do pandas.
         """
         try:
             cfop_path = self.data_dir / arquivo_cfop
-            if cfop_path.suffix == '.csv':
-                self.cfop_data = pd.read_csv(cfop_path, dtype={'cfop': str})
+            if cfop_path.suffix in ('.db', '.sqlite'):
+                registros = self._ler_artefato_sqlite(cfop_path)
+                ja_normalizado = True
+            elif cfop_path.suffix == '.csv':
+                with open(cfop_path, 'r', encoding='utf-8', newline='') as f:
+                    registros = list(csv.DictReader(f))
+                ja_normalizado = False
             elif cfop_path.suffix == '.json':
                 with open(cfop_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                self.cfop_data = pd.DataFrame(data, dtype=str)
+                    registros = [{k: str(v) for k, v in registro.items()} for registro in json.load(f)]
+                ja_normalizado = False
             else:
                 print(f"❌ Formato de arquivo não suportado: {arquivo_cfop}")
                 return False
 
-            # --- CORREÇÃO CRÍTICA ---
-            # Normaliza toda a coluna 'cfop' do DataFrame para garantir correspondência.
-            if 'cfop' in self.cfop_data.columns:
-                self.cfop_data['cfop'] = self.cfop_data['cfop'].apply(self._normalize_cfop)
-            # --- FIM DA CORREÇÃO ---
-
-            print(f"✅ Dados CFOP carregados e normalizados: {len(self.cfop_data)} registros")
+            # Normaliza o código de cada registro para garantir correspondência.
+            # Em caso de códigos repetidos, prevalece o primeiro registro (como na busca anterior).
+            # Os registros são somente leitura: cada classificação devolve o próprio registro.
+            cfop_data = {}
+            for registro in registros:
+                if not ja_normalizado:
+                    registro['cfop'] = self._normalize_cfop(registro.get('cfop'))
+                if registro['cfop'] not in cfop_data:
+                    cfop_data[registro['cfop']] = RegistroSomenteLeitura(registro)
+            self.cfop_data = cfop_data
+
+            print(f"✅ Dados CFOP carregados e normalizados: {len(registros)} registros")
             return True
         except Exception as e:
             print(f"❌ Erro ao carregar dados CFOP: {e}")
             self.cfop_data = None
             return False
 
+    def _ler_artefato_sqlite(self, cfop_path: Path) -> List[Dict]:
+        """
+        Lê o artefato SQLite do crawler, conferindo a versão do formato.
+        Os códigos já estão normalizados no formato 'X.XXX'.
+        """
+        # Abre somente leitura: um caminho inexistente não deve criar um banco vazio.
+        conn = sqlite3.connect(f"{cfop_path.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            conn.row_factory = sqlite3.Row
+            meta = dict(conn.execute("SELECT chave, valor FROM meta").fetchall())
+            if int(meta.get('formato_versao', 0)) != FORMATO_ARTEFATO_CFOP:
+                raise ValueError(f"versão de formato {meta.get('formato_versao')} não suportada "
+                                 f"(esperada {FORMATO_ARTEFATO_CFOP})")
+            return [dict(linha) for linha in conn.execute("SELECT * FROM cfop")]
+        finally:
+            conn.close()
+
     def classificar_documento(self, cfop: str, ramo_empresa: str, dados_documento: Dict) -> Dict:
         """
         Classifica um documento fiscal com base no CFOP (normalizado), ramo de atividade e dados do documento.
@@ -58,12 +90,11 @@ class CFOPClassifierAgent(BaseAgent):
         # Normaliza o CFOP recebido do XML antes de fazer a busca.
         cfop_normalizado = self._normalize_cfop(cfop)
 
-        cfop_info = self.cfop_data[self.cfop_data['cfop'] == cfop_normalizado]
+        # O registro (somente leitura) é compartilhado entre todas as classificações do mesmo CFOP, sem cópia.
+        cfop_info = self.cfop_data.get(cfop_normalizado)
 
-        if cfop_info.empty:
+        if cfop_info is None:
             return {"erro": f"CFOP {cfop_normalizado} (originado de '{cfop}') não encontrado na base de dados."}
-
-        cfop_info = cfop_info.iloc[0].to_dict()
         ramo_config = self.ramos_atividade.get(ramo_empresa, {})
         if not ramo_config:
             return {"erro": f"Ramo de atividade '{ramo_empresa}' não configurado no arquivo ramos_atividade.json."}
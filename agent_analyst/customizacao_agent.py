@@ -10,8 +10,13 @@ class CustomizacaoAgent(BaseAgent):
 
     def __init__(self, data_dir: str = "data"):
         super().__init__(data_dir)
-        # Este agente pode carregar configurações adicionais ou regras de negócio complexas
-        # Ex: self.regras_especificas = self._carregar_json(self.data_dir / "regras_especificas.json")
+        self._carregar_configuracao()
+
+    def _carregar_configuracao(self):
+        # Regras de setor específico (CNPJ do destinatário, CNAE do emitente) e de mudanças
+        # legais (por CFOP), declaradas em 'regras_setoriais.json'.
+        self.regras_setor = self._carregar_regras("setor_especifico")
+        self.motor_regras = self._carregar_regras("mudancas_legais")
 
     def analisar_setor_especifico(self, dados_documento: Dict) -> Dict:
         """
@@ -23,19 +28,14 @@ class CustomizacaoAgent(BaseAgent):
         implicacoes = []
         ramo_especifico = "Padrão"
 
-        # Exemplo de lógica para Órgãos Públicos (CNPJ começa com 00.394.460/...)
-        cnpj_destinatario = dados_documento.get("cabecalho", {}).get("destinatario_cpf_cnpj")
-        if cnpj_destinatario and cnpj_destinatario.startswith("00394460"): # CNPJ da União
-            ramo_especifico = "Órgão Público"
-            alertas.append("ALERTA SETOR PÚBLICO: Verificar regras de retenção de impostos federais (Lei 9.430/96).")
-            implicacoes.append("Tratamento fiscal diferenciado (imunidade/isenção) pode ser aplicável.")
-
-        # Exemplo de lógica para Terceiro Setor (simulação via CNAE)
-        cnae_emitente = dados_documento.get("cabecalho", {}).get("emitente_cnae")
-        if cnae_emitente and cnae_emitente.startswith("94"): # CNAE de Atividades de organizações associativas
-            ramo_especifico = "Terceiro Setor"
-            alertas.append("ALERTA TERCEIRO SETOR: Conferir se a entidade possui Certificado de Entidade Beneficente de Assistência Social (CEBAS).")
-            implicacoes.append("Imunidade de impostos federais (IRPJ, CSLL, PIS, COFINS) pode ser aplicável.")
+        # Ex.: órgãos públicos pelo CNPJ da União (00.394.460/...) e terceiro setor pelo CNAE 94.
+        # Quando mais de uma regra casa, vale o ramo da última.
+        for regra, _ in self.regras_setor.avaliar_documento("", dados_documento):
+            if regra.ramo_especifico:
+                ramo_especifico = regra.ramo_especifico
+            alertas.append(regra.alerta)
+            if regra.implicacao:
+                implicacoes.append(regra.implicacao)
 
         return {
             "ramo_especifico_detectado": ramo_especifico,
@@ -46,10 +46,7 @@ class CustomizacaoAgent(BaseAgent):
     def tratar_mudancas_legais(self, cfop: str) -> List[str]:
         """
         Simula a adaptação a mudanças legais. Na prática, isso seria um
-        mecanismo de atualização de regras externas.
+        mecanismo de atualização de regras externas: as regras ficam em
+        'regras_setoriais.json' e dependem apenas do CFOP, então são memorizadas.
         """
-        alertas = []
-        # Simulação: Se o CFOP for de um tipo que recentemente teve mudança de alíquota
-        if cfop == "5.405":
-            alertas.append("ATENÇÃO LEGAL: CFOP 5.405 (Venda de mercadoria sujeita a ST) - Verificar a última atualização da MVA para o estado de destino (Portaria XYZ/2024).")
-        return alertas
\ No newline at end of file
+        return list(self._alertas_por_cfop(cfop))
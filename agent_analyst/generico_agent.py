@@ -8,16 +8,23 @@ class GenericoAgent(BaseAgent):
     def __init__(self, ramo_empresa: str, data_dir: str = "data"):
         super().__init__(data_dir)
         self.ramo_empresa = ramo_empresa
-        self.ramo_config = self._carregar_json(self.data_dir / "ramos_atividade.json").get(ramo_empresa, {})
+        self._carregar_configuracao()
+
+    def _carregar_configuracao(self):
+        self.ramo_config = self._carregar_json(self.data_dir / "ramos_atividade.json").get(self.ramo_empresa, {})
+        self.motor_regras = self._carregar_regras(self.ramo_empresa)
+        # Implicações e recomendações dependem só da configuração do ramo: calculadas uma vez por carga.
+        self._implicacoes = tuple(self._analisar_implicacoes_fiscais())
+        self._recomendacoes = tuple(self._gerar_recomendacoes())
 
     def analisar_documento(self, cfop: str, dados_documento: Dict) -> Dict:
         """
         Realiza a análise fiscal genérica.
         """
         return {
-            "implicacoes_fiscais": self._analisar_implicacoes_fiscais(),
-            "recomendacoes_arquivamento": self._gerar_recomendacoes(),
-            "alertas_especificos": self._gerar_alertas_setoriais(cfop)
+            "implicacoes_fiscais": list(self._implicacoes),
+            "recomendacoes_arquivamento": list(self._recomendacoes),
+            "alertas_especificos": self._gerar_alertas_setoriais(cfop, dados_documento)
         }
 
     def _analisar_implicacoes_fiscais(self) -> List[str]:
@@ -40,12 +47,3 @@ class GenericoAgent(BaseAgent):
         if documentos:
             recomendacoes.append(f"Anexar os seguintes documentos de suporte: {', '.join(documentos)}.")
         return recomendacoes
-
-    def _gerar_alertas_setoriais(self, cfop: str) -> List[str]:
-        """Gera alertas específicos para o ramo."""
-        alertas = []
-        if self.ramo_empresa == 'comercio' and cfop == '5.405':
-            alertas.append("ALERTA COMÉRCIO: Venda de mercadoria com ICMS-ST. Assegurar que o imposto foi retido anteriormente.")
-        elif self.ramo_empresa == 'servicos' and cfop.startswith(('5.9', '6.9')):
-            alertas.append("ALERTA SERVIÇOS: Verificar retenção de impostos (IRRF, CSRF) na fonte.")
-        return alertas
@@ -7,15 +7,22 @@ class IndustriaAgent(BaseAgent):
 
     def __init__(self, data_dir: str = "data"):
         super().__init__(data_dir)
+        self._carregar_configuracao()
+
+    def _carregar_configuracao(self):
         self.ramo_config = self._carregar_json(self.data_dir / "ramos_atividade.json").get("industria", {})
+        self.motor_regras = self._carregar_regras("industria")
+        # Implicações e recomendações dependem só da configuração do ramo: calculadas uma vez por carga.
+        self._implicacoes = tuple(self._analisar_implicacoes_fiscais())
+        self._recomendacoes = tuple(self._gerar_recomendacoes())
 
     def analisar_documento(self, cfop: str, dados_documento: Dict) -> Dict:
         """
         Realiza a análise fiscal específica para a indústria.
         """
         return {
-            "implicacoes_fiscais": self._analisar_implicacoes_fiscais(),
-            "recomendacoes_arquivamento": self._gerar_recomendacoes(),
+            "implicacoes_fiscais": list(self._implicacoes),
+            "recomendacoes_arquivamento": list(self._recomendacoes),
             "alertas_especificos": self._gerar_alertas_setoriais(cfop, dados_documento)
         }
 
@@ -39,15 +46,3 @@ class IndustriaAgent(BaseAgent):
         if documentos:
             recomendacoes.append(f"Anexar os seguintes documentos de suporte: {', '.join(documentos)}.")
         return recomendacoes
-
-    def _gerar_alertas_setoriais(self, cfop: str, dados_documento: Dict) -> List[str]:
-        """Gera alertas específicos para a indústria."""
-        alertas = []
-        if cfop in ['5.401', '5.403', '5.405', '6.401', '6.403', '6.404']:
-            alertas.append("ALERTA INDÚSTRIA: Operação com Substituição Tributária (ICMS-ST). Conferir base de cálculo e MVA.")
-
-        # Exemplo de insumo para custo de produção
-        if cfop.startswith(('1.', '2.')) and any("matéria-prima" in item.get("descricao", "").lower() for item in dados_documento.get("itens", [])):
-            alertas.append("INFO INDÚSTRIA: Documento de entrada de matéria-prima. Insumo para cálculo de custo de produção.")
-
-        return alertas
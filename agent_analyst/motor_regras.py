@@ -0,0 +1,286 @@
+# agent_analyst/motor_regras.py
+import json
+import re
+from collections import defaultdict
+from pathlib import Path
+from typing import AbstractSet, Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+# Regras padrão distribuídas com o código; 'data/regras_setoriais.json' pode sobrescrevê-las.
+ARQUIVO_REGRAS_PADRAO = Path(__file__).parent / "regras_setoriais.json"
+ARQUIVO_REGRAS = "regras_setoriais.json"
+
+# Tipos de condição de uma regra. Dentro de uma condição basta um valor casar (OU);
+# entre condições diferentes, todas precisam casar (E).
+COND_CFOP = 'cfop'
+COND_CNPJ_DESTINATARIO = 'cnpj_destinatario'
+COND_CNAE_EMITENTE = 'cnae_emitente'
+COND_ITENS = 'itens'
+
+# Campo do documento lido por cada condição (além do CFOP).
+_CAMPOS_POR_CONDICAO = {
+    COND_CNPJ_DESTINATARIO: "cabecalho.destinatario_cpf_cnpj",
+    COND_CNAE_EMITENTE: "cabecalho.emitente_cnae",
+}
+
+
+class Regra(NamedTuple):
+    """Uma regra compilada. `ordem` é a posição no arquivo, que define a ordem dos alertas."""
+    ordem: int
+    id: str
+    alerta: str
+    implicacao: Optional[str]
+    ramo_especifico: Optional[str]
+    por_item: bool
+    item_sem_campo: Optional[str]
+    condicoes: frozenset
+
+
+def carregar_regras(data_dir: Path) -> List[Dict[str, Any]]:
+    """
+    Carrega as regras padrão e aplica as de '<data_dir>/regras_setoriais.json', se existir.
+    Uma regra do arquivo de dados com o mesmo `id` de uma padrão a substitui (ou a desliga
+    com `"ativa": false`); regras com `id` novo são acrescentadas ao final.
+    """
+    with open(ARQUIVO_REGRAS_PADRAO, 'r', encoding='utf-8') as f:
+        regras = {regra['id']: regra for regra in json.load(f)['regras']}
+
+    arquivo = Path(data_dir) / ARQUIVO_REGRAS
+    if arquivo.exists():
+        try:
+            with open(arquivo, 'r', encoding='utf-8') as f:
+                for regra in json.load(f).get('regras', []):
+                    regras[regra['id']] = regra
+        except (json.JSONDecodeError, KeyError) as e:
+            print(f"❌ Erro ao carregar o arquivo de regras {arquivo.name}: {e}. Usando as regras padrão.")
+
+    return [regra for regra in regras.values() if regra.get('ativa', True)]
+
+
+_NENHUMA: FrozenSet[int] = frozenset()
+# Marca de fim de palavra nos nós da trie de palavras-chave.
+_FIM = ''
+
+
+class _TabelaPrefixos:
+    """
+    Tabela de prefixos (trie achatada): um dicionário por comprimento de prefixo. A busca
+    faz uma consulta por comprimento distinto, não por prefixo cadastrado.
+    """
+
+    def __init__(self):
+        self._por_tamanho: Dict[int, Dict[str, FrozenSet[int]]] = {}
+        self._tamanhos: Tuple[int, ...] = ()
+
+    def adicionar(self, prefixo: str, ordem: int):
+        tabela = self._por_tamanho.setdefault(len(prefixo), {})
+        tabela[prefixo] = tabela.get(prefixo, _NENHUMA) | {ordem}
+        self._tamanhos = tuple(sorted(self._por_tamanho))
+
+    def buscar(self, valor: str) -> AbstractSet[int]:
+        encontradas = _NENHUMA
+        for tamanho in self._tamanhos:
+            if tamanho > len(valor):
+                break
+            ordens = self._por_tamanho[tamanho].get(valor[:tamanho])
+            if ordens:
+                encontradas = encontradas.union(ordens)
+        return encontradas
+
+    def __bool__(self):
+        return bool(self._tamanhos)
+
+
+def _padrao_trie(no: Dict[str, Any]) -> str:
+    """
+    Expressão regular com a forma da trie das palavras-chave: em cada nó os ramos diferem
+    no primeiro caractere, então o custo por posição do texto depende do comprimento das
+    palavras e não de quantas existem (ao contrário de uma alternância 'a|b|c|...').
+    """
+    ramos = [re.escape(caractere) + _padrao_trie(filho) for caractere, filho in sorted(no.items())
+             if caractere != _FIM]
+    if not ramos:
+        return ''
+    corpo = ramos[0] if len(ramos) == 1 else '(?:' + '|'.join(ramos) + ')'
+    # Num nó que termina uma palavra, o resto é opcional (guloso: prefere a palavra mais longa).
+    return f'(?:{corpo})?' if _FIM in no else corpo
+
+
+class MotorRegras:
+    """
+    Motor de regras setoriais declarativas, compilado na carga em tabelas de despacho.
+
+    Cada regra pertence a um agente (`"agente"`) e tem um alerta e uma ou mais condições:
+      - `cfops` / `cfop_prefixos`: CFOP exato ou por prefixo;
+      - `cnpj_destinatario_prefixos` e `cnae_emitente_prefixos`: prefixos;
+      - `itens_contem`: palavras-chave na descrição de algum item; opcionalmente
+        `item_sem_campo` (o item não tem o campo) e `por_item` (um alerta por item, com
+        `{campo}` do item no texto).
+
+    Os CFOPs exatos ficam em uma tabela hash, os prefixos em tabelas hash por comprimento
+    e as palavras-chave em uma única expressão com a forma de uma trie. Cada tabela devolve
+    só as regras satisfeitas, e uma regra casa quando foi devolvida por todas as suas
+    condições; assim o custo por documento depende das regras que casam, e não de quantas
+    estão cadastradas. Regras só de CFOP ficam em `alertas_cfop` (memorizável por CFOP);
+    as demais em `avaliar_documento`.
+    """
+
+    def __init__(self, regras: Iterable[Dict[str, Any]], agente: str):
+        self.agente = agente
+        self.regras: List[Regra] = []
+        self._cfop_exato: Dict[str, FrozenSet[int]] = {}
+        self._cfop_prefixos = _TabelaPrefixos()
+        self._prefixos_cabecalho = {COND_CNPJ_DESTINATARIO: _TabelaPrefixos(), COND_CNAE_EMITENTE: _TabelaPrefixos()}
+        # Trie das palavras-chave (minúsculas); o nó que termina uma palavra guarda suas regras.
+        self._trie_palavras: Dict[str, Any] = {}
+
+        for definicao in regras:
+            if definicao.get('agente') == agente:
+                self._compilar(definicao)
+        self._compilar_palavras()
+
+        self._so_cfop = frozenset(regra.ordem for regra in self.regras if regra.condicoes == {COND_CFOP})
+        self._de_documento = frozenset(regra.ordem for regra in self.regras if regra.condicoes != {COND_CFOP})
+        condicoes_documento = set().union(*(self.regras[i].condicoes for i in self._de_documento))
+        self._cfop_no_documento = COND_CFOP in condicoes_documento
+        # (campo do cabeçalho, tabela de prefixos) das condições de cabeçalho em uso.
+        self._condicoes_cabecalho = tuple(
+            (_CAMPOS_POR_CONDICAO[condicao].split('.', 1)[1], prefixos)
+            for condicao, prefixos in self._prefixos_cabecalho.items() if condicao in condicoes_documento
+        )
+
+        campos = [_CAMPOS_POR_CONDICAO[c] for c in (COND_CNPJ_DESTINATARIO, COND_CNAE_EMITENTE)
+                  if c in condicoes_documento]
+        if COND_ITENS in condicoes_documento:
+            campos.append("itens.descricao")
+            campos.extend(sorted({f"itens.{self.regras[i].item_sem_campo}" for i in self._de_documento
+                                  if self.regras[i].item_sem_campo}))
+        # Campos do documento que as regras leem; vazio quando todas dependem só do CFOP.
+        self.campos_documento: Tuple[str, ...] = tuple(campos)
+
+    def _compilar(self, definicao: Dict[str, Any]):
+        ordem = len(self.regras)
+        condicoes = set()
+
+        for cfop in definicao.get('cfops', []):
+            self._cfop_exato[cfop] = self._cfop_exato.get(cfop, _NENHUMA) | {ordem}
+            condicoes.add(COND_CFOP)
+        for prefixo in definicao.get('cfop_prefixos', []):
+            self._cfop_prefixos.adicionar(prefixo, ordem)
+            condicoes.add(COND_CFOP)
+        for condicao in (COND_CNPJ_DESTINATARIO, COND_CNAE_EMITENTE):
+            for prefixo in definicao.get(f"{condicao}_prefixos", []):
+                self._prefixos_cabecalho[condicao].adicionar(prefixo, ordem)
+                condicoes.add(condicao)
+        for palavra in definicao.get('itens_contem', []):
+            if not palavra:
+                raise ValueError(f"Regra '{definicao.get('id')}' tem uma palavra-chave vazia.")
+            no = self._trie_palavras
+            for caractere in palavra.lower():
+                no = no.setdefault(caractere, {})
+            no[_FIM] = no.get(_FIM, _NENHUMA) | {ordem}
+            condicoes.add(COND_ITENS)
+
+        if not condicoes:
+            raise ValueError(f"Regra '{definicao.get('id')}' não tem nenhuma condição.")
+        if (definicao.get('por_item') or definicao.get('item_sem_campo')) and COND_ITENS not in condicoes:
+            raise ValueError(f"Regra '{definicao.get('id')}' usa condições de item sem 'itens_contem'.")
+
+        self.regras.append(Regra(
+            ordem=ordem,
+            id=definicao['id'],
+            alerta=definicao['alerta'],
+            implicacao=definicao.get('implicacao'),
+            ramo_especifico=definicao.get('ramo_especifico'),
+            por_item=bool(definicao.get('por_item')),
+            item_sem_campo=definicao.get('item_sem_campo'),
+            condicoes=frozenset(condicoes),
+        ))
+
+    def _compilar_palavras(self):
+        # Palavra -> regras dela e das palavras que são prefixo dela: na posição em que a
+        # expressão casa a palavra mais longa, as mais curtas do mesmo caminho também casam.
+        self._regras_da_palavra: Dict[str, FrozenSet[int]] = {}
+        self._expressao_itens: Optional[re.Pattern] = None
+        if not self._trie_palavras:
+            return
+
+        pilha = [(self._trie_palavras, '', _NENHUMA)]
+        while pilha:
+            no, palavra, herdadas = pilha.pop()
+            if _FIM in no:
+                herdadas = herdadas | no[_FIM]
+                self._regras_da_palavra[palavra] = herdadas
+            pilha.extend((filho, palavra + caractere, herdadas) for caractere, filho in no.items() if caractere != _FIM)
+        padrao = _padrao_trie(self._trie_palavras)
+        # Sem lookahead para a triagem (o re acelera a busca pelo primeiro caractere); com
+        # lookahead para testar todas as posições, inclusive as sobrepostas a uma ocorrência.
+        self._triagem_itens = re.compile(padrao)
+        self._expressao_itens = re.compile(f"(?=({padrao}))")
+
+    def _regras_do_cfop(self, cfop: str) -> AbstractSet[int]:
+        exatas = self._cfop_exato.get(cfop, _NENHUMA)
+        por_prefixo = self._cfop_prefixos.buscar(cfop)
+        return exatas | por_prefixo if por_prefixo else exatas
+
+    def alertas_cfop(self, cfop: str) -> Tuple[str, ...]:
+        """Alertas das regras que dependem apenas do CFOP, na ordem do arquivo."""
+        if not self._so_cfop:
+            return ()
+        return tuple(self.regras[i].alerta for i in sorted(self._so_cfop.intersection(self._regras_do_cfop(cfop))))
+
+    def _itens_por_regra(self, dados_documento: Dict) -> Dict[int, List[Dict]]:
+        """Regra de item -> itens do documento que casaram com ela."""
+        itens = dados_documento.get("itens", [])
+        descricoes = [item.get("descricao", "").lower() for item in itens]
+        itens_por_regra: Dict[int, List[Dict]] = {}
+        # Uma busca no texto de todos os itens descarta de uma vez o caso comum (nenhuma palavra).
+        if not self._triagem_itens.search("\0".join(descricoes)):
+            return itens_por_regra
+        for item, descricao in zip(itens, descricoes):
+            regras_item = set()
+            for palavra in self._expressao_itens.findall(descricao):
+                regras_item.update(self._regras_da_palavra[palavra])
+            for ordem in sorted(regras_item):
+                campo = self.regras[ordem].item_sem_campo
+                if campo is None or item.get(campo) is None:
+                    itens_por_regra.setdefault(ordem, []).append(item)
+        return itens_por_regra
+
+    def avaliar_documento(self, cfop: str, dados_documento: Dict) -> List[Tuple[Regra, Optional[Dict]]]:
+        """
+        Regras que dependem do documento e casam com ele, na ordem do arquivo:
+        (regra, item) para as regras por item e (regra, None) para as demais.
+        """
+        if not self._de_documento:
+            return []
+
+        # Regra -> quantas de suas condições foram satisfeitas.
+        satisfeitas: Dict[int, int] = {}
+        if self._cfop_no_documento:
+            for ordem in self._regras_do_cfop(cfop):
+                satisfeitas[ordem] = satisfeitas.get(ordem, 0) + 1
+        if self._condicoes_cabecalho:
+            cabecalho = dados_documento.get("cabecalho", {})
+            for campo, prefixos in self._condicoes_cabecalho:
+                valor = cabecalho.get(campo)
+                for ordem in (prefixos.buscar(valor) if valor else _NENHUMA):
+                    satisfeitas[ordem] = satisfeitas.get(ordem, 0) + 1
+        itens_por_regra = self._itens_por_regra(dados_documento) if self._expressao_itens is not None else {}
+        for ordem in itens_por_regra:
+            satisfeitas[ordem] = satisfeitas.get(ordem, 0) + 1
+
+        resultado = []
+        for ordem in sorted(satisfeitas):
+            regra = self.regras[ordem]
+            if satisfeitas[ordem] != len(regra.condicoes) or ordem not in self._de_documento:
+                continue
+            if regra.por_item:
+                resultado.extend((regra, item) for item in itens_por_regra[ordem])
+            else:
+                resultado.append((regra, None))
+        return resultado
+
+    def alertas_documento(self, cfop: str, dados_documento: Dict) -> List[str]:
+        """Textos dos alertas de `avaliar_documento` (o das regras por item com os campos do item)."""
+        return [regra.alerta.format_map(defaultdict(str, item)) if item is not None else regra.alerta
+                for regra, item in self.avaliar_documento(cfop, dados_documento)]
@@ -1,12 +1,33 @@
+from functools import partial, wraps
 from pathlib import Path
-from typing import Dict, Any
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, NamedTuple, Optional, Set, Tuple, Union
 import os
 import shutil
+import threading
+import time
+from contextlib import nullcontext
 from datetime import datetime
 
 # Importa os extratores modulares. O orquestrador delega a tarefa de extração,
 # mantendo seu próprio código focado no fluxo de trabalho.
 from tools.data_extractor import extract_from_xml, extract_data_from_pdf
+from tools.document_source import DocumentSource
+from tools.document_model import DocumentoFiscal
+from tools.batch_inputs import EntradaLote, is_arquivo_compactado, iterar_entradas_lote, listar_entradas_lote
+from tools.batch_aggregates import AgregadosLote
+from tools.notes_index import IndiceNotas
+from tools.batch_journal import DiarioLote, assinatura_arquivo
+from tools.work_queue import FilaTrabalho, Tarefa, identificar_trabalhador
+from tools.batch_scheduler import EscalonadorLote, FAIXA_OCR
+from tools.note_bundles import PacotesNotas, caminho_pacote, chave_conteudo, is_destino_pacote, ler_destino, separar_destino
+from tools.extraction_store import ArmazemExtracoes, ExtracaoArmazenada, chaves_alteradas, impressao_digital
+from tools.value_anomalies import DetectorAnomalias, HistoricoCompartilhado
+from tools.xml_prefetch import ler_cabecalho, planejar_documentos
+from tools.resource_governor import GovernadorRecursos
+from tools.run_profiler import CapturaPerfil
+from agent_analyst.motor_regras import carregar_regras
+from agent_analyst.base_agent import BaseAgent
 from agent_analyst.cfop_classifier_agent import CFOPClassifierAgent
 from agent_analyst.agronegocio_agent import AgronegocioAgent
 from agent_analyst.automotivo_agent import AutomotivoAgent
@@ -15,45 +36,147 @@ from agent_analyst.generico_agent import GenericoAgent
 from agent_analyst.customizacao_agent import CustomizacaoAgent
 
 
+# Banco SQLite (em 'output/') com o controle dos lotes processados.
+ARQUIVO_CONTROLE_LOTES = "controle_lotes.db"
+# Índice de busca (em 'output/') das notas organizadas.
+ARQUIVO_INDICE_NOTAS = "indice_notas.db"
+# Pasta (em 'output/') dos relatórios finais de cada lote.
+PASTA_RELATORIOS = "relatorios"
+# Fila de trabalho (em 'output/') dos lotes distribuídos entre vários trabalhadores.
+ARQUIVO_FILA_LOTE = "fila_lote.db"
+# Extrações persistidas (em 'output/'), reclassificadas quando a configuração muda.
+ARQUIVO_EXTRACOES = "extracoes.db"
+# Versão da lógica de classificação: incrementar quando uma mudança no código alterar os
+# resultados, para que `reclassificar_extracoes` refaça todas as classificações guardadas.
+VERSAO_CLASSIFICACAO = 1
+# Histórico (em 'output/') dos valores por emitente, CFOP e produto, usado na detecção de anomalias.
+ARQUIVO_ESTATISTICAS_VALORES = "estatisticas_valores.npz"
+# Quantos documentos do lote são pontuados juntos (de forma vetorizada) contra o histórico.
+TAMANHO_GRUPO_ANOMALIAS = 256
+
+
+def _serializar_saida(metodo):
+    """Executa o método com a trava de 'output/' da instância (um lote, trabalhador ou reclassificação por vez)."""
+    @wraps(metodo)
+    def envolvido(self, *args, **kwargs):
+        with self._trava_saida:
+            return metodo(self, *args, **kwargs)
+    return envolvido
+
+
+class EstadoConfiguracao(NamedTuple):
+    """
+    Configuração carregada de uma vez: agentes (com a tabela de CFOPs, ramos, centros de custo e
+    regras), mapa CNAE -> ramo e o instantâneo da configuração (ver `_instantaneo_configuracao`).
+    Nunca é alterada depois de montada; `recarregar_configuracao` monta outra e troca a referência.
+    """
+    classifier_agent: CFOPClassifierAgent
+    agentes_especializados: Mapping[str, BaseAgent]
+    cnae_ramo_map: Mapping[str, str]
+    instantaneo: Mapping[str, str]
+
+
 class OrchestratorAgent:
     """
     Agente Orquestrador.
     Sua principal responsabilidade é gerenciar o fluxo de processamento de um documento fiscal,
     seja individualmente ou em lote, coordenando a extração, inferência e classificação.
+
+    Uma instância pode ser compartilhada entre threads (pool de threads, sessões do Streamlit):
+    - as pastas de dados e de saída são caminhos absolutos fixados na criação, independentes
+      do diretório de trabalho corrente;
+    - a configuração carregada fica em um `EstadoConfiguracao` imutável. Cada classificação lê
+      a referência uma vez e usa o mesmo estado do início ao fim, mesmo que outra thread
+      recarregue a configuração no meio; um lote usa o estado em vigor quando começou;
+    - os resultados são montados a cada chamada, sem listas ou dicionários compartilhados
+      (os registros da tabela de CFOPs, compartilhados, são somente leitura);
+    - operações que gravam em 'output/' (lotes, trabalhador, consolidação, reclassificação)
+      são serializadas entre as threads da instância.
     """
 
-    def __init__(self):
+    def __init__(self, data_dir: Optional[Union[str, Path]] = None, output_dir: Optional[Union[str, Path]] = None):
         """
         Inicializa o orquestrador, criando uma instância do agente classificador
         e carregando os dados de CFOP necessários para a operação.
+        `data_dir` e `output_dir` (padrão: 'data' e 'output' no diretório atual) são
+        resolvidos para caminhos absolutos aqui; a entrada do lote é '<data_dir>/notas'.
         """
-        self.classifier_agent = CFOPClassifierAgent(data_dir="data")
+        self.data_dir = Path(data_dir or "data").resolve()
+        self.input_dir = self.data_dir / "notas"
+        self.output_dir = Path(output_dir or "output").resolve()
+        self._trava_configuracao = threading.Lock()
+        self._trava_saida = threading.RLock()
         # Carrega os dados do CFOP uma única vez na inicialização para otimizar o desempenho.
-        self.classifier_agent.carregar_dados_cfop(self._get_latest_cfop_file())
+        self._estado = self._carregar_estado()
+
+    @property
+    def estado(self) -> EstadoConfiguracao:
+        """Configuração em vigor (a referência é trocada inteira por `recarregar_configuracao`)."""
+        return self._estado
+
+    @property
+    def classifier_agent(self) -> CFOPClassifierAgent:
+        return self._estado.classifier_agent
+
+    @property
+    def agentes_especializados(self) -> Mapping[str, BaseAgent]:
+        return self._estado.agentes_especializados
+
+    @property
+    def cnae_ramo_map(self) -> Mapping[str, str]:
+        return self._estado.cnae_ramo_map
+
+    def _carregar_estado(self) -> EstadoConfiguracao:
+        """Lê todos os arquivos de configuração em agentes novos e monta um estado imutável."""
+        data_dir = str(self.data_dir)
+        classifier_agent = CFOPClassifierAgent(data_dir=data_dir)
+        classifier_agent.carregar_dados_cfop(self._get_latest_cfop_file(classifier_agent))
 
         # Inicializa os agentes especializados
-        self.agentes_especializados = {
-            "agronegocio": AgronegocioAgent(data_dir="data"),
-            "automotivo": AutomotivoAgent(data_dir="data"),
-            "industria": IndustriaAgent(data_dir="data"),
-            "customizacao": CustomizacaoAgent(data_dir="data"),
-            "comercio": GenericoAgent(ramo_empresa="comercio", data_dir="data"),
-            "servicos": GenericoAgent(ramo_empresa="servicos", data_dir="data"),
-        }
-        self.cnae_ramo_map = self.classifier_agent._carregar_json(Path("data/cnae_ramo_map.json"))
+        agentes_especializados = MappingProxyType({
+            "agronegocio": AgronegocioAgent(data_dir=data_dir),
+            "automotivo": AutomotivoAgent(data_dir=data_dir),
+            "industria": IndustriaAgent(data_dir=data_dir),
+            "customizacao": CustomizacaoAgent(data_dir=data_dir),
+            "comercio": GenericoAgent(ramo_empresa="comercio", data_dir=data_dir),
+            "servicos": GenericoAgent(ramo_empresa="servicos", data_dir=data_dir),
+        })
+        cnae_ramo_map = MappingProxyType(classifier_agent._carregar_json(self.data_dir / "cnae_ramo_map.json"))
+        instantaneo = self._instantaneo_configuracao(classifier_agent, cnae_ramo_map)
+        return EstadoConfiguracao(classifier_agent, agentes_especializados, cnae_ramo_map,
+                                  MappingProxyType(instantaneo))
+
+    def recarregar_configuracao(self) -> EstadoConfiguracao:
+        """
+        Relê os arquivos de configuração (tabela de CFOPs, ramos, centros de custo, mapa CNAE, regras
+        setoriais) em um estado novo, com os agentes setoriais sem resultados memorizados, e o põe
+        em vigor. Classificações em andamento terminam com o estado anterior.
+        """
+        with self._trava_configuracao:
+            self._estado = self._carregar_estado()
+            return self._estado
 
-    def _get_latest_cfop_file(self) -> str:
+    def _get_latest_cfop_file(self, classifier_agent: CFOPClassifierAgent) -> str:
         """
-        Encontra o arquivo de dados CFOP mais recente gerado pelo crawler.
-        Isso garante que a aplicação sempre use os dados mais atualizados.
+        Encontra o arquivo de dados CFOP vigente gerado pelo crawler.
+        Usa o ponteiro estável 'cfop_atual.json' mantido pelo crawler, preferindo o
+        artefato SQLite pré-normalizado ao CSV; a varredura de todos os
+        'cfop_confaz_*.csv' fica apenas como fallback para bases antigas.
         """
-        data_dir = Path("data")
-        # Procura por arquivos CSV, que é o formato preferencial para o pandas.
+        data_dir = self.data_dir
+        ponteiro_path = data_dir / "cfop_atual.json"
+        if ponteiro_path.is_file():
+            ponteiro = classifier_agent._carregar_json(ponteiro_path)
+            for formato in ('sqlite', 'csv'):
+                if ponteiro.get(formato) and (data_dir / ponteiro[formato]).is_file():
+                    return ponteiro[formato]
+
+        # Procura pelos arquivos CSV gerados antes da existência do ponteiro.
         cfop_files = list(data_dir.glob("cfop_confaz_*.csv"))
         if not cfop_files:
             # Lança um erro claro se os dados essenciais não existirem.
             raise FileNotFoundError(
-                "Nenhum arquivo de dados CFOP (.csv) encontrado na pasta 'data'. "
+                f"Nenhum arquivo de dados CFOP (.csv) encontrado na pasta '{data_dir}'. "
                 "Por favor, execute o 'tools/crawler.py' primeiro."
             )
 
@@ -61,60 +184,175 @@ class OrchestratorAgent:
         latest_file = max(cfop_files, key=lambda p: p.stat().st_mtime)
         return latest_file.name
 
-    def _inferir_ramo_atividade(self, dados_extraidos: Dict) -> str:
+    def _inferir_ramo_atividade(self, dados_extraidos: Dict, estado: Optional[EstadoConfiguracao] = None) -> str:
         """
         Tenta inferir o ramo de atividade da empresa a partir dos dados do documento.
         Utiliza o CNAE como fonte primária e o CFOP como fallback.
         """
+        ramo, estrategia, pista = self._detectar_ramo(dados_extraidos, estado=estado)
+        if estrategia == 'cnae':
+            print(f'✅ Ramo detectado via CNAE ({pista}): {ramo}')
+        elif estrategia == 'cfop':
+            print(f'✅ Ramo detectado via CFOP ({pista}): {ramo}')
+        else:
+            print(f'⚠️ Não foi possível detectar o ramo via CNAE ou CFOP. Usando \'{ramo}\' como padrão.')
+        return ramo
+
+    def _detectar_ramo(self, dados_extraidos: Dict, dependencias: Optional[Set[str]] = None,
+                       estado: Optional[EstadoConfiguracao] = None) -> Tuple[str, str, Optional[str]]:
+        """
+        Detecção do ramo, sem mensagens: retorna (ramo, estratégia, pista), com a estratégia
+        'cnae', 'cfop' ou 'padrao'. Se `dependencias` for informado, recebe as chaves de
+        configuração consultadas (ver `_instantaneo_configuracao`).
+        """
+        estado = estado or self._estado
+        dependencias = set() if dependencias is None else dependencias
         cabecalho = dados_extraidos.get('cabecalho', {})
         cnae = cabecalho.get('emitente_cnae')
 
         # Estratégia 1: Usar o CNAE (o método mais confiável).
-        if cnae and self.cnae_ramo_map:
+        if cnae:
             # Pega os 2 primeiros dígitos do CNAE
             cnae_prefix = cnae[:2]
-            ramo_detectado = self.cnae_ramo_map.get(cnae_prefix)
+            dependencias.add(f"cnae:{cnae_prefix}")
+            ramo_detectado = estado.cnae_ramo_map.get(cnae_prefix)
             if ramo_detectado:
-                print(f'✅ Ramo detectado via CNAE ({cnae_prefix}): {ramo_detectado}')
-                return ramo_detectado
+                return ramo_detectado, 'cnae', cnae_prefix
 
         # Estratégia 2: Usar o CFOP como pista (fallback).
         primeiro_item = dados_extraidos.get("itens", [{}])[0]
         cfop_str = primeiro_item.get("cfop", "")
         if cfop_str:
-            cfop_normalizado = self.classifier_agent._normalize_cfop(cfop_str)
-            for ramo, config in self.classifier_agent.ramos_atividade.items():
+            cfop_normalizado = estado.classifier_agent._normalize_cfop(cfop_str)
+            dependencias.add(f"ramo_por_cfop:{cfop_normalizado}")
+            for ramo, config in estado.classifier_agent.ramos_atividade.items():
                 cfops_comuns = config.get('cfops_entrada_comuns', []) + config.get('cfops_saida_comuns', [])
                 if cfop_normalizado in cfops_comuns:
-                    print(f'✅ Ramo detectado via CFOP ({cfop_normalizado}): {ramo}')
-                    return ramo
+                    return ramo, 'cfop', cfop_normalizado
 
         # Estratégia 3: Se nada funcionar, retorna o padrão definido no mapa.
-        ramo_padrao = self.cnae_ramo_map.get("default", "comercio")
-        print(f'⚠️ Não foi possível detectar o ramo via CNAE ou CFOP. Usando \'{ramo_padrao}\' como padrão.')
-        return ramo_padrao
+        dependencias.add("cnae:default")
+        return estado.cnae_ramo_map.get("default", "comercio"), 'padrao', None
 
-    def processar_documento(self, file_path: str) -> Dict[str, Any]:
+    def _dependencias_classificacao(self, dados_extraidos: Dict,
+                                    estado: Optional[EstadoConfiguracao] = None) -> Set[str]:
+        """
+        Chaves de configuração que a classificação do documento lê: as da detecção do ramo,
+        o registro do CFOP, a configuração do ramo e dos seus centros de custo prioritários e
+        as regras do agente do ramo e do agente de customização. Uma reclassificação só é
+        necessária quando alguma delas muda.
+        """
+        estado = estado or self._estado
+        dependencias = {"codigo:classificacao", "regras:setor_especifico", "regras:mudancas_legais"}
+        ramo, _, _ = self._detectar_ramo(dados_extraidos, dependencias, estado)
+        cfop = dados_extraidos.get("itens", [{}])[0].get("cfop")
+        if cfop:
+            ramo_config = estado.classifier_agent.ramos_atividade.get(ramo, {})
+            dependencias.update((f"cfop:{estado.classifier_agent._normalize_cfop(cfop)}",
+                                 f"ramo:{ramo}", f"regras:{ramo}"))
+            dependencias.update(f"centro:{centro}" for centro in ramo_config.get('centros_custo_prioritarios', []))
+        return dependencias
+
+    def _instantaneo_configuracao(self, classifier_agent: CFOPClassifierAgent,
+                                  cnae_ramo_map: Mapping[str, str]) -> Dict[str, str]:
+        """
+        Impressão digital de cada parte da configuração que a classificação pode ler, com as
+        mesmas chaves de `_dependencias_classificacao` (ex.: 'cfop:5.102' é o registro desse CFOP
+        e 'ramo_por_cfop:1.101' o primeiro ramo que o lista entre os seus CFOPs comuns).
+        """
+        instantaneo = {"codigo:classificacao": str(VERSAO_CLASSIFICACAO)}
+        for cfop, registro in (classifier_agent.cfop_data or {}).items():
+            instantaneo[f"cfop:{cfop}"] = impressao_digital(registro)
+        for prefixo, ramo in cnae_ramo_map.items():
+            instantaneo[f"cnae:{prefixo}"] = impressao_digital(ramo)
+        ramo_por_cfop = {}
+        for ramo, config in classifier_agent.ramos_atividade.items():
+            instantaneo[f"ramo:{ramo}"] = impressao_digital(config)
+            for cfop in config.get('cfops_entrada_comuns', []) + config.get('cfops_saida_comuns', []):
+                ramo_por_cfop.setdefault(cfop, ramo)
+        for cfop, ramo in ramo_por_cfop.items():
+            instantaneo[f"ramo_por_cfop:{cfop}"] = impressao_digital(ramo)
+        for centro, config in (classifier_agent.centros_custo or {}).items():
+            instantaneo[f"centro:{centro}"] = impressao_digital(config)
+        regras_por_agente: Dict[str, list] = {}
+        for regra in carregar_regras(self.data_dir):
+            regras_por_agente.setdefault(regra.get('agente', ''), []).append(regra)
+        for agente, regras in regras_por_agente.items():
+            instantaneo[f"regras:{agente}"] = impressao_digital(regras)
+        return instantaneo
+
+    def processar_documento(self, file_path: str, perfilar: bool = False,
+                            perfilar_memoria: bool = False) -> Dict[str, Any]:
         """
         Método que coordena o processamento de um ÚNICO documento fiscal.
         É utilizado pelo dashboard para análises individuais.
+        Com `perfilar`, captura o perfil da análise (ver `_processar_com_perfil`).
+        """
+        return self._processar_com_perfil(Path(file_path).name, file_path, perfilar, perfilar_memoria)
+
+    def processar_conteudo(self, nome_arquivo: str, conteudo: DocumentSource, perfilar: bool = False,
+                           perfilar_memoria: bool = False) -> Dict[str, Any]:
+        """
+        Processa um documento que já está em memória (ex.: upload do dashboard).
+        O conteúdo pode ser bytes, bytearray, memoryview, mmap ou um objeto de arquivo.
+        O tipo é decidido pela extensão do nome e o conteúdo nunca é gravado em disco.
+        Com `perfilar`, captura o perfil da análise (ver `_processar_com_perfil`).
+        """
+        return self._processar_com_perfil(nome_arquivo, conteudo, perfilar, perfilar_memoria)
+
+    def _processar_com_perfil(self, nome_arquivo: str, fonte, perfilar: bool,
+                              perfilar_memoria: bool) -> Dict[str, Any]:
+        """
+        Processa um único documento. Com `perfilar`, a análise roda sob uma `CapturaPerfil`
+        (cProfile e pilhas amostradas; com `perfilar_memoria`, também o tracemalloc), salva em
+        'output/relatorios/perfil_documento_<data>_<nome>.*', e os arquivos vão em 'perfil'.
         """
-        file_path_obj = Path(file_path)
+        extensao = Path(nome_arquivo).suffix
+        if not perfilar:
+            return self._processar_fonte(extensao, fonte)
+
+        nome = f"documento_{datetime.now():%Y%m%d_%H%M%S_%f}_{Path(nome_arquivo).stem}"
+        with CapturaPerfil(self.output_dir / PASTA_RELATORIOS, nome, memoria=perfilar_memoria) as captura:
+            resultado = self._processar_fonte(extensao, fonte)
+        return {**resultado, "perfil": captura.arquivos}
+
+    def _processar_fonte(self, extensao: str, fonte, permitir_ocr: bool = True,
+                         prazo: Optional[float] = None,
+                         estado: Optional[EstadoConfiguracao] = None,
+                         governador: Optional[GovernadorRecursos] = None) -> Dict[str, Any]:
+        """
+        Extrai os dados da fonte (caminho ou conteúdo em memória) e executa a classificação completa.
+        `permitir_ocr`, `prazo` e `governador` valem para PDFs (ver `extract_data_from_pdf`). Sem `estado`,
+        usa a configuração em vigor; a tabela de CFOPs dela valida os campos lidos por OCR.
+        """
+        estado = estado or self._estado
         dados_extraidos = {}
 
         # Delega a extração ao módulo correto com base na extensão do arquivo.
-        if file_path_obj.suffix.lower() == '.xml':
-            dados_extraidos = extract_from_xml(file_path)
-        elif file_path_obj.suffix.lower() == '.pdf':
-            dados_extraidos = extract_data_from_pdf(file_path)
+        if extensao.lower() == '.xml':
+            dados_extraidos = extract_from_xml(fonte)
+        elif extensao.lower() == '.pdf':
+            dados_extraidos = extract_data_from_pdf(fonte, permitir_ocr=permitir_ocr, prazo=prazo,
+                                                    cfops_validos=estado.classifier_agent.cfop_data,
+                                                    governador=governador)
         else:
-            return {"erro": f"Formato de arquivo '{file_path_obj.suffix}' não suportado. Use XML ou PDF."}
+            return {"erro": f"Formato de arquivo '{extensao}' não suportado. Use XML ou PDF."}
 
         # Se a extração falhou, propaga o erro para a interface.
         if "erro" in dados_extraidos:
             return dados_extraidos
 
-        ramo_detectado = self._inferir_ramo_atividade(dados_extraidos)
+        return self._classificar_extracao(dados_extraidos, estado)
+
+    def _classificar_extracao(self, dados_extraidos,
+                              estado: Optional[EstadoConfiguracao] = None) -> Dict[str, Any]:
+        """
+        Classifica um documento já extraído (ramo, classificação base e análises setoriais).
+        É a etapa refeita por `reclassificar_extracoes` a partir das extrações guardadas.
+        """
+        # Lê a referência uma única vez: uma recarga em outra thread não afeta este documento.
+        estado = estado or self._estado
+        ramo_detectado = self._inferir_ramo_atividade(dados_extraidos, estado)
         primeiro_item = dados_extraidos.get("itens", [{}])[0]
         cfop = primeiro_item.get("cfop")
 
@@ -122,14 +360,16 @@ class OrchestratorAgent:
             return {"erro": "Não foi possível encontrar um CFOP no documento para iniciar a classificação."}
 
         # 1. Classificação base (CFOP, Centro de Custo, Tipo Documento)
-        resultado_classificacao = self.classifier_agent.classificar_documento(
+        resultado_classificacao = estado.classifier_agent.classificar_documento(
             cfop=cfop,
             ramo_empresa=ramo_detectado,
             dados_documento=dados_extraidos
         )
+        if "erro" in resultado_classificacao:
+            return {"dados_do_documento": dados_extraidos, "analise_classificacao": resultado_classificacao}
 
         # 2. Análise setorial customizada pelo agente especializado
-        agente_setorial = self.agentes_especializados.get(ramo_detectado)
+        agente_setorial = estado.agentes_especializados.get(ramo_detectado)
         if agente_setorial:
             analise_setorial = agente_setorial.analisar_documento(
                 cfop=cfop,
@@ -141,16 +381,23 @@ class OrchestratorAgent:
             print(f'⚠️ Agente especializado para \'{ramo_detectado}\' não encontrado. Usando classificação base.')
 
         # 3. Análise de customização (setores específicos e mudanças legais)
-        agente_customizacao = self.agentes_especializados.get("customizacao")
+        agente_customizacao = estado.agentes_especializados.get("customizacao")
         analise_customizacao = agente_customizacao.analisar_setor_especifico(dados_extraidos)
 
         # Adiciona alertas de mudanças legais
         alertas_legais = agente_customizacao.tratar_mudancas_legais(cfop)
 
-        # Mescla os resultados da customização
-        resultado_classificacao['alertas_especificos'].extend(analise_customizacao['alertas_customizados'])
-        resultado_classificacao['implicacoes_fiscais'].extend(analise_customizacao['implicacoes_customizadas'])
-        resultado_classificacao['alertas_especificos'].extend(alertas_legais)
+        # Mescla os resultados da customização em listas novas: as listas recebidas dos
+        # agentes nunca são alteradas no lugar.
+        resultado_classificacao['alertas_especificos'] = [
+            *resultado_classificacao['alertas_especificos'],
+            *analise_customizacao['alertas_customizados'],
+            *alertas_legais,
+        ]
+        resultado_classificacao['implicacoes_fiscais'] = [
+            *resultado_classificacao['implicacoes_fiscais'],
+            *analise_customizacao['implicacoes_customizadas'],
+        ]
         resultado_classificacao['ramo_especifico_customizado'] = analise_customizacao['ramo_especifico_detectado']
 
         # Consolida os dados e a análise em um único objeto de resposta.
@@ -159,70 +406,737 @@ class OrchestratorAgent:
             "analise_classificacao": resultado_classificacao
         }
 
-    def processar_lote_notas(self) -> Dict[str, Any]:
+    @_serializar_saida
+    def processar_lote_notas(self, retomar: bool = True, em_pacotes: bool = False,
+                             governador: Optional[GovernadorRecursos] = None,
+                             perfilar: bool = False, perfilar_memoria: bool = False) -> Dict[str, Any]:
         """
-        Processa todos os arquivos .xml e .pdf da pasta 'data/notas',
-        classifica-os e os copia para uma estrutura de pastas organizada em 'output/'.
+        Processa todos os arquivos .xml e .pdf da pasta 'data/notas' (soltos ou dentro de
+        arquivos .zip/.tar), classifica-os e os copia para uma estrutura de pastas organizada em 'output/'.
+        Os membros dos arquivos compactados são lidos como streams, sem extração para o disco.
+
+        O progresso é gravado em um diário (em 'output/controle_lotes.db') a cada grupo de
+        documentos. Se um lote anterior desta pasta foi interrompido e `retomar` é True, ele
+        continua com o mesmo run_id, pulando os documentos já concluídos. Ao final, o relatório
+        do lote é salvo em 'output/relatorios/lote_<run_id>.json'.
+
+        Os valores de cada grupo de documentos classificados (total por emitente e por CFOP, preço
+        e quantidade por produto) são comparados com o histórico dos lotes anteriores (ver
+        `tools.value_anomalies`); os valores anômalos viram alertas em 'alertas_especificos'.
+
+        Com `em_pacotes`, em vez de um arquivo por nota, as notas são anexadas a pacotes mensais
+        compactados ('output/<Ramo>/<AAAA-MM>.notas.gz', ver `tools.note_bundles`).
+
+        Antes da extração, o cabeçalho (ide/emit/dest) de cada XML é pré-lido do início do
+        arquivo (ver `tools.xml_prefetch`): os XMLs soltos são agrupados por mês, CNAE e emitente,
+        e as demais cópias de uma nota cuja chave de acesso já apareceu no lote (ex.: o mesmo XML
+        solto e dentro de um ZIP) aguardam o resultado da primeira: se ela foi concluída com
+        sucesso (neste ou num processamento anterior do mesmo lote), são registradas como
+        'duplicada', sem serem extraídas de novo; se falhou, a cópia seguinte é processada.
+
+        O `governador` (por padrão, um `GovernadorRecursos` com os limites padrão) limita os
+        documentos em andamento, as páginas renderizadas pelo OCR e a memória do processo,
+        pausando a leitura de novas entradas em vez de deixar o lote estourar a memória. Os
+        picos e as contenções vão para o relatório, em 'recursos'.
+
+        Com `perfilar`, o processamento do lote roda sob uma `CapturaPerfil` (ver
+        `tools.run_profiler`): o perfil do cProfile, as pilhas para flamegraph e, com
+        `perfilar_memoria`, os locais com mais memória alocada (tracemalloc) são salvos ao lado
+        do relatório, em 'output/relatorios/perfil_lote_<run_id>.*', e listados em 'perfil'.
         """
-        input_path = Path("data/notas")
-        output_path = Path("output")
+        input_path = self.input_dir
+        output_path = self.output_dir
         erros_path = output_path / "erros"
 
         if not input_path.exists():
-            return {"erro": "A pasta 'data/notas' não foi encontrada. Crie-a e adicione seus arquivos."}
+            return {"erro": f"A pasta '{input_path}' não foi encontrada. Crie-a e adicione seus arquivos."}
 
         output_path.mkdir(exist_ok=True)
         erros_path.mkdir(exist_ok=True)
 
-        arquivos_para_processar = list(input_path.glob("*.xml")) + list(input_path.glob("*.pdf"))
+        documentos, compactados = listar_entradas_lote(input_path)
+        # Todo o lote usa a configuração em vigor agora, mesmo que outra thread a recarregue.
+        estado = self._estado
 
-        if not arquivos_para_processar:
-            return {"info": "Nenhum arquivo .xml ou .pdf encontrado em 'data/notas' para processar."}
+        if not documentos and not compactados:
+            return {"info": f"Nenhum arquivo .xml, .pdf ou compactado (.zip/.tar) encontrado em '{input_path}' para processar."}
 
-        sucesso_count = 0
-        falha_count = 0
+        inicio_planejamento = time.perf_counter()
+        documentos, cabecalhos = planejar_documentos(documentos)
+        print(f'🧭 Cabeçalhos de {len(cabecalhos)} XMLs pré-lidos em '
+              f'{time.perf_counter() - inicio_planejamento:.2f}s para planejar o lote.')
 
-        print(f'🚀 Iniciando processamento em lote de {len(arquivos_para_processar)} arquivos...')
+        # Diário do lote: agrupa as gravações e permite retomar um lote interrompido.
+        diario = DiarioLote(output_path / ARQUIVO_CONTROLE_LOTES, input_path, retomar=retomar)
+        # Totais por ramo/mês/centro de custo/CFOP, acumulados entre execuções. Usam a conexão
+        # do diário para que cada grupo de documentos e seus totais sejam gravados juntos.
+        agregados = AgregadosLote(output_path / ARQUIVO_CONTROLE_LOTES, conn=diario.conn)
+        # Índice de busca por chave, CNPJ, CFOP e descrição, construído durante o lote.
+        indice = IndiceNotas(output_path / ARQUIVO_INDICE_NOTAS)
+        diario.ao_fazer_checkpoint(agregados.aplicar_pendentes)
+        diario.ao_fazer_checkpoint(lambda _conn: indice.salvar())
+        # Extrações guardadas para `reclassificar_extracoes`, com a versão da configuração usada.
+        extracoes = ArmazemExtracoes(output_path / ARQUIVO_EXTRACOES)
+        extracoes.registrar_versao(dict(estado.instantaneo))
+        diario.ao_fazer_checkpoint(lambda _conn: extracoes.salvar())
+        pacotes = PacotesNotas() if em_pacotes else None
+        detector = DetectorAnomalias(output_path / ARQUIVO_ESTATISTICAS_VALORES)
+        diario.ao_fazer_checkpoint(lambda _conn: detector.salvar())
 
-        for file in arquivos_para_processar:
-            try:
-                print(f'--- Processando: {file.name} ---')
-                resultado = self.processar_documento(str(file))
+        if diario.retomado:
+            print(f'🔁 Retomando o lote {diario.run_id} ({diario.total_concluidos} documentos já concluídos)...')
+        else:
+            print(f'🚀 Iniciando o lote {diario.run_id}: {len(documentos)} arquivos '
+                  f'e {len(compactados)} arquivos compactados...')
+
+        assinaturas = {}
+        pulados = [0]
+        # Chave de acesso -> entrada do lote que a representa (a primeira, ou a cópia que a substituiu).
+        chaves_vistas: Dict[str, str] = {}
+        # Chave de acesso -> demais cópias, à espera do resultado da entrada que a representa.
+        copias_adiadas: Dict[str, List[EntradaLote]] = {}
+        duplicadas = [0]
 
-                # Se houve erro na extração ou classificação, move para a pasta de erros.
-                if "erro" in resultado or "erro" in resultado.get('analise_classificacao', {}):
-                    erro_msg = resultado.get("erro") or resultado['analise_classificacao'].get("erro")
-                    print(f'❌ Falha ao processar {file.name}: {erro_msg}. Arquivo mantido na pasta de entrada.')
-                    falha_count += 1
+        def entradas_pendentes():
+            for entrada in iterar_entradas_lote(documentos, compactados):
+                # A versão de um membro é a do arquivo compactado que o contém.
+                if entrada.caminho not in assinaturas:
+                    assinaturas[entrada.caminho] = assinatura_arquivo(entrada.caminho)
+                if entrada.extensao == '.xml' and not entrada.erro:
+                    # Membros de ZIP/TAR já estão em memória; os XMLs soltos foram pré-lidos no planejamento.
+                    cabecalho = cabecalhos.get(entrada.caminho) if entrada.membro is None else ler_cabecalho(entrada.fonte)
+                    if cabecalho is not None and cabecalho.chave_completa:
+                        original = chaves_vistas.setdefault(cabecalho.chave_acesso, entrada.identificador)
+                        if original != entrada.identificador:
+                            if not diario.ja_processado(entrada.identificador, assinaturas[entrada.caminho]):
+                                copias_adiadas.setdefault(cabecalho.chave_acesso, []).append(entrada)
+                            continue
+                if diario.ja_processado(entrada.identificador, assinaturas[entrada.caminho]):
+                    pulados[0] += 1
                     continue
+                yield entrada
 
-                # Determina a pasta de destino com base na classificação.
-                analise = resultado['analise_classificacao']
-                dados_doc = resultado['dados_do_documento']['cabecalho']
+        def resolver_copias_adiadas() -> List[EntradaLote]:
+            """
+            Com todas as entradas da passada concluídas: as cópias de uma nota cuja entrada deu certo
+            são registradas como duplicadas; para as que falharam, retorna a próxima cópia a processar.
+            """
+            proximas = []
+            for chave, copias in list(copias_adiadas.items()):
+                original = chaves_vistas[chave]
+                if diario.concluido_com_sucesso(original):
+                    for copia in copias:
+                        print(f'♊ {copia.identificador} tem a mesma chave de acesso de {original}; não será extraído de novo.')
+                        duplicadas[0] += 1
+                        diario.registrar(copia.identificador, assinaturas[copia.caminho],
+                                         copia.caminho.name, copia.membro, duplicada=True)
+                    del copias_adiadas[chave]
+                    continue
+                copia = copias.pop(0)
+                if not copias:
+                    del copias_adiadas[chave]
+                print(f'🔂 {original} falhou; a cópia {copia.identificador} (mesma chave de acesso) será processada.')
+                chaves_vistas[chave] = copia.identificador
+                proximas.append(copia)
+            return proximas
 
-                ramo = analise.get('ramo_empresa_detectado', 'Ramo_Nao_Identificado').replace(" ", "_").capitalize()
+        # XMLs, PDFs com texto e PDFs com OCR correm em faixas separadas; os resultados chegam
+        # na ordem em que ficam prontos e são gravados aqui, na thread principal.
+        governador = governador or GovernadorRecursos()
+        # Sem o perfil pedido, nenhuma captura é criada e o lote roda sem instrumentação.
+        captura = CapturaPerfil(output_path / PASTA_RELATORIOS, f"lote_{diario.run_id}",
+                                memoria=perfilar_memoria) if perfilar else None
+        escalonador = EscalonadorLote(partial(self._processar_entrada_na_faixa, estado=estado, governador=governador),
+                                      governador=governador, perfil=captura)
+        # Documentos classificados que aguardam a pontuação de anomalias do seu grupo.
+        grupo = []
 
-                try:
-                    data_emissao_str = dados_doc.get('data_emissao', '')
-                    ano_mes = datetime.fromisoformat(data_emissao_str).strftime('%Y-%m')
-                except (ValueError, TypeError):
-                    ano_mes = "Sem_Data_Valida"
+        def concluir_grupo():
+            self._aplicar_anomalias(detector, [resultado for _, resultado in grupo])
+            for entrada, resultado in grupo:
+                destino, erro_msg = self._concluir_entrada_lote(entrada, resultado, output_path, indice,
+                                                                pacotes, extracoes, estado)
+                if destino is not None:
+                    self._registrar_agregados(agregados, resultado)
 
-                destination_folder = output_path / ramo / ano_mes
-                destination_folder.mkdir(parents=True, exist_ok=True)
+                diario.registrar(entrada.identificador, assinaturas[entrada.caminho], entrada.caminho.name,
+                                 entrada.membro, destino=str(destino) if destino else None, erro=erro_msg)
+            grupo.clear()
 
-                shutil.copy(str(file), destination_folder / file.name)
-                print(f'✅ Sucesso! {file.name} copiado para {destination_folder}. Arquivo original mantido.')
-                sucesso_count += 1
+        try:
+            with captura if captura is not None else nullcontext():
+                entradas = entradas_pendentes()
+                while entradas:
+                    for entrada, _, resultado in escalonador.executar(entradas):
+                        grupo.append((entrada, resultado))
+                        if len(grupo) >= TAMANHO_GRUPO_ANOMALIAS:
+                            concluir_grupo()
+                    concluir_grupo()
+                    # Nova passada com uma cópia de cada nota duplicada cuja entrada falhou.
+                    entradas = resolver_copias_adiadas()
 
-            except Exception as e:
-                print(f'💥 Erro fatal ao processar {file.name}: {e}. Arquivo mantido na pasta de entrada.')
-                falha_count += 1
+            if pulados[0]:
+                print(f'⏭️ {pulados[0]} documentos já concluídos neste lote foram pulados.')
+            if duplicadas[0]:
+                print(f'♊ {duplicadas[0]} notas duplicadas (mesma chave de acesso) não foram extraídas de novo.')
+            extras = {"recursos": governador.relatorio()}
+            if captura is not None:
+                extras["perfil"] = captura.arquivos
+            relatorio = diario.finalizar(output_path / PASTA_RELATORIOS, **extras)
+        finally:
+            # Em caso de interrupção, os grupos já gravados permanecem no diário para a retomada.
+            agregados.fechar()
+            indice.fechar()
+            extracoes.fechar()
+            detector.salvar()
+            if pacotes is not None:
+                pacotes.fechar()
+            diario.fechar()
 
         # Retorna um resumo da operação para ser exibido no dashboard.
         return {
-            "sucesso": sucesso_count,
-            "falhas": falha_count,
-            "total": len(arquivos_para_processar),
-            "output_path": str(output_path.resolve())
-        }
\ No newline at end of file
+            "run_id": relatorio["run_id"],
+            "retomado": diario.retomado,
+            "sucesso": relatorio["sucesso"],
+            "falhas": relatorio["falhas"],
+            "duplicadas": relatorio["duplicadas"],
+            "total": relatorio["total"],
+            "output_path": str(output_path.resolve()),
+            "relatorio_path": relatorio["relatorio_path"],
+            "documentos": relatorio["documentos"],
+            "faixas": escalonador.estatisticas,
+            "recursos": relatorio["recursos"],
+            "perfil": relatorio.get("perfil"),
+        }
+
+    def _processar_entrada_lote(self, entrada: EntradaLote, estado: Optional[EstadoConfiguracao] = None,
+                                governador: Optional[GovernadorRecursos] = None) -> Dict[str, Any]:
+        """
+        Extrai e classifica uma entrada do lote (a cópia para 'output/' e a indexação ficam com
+        `_concluir_entrada_lote`). Com um `governador`, o documento espera caber no teto de
+        memória antes de começar, e o OCR, uma vaga para cada página renderizada.
+        """
+        if governador is not None:
+            governador.iniciar_documento()
+        try:
+            if entrada.erro:
+                raise ValueError(entrada.erro)
+            print(f'--- Processando: {entrada.identificador} ---')
+            resultado = self._processar_fonte(entrada.extensao, entrada.fonte, estado=estado, governador=governador)
+        except Exception as e:
+            resultado = {"erro": str(e)}
+        finally:
+            if governador is not None:
+                governador.concluir_documento()
+        return resultado
+
+    def _processar_entrada_na_faixa(self, entrada: EntradaLote, faixa: str, prazo: float,
+                                    estado: Optional[EstadoConfiguracao] = None,
+                                    governador: Optional[GovernadorRecursos] = None) -> Dict[str, Any]:
+        """Extrai e classifica uma entrada dentro de uma faixa do escalonador (só a faixa de OCR roda o OCR)."""
+        print(f'--- Processando ({faixa}): {entrada.identificador} ---')
+        return self._processar_fonte(entrada.extensao, entrada.fonte,
+                                     permitir_ocr=(faixa == FAIXA_OCR), prazo=prazo, estado=estado,
+                                     governador=governador)
+
+    def _concluir_entrada_lote(self, entrada: EntradaLote, resultado: Dict[str, Any], output_path: Path,
+                               indice: IndiceNotas, pacotes: Optional[PacotesNotas] = None,
+                               extracoes: Optional[ArmazemExtracoes] = None,
+                               estado: Optional[EstadoConfiguracao] = None) -> Tuple[Optional[Path], Optional[str]]:
+        """
+        Copia o documento classificado para 'output/' (ou para o pacote mensal) e o indexa.
+        Com `extracoes`, também guarda os dados extraídos e a classificação (inclusive de um
+        documento cuja classificação falhou, que uma nova configuração pode resolver), com as
+        dependências calculadas no `estado` que classificou o documento.
+        Retorna (destino, erro); em caso de falha, destino é None e o arquivo fica na entrada.
+        """
+        try:
+            # Se houve erro na extração ou classificação, o arquivo é mantido na entrada.
+            if "erro" in resultado or "erro" in resultado.get('analise_classificacao', {}):
+                erro_msg = resultado.get("erro") or resultado['analise_classificacao'].get("erro")
+                print(f'❌ Falha ao processar {entrada.identificador}: {erro_msg}. Arquivo mantido na pasta de entrada.')
+                if extracoes is not None and 'dados_do_documento' in resultado:
+                    self._guardar_extracao(extracoes, entrada.identificador, entrada.nome, None, resultado,
+                                           estado=estado)
+                return None, erro_msg
+
+            destino = self._organizar_documento(entrada, resultado, output_path, pacotes)
+            indice.indexar(resultado['dados_do_documento'], resultado['analise_classificacao'],
+                           caminho=str(destino), origem=entrada.identificador)
+            if extracoes is not None:
+                self._guardar_extracao(extracoes, entrada.identificador, entrada.nome, str(destino), resultado,
+                                       estado=estado)
+            print(f'✅ Sucesso! {entrada.identificador} copiado para {destino.parent}. Arquivo original mantido.')
+            return destino, None
+
+        except Exception as e:
+            print(f'💥 Erro fatal ao processar {entrada.identificador}: {e}. Arquivo mantido na pasta de entrada.')
+            return None, str(e)
+
+    @staticmethod
+    def _aplicar_anomalias(detector: Union[DetectorAnomalias, HistoricoCompartilhado], resultados: list):
+        """
+        Pontua juntos os documentos classificados com sucesso e os inclui no histórico. Os alertas
+        de cada documento vão para 'alertas_especificos' e também para 'alertas_valor', de onde a
+        reclassificação os recupera (eles dependem dos valores do documento, não da configuração).
+        """
+        classificados = [resultado for resultado in resultados
+                         if "erro" not in resultado and "erro" not in resultado.get('analise_classificacao', {})]
+        if not classificados:
+            return
+        alertas = detector.avaliar_lote([resultado['dados_do_documento'] for resultado in classificados])
+        for resultado, alertas_valor in zip(classificados, alertas):
+            if alertas_valor:
+                analise = resultado['analise_classificacao']
+                analise['alertas_especificos'] = [*analise['alertas_especificos'], *alertas_valor]
+                analise['alertas_valor'] = alertas_valor
+
+    def _guardar_extracao(self, extracoes: ArmazemExtracoes, identificador: str, nome: str,
+                          destino: Optional[str], resultado: Dict[str, Any], versao: Optional[str] = None,
+                          estado: Optional[EstadoConfiguracao] = None):
+        dados = resultado['dados_do_documento']
+        extracoes.gravar(identificador, nome, destino, dados, resultado['analise_classificacao'],
+                         self._dependencias_classificacao(dados, estado), versao)
+
+    @_serializar_saida
+    def enfileirar_lote_notas(self, fila: FilaTrabalho, retomar: bool = True) -> Dict[str, Any]:
+        """
+        Coordenador de um lote distribuído: enfileira cada arquivo de 'data/notas' (documento
+        solto ou compactado inteiro) como uma tarefa na fila compartilhada. Os trabalhadores
+        (`executar_trabalhador_lote`, em qualquer número de processos ou máquinas que vejam
+        a mesma pasta) processam as tarefas; `consolidar_lote_distribuido` junta os resultados.
+
+        Como em `processar_lote_notas`, os cabeçalhos dos XMLs soltos são pré-lidos e as tarefas
+        são enfileiradas (e reivindicadas) na ordem planejada: por mês, CNAE e emitente.
+        """
+        input_path = self.input_dir
+        output_path = self.output_dir
+
+        if not input_path.exists():
+            return {"erro": f"A pasta '{input_path}' não foi encontrada. Crie-a e adicione seus arquivos."}
+
+        documentos, compactados = listar_entradas_lote(input_path)
+        if not documentos and not compactados:
+            return {"info": f"Nenhum arquivo .xml, .pdf ou compactado (.zip/.tar) encontrado em '{input_path}' para processar."}
+
+        documentos, _ = planejar_documentos(documentos)
+        output_path.mkdir(exist_ok=True)
+        diario = DiarioLote(output_path / ARQUIVO_CONTROLE_LOTES, input_path, retomar=retomar)
+        try:
+            arquivos = {caminho.name: assinatura_arquivo(caminho) for caminho in documentos + compactados}
+            novas = fila.enfileirar(diario.run_id, arquivos)
+        finally:
+            diario.fechar()
+
+        print(f'📬 Lote {diario.run_id}: {novas} de {len(arquivos)} arquivos enfileirados em {fila.caminho_db}.')
+        return {"run_id": diario.run_id, "retomado": diario.retomado, "arquivos": len(arquivos), "enfileirados": novas}
+
+    @_serializar_saida
+    def executar_trabalhador_lote(self, fila: FilaTrabalho, trabalhador: Optional[str] = None,
+                                  aguardar_novas: bool = False, intervalo: float = 1.0,
+                                  em_pacotes: bool = False,
+                                  governador: Optional[GovernadorRecursos] = None) -> Dict[str, Any]:
+        """
+        Trabalhador de um lote distribuído: reivindica tarefas da fila (com lease), processa
+        os documentos de cada arquivo e grava o resultado na fila. Cópias para 'output/' e o
+        índice de busca são idempotentes; os agregados vão no resultado da tarefa e só são
+        somados pelo coordenador, então uma tarefa refeita após um lease expirado não é
+        contabilizada duas vezes.
+
+        Os valores dos documentos classificados são pontuados contra o histórico dos lotes, como
+        em `processar_lote_notas`, em grupos de até `TAMANHO_GRUPO_ANOMALIAS` documentos de uma
+        tarefa. Cada trabalhador mantém uma cópia do histórico e junta os seus documentos ao
+        arquivo compartilhado de tempos em tempos, quando fica sem tarefas e ao terminar (ver
+        `tools.value_anomalies.HistoricoCompartilhado`). Uma nota refeita não entra de novo no
+        histórico.
+
+        Uma nota cuja chave de acesso (lida do cabeçalho do XML) já foi concluída com sucesso por
+        outro documento do lote, em qualquer trabalhador, não é extraída de novo: vai no resultado
+        como 'duplicada' (ver `FilaTrabalho.documento_da_chave`).
+
+        Termina quando não há mais tarefas pendentes nem em execução (ou continua esperando
+        novas tarefas, com `aguardar_novas`). `em_pacotes` grava as notas nos pacotes mensais
+        (ver `processar_lote_notas`); os pacotes aceitam vários trabalhadores ao mesmo tempo.
+
+        O `governador` (por padrão, um `GovernadorRecursos` com os limites padrão) vale para este
+        processo, como no lote local: cada documento só começa quando cabe no teto de memória e o
+        OCR espera uma vaga antes de renderizar cada página. Os picos e as contenções vão para o
+        retorno, em 'recursos'.
+        """
+        input_path = self.input_dir
+        output_path = self.output_dir
+        output_path.mkdir(exist_ok=True)
+        trabalhador = trabalhador or identificar_trabalhador()
+        indice = IndiceNotas(output_path / ARQUIVO_INDICE_NOTAS)
+        pacotes = PacotesNotas(wal=fila.wal) if em_pacotes else None
+        estado = self._estado
+        extracoes = ArmazemExtracoes(output_path / ARQUIVO_EXTRACOES)
+        extracoes.registrar_versao(dict(estado.instantaneo))
+        governador = governador or GovernadorRecursos()
+        historico = HistoricoCompartilhado(output_path / ARQUIVO_ESTATISTICAS_VALORES)
+        concluidas = 0
+        perdidas = 0
+
+        print(f'👷 Trabalhador {trabalhador} aguardando tarefas em {fila.caminho_db}...')
+        try:
+            while True:
+                tarefas = fila.reivindicar(trabalhador)
+                if not tarefas:
+                    historico.sincronizar()
+                    # Tarefas em execução por outro trabalhador podem voltar à fila se o lease expirar.
+                    if not aguardar_novas and not fila.ha_trabalho():
+                        break
+                    time.sleep(intervalo)
+                    continue
+
+                tarefa = tarefas[0]
+                resultado = self._executar_tarefa_lote(fila, tarefa, trabalhador, input_path, output_path,
+                                                       indice, pacotes, extracoes, estado, governador,
+                                                       historico)
+                # Notas concluídas com sucesso na tarefa: as outras cópias delas deixam de ser processadas.
+                chaves = {}
+                for doc in resultado.get("documentos", []):
+                    if doc.get("chave_acesso") and doc["destino"]:
+                        chaves.setdefault(doc["chave_acesso"], doc["identificador"])
+                if fila.concluir(tarefa.id, trabalhador, resultado, chaves=chaves):
+                    concluidas += 1
+                else:
+                    perdidas += 1
+                    print(f'⚠️ Lease da tarefa {tarefa.arquivo} expirou; o resultado foi descartado.')
+        finally:
+            historico.fechar()
+            indice.fechar()
+            extracoes.fechar()
+            if pacotes is not None:
+                pacotes.fechar()
+
+        return {"trabalhador": trabalhador, "concluidas": concluidas, "leases_perdidos": perdidas,
+                "recursos": governador.relatorio()}
+
+    def _executar_tarefa_lote(self, fila: FilaTrabalho, tarefa: Tarefa, trabalhador: str,
+                              input_path: Path, output_path: Path, indice: IndiceNotas,
+                              pacotes: Optional[PacotesNotas] = None,
+                              extracoes: Optional[ArmazemExtracoes] = None,
+                              estado: Optional[EstadoConfiguracao] = None,
+                              governador: Optional[GovernadorRecursos] = None,
+                              historico: Optional[HistoricoCompartilhado] = None) -> Dict[str, Any]:
+        """Processa todos os documentos de um arquivo da fila, renovando o lease entre eles."""
+        caminho = input_path / tarefa.arquivo
+        if not caminho.is_file():
+            return {"erro": f"Arquivo '{tarefa.arquivo}' não encontrado em {input_path}."}
+
+        if is_arquivo_compactado(caminho):
+            entradas = iterar_entradas_lote([], [caminho])
+        else:
+            entradas = iterar_entradas_lote([caminho], [])
+
+        documentos = []
+        # Documentos classificados que aguardam a pontuação de anomalias do seu grupo.
+        grupo = []
+        # Chave de acesso -> documento desta tarefa concluído com sucesso com ela.
+        chaves_tarefa: Dict[str, str] = {}
+        ultima_renovacao = time.monotonic()
+
+        def concluir_grupo():
+            if not grupo:
+                return
+            if historico is not None:
+                self._aplicar_anomalias(historico, [resultado for _, _, resultado in grupo])
+            for entrada, chave, resultado in grupo:
+                destino, erro_msg = self._concluir_entrada_lote(entrada, resultado, output_path, indice,
+                                                                pacotes, extracoes, estado)
+                # Commit por documento: o índice e as extrações são compartilhados com os outros trabalhadores.
+                indice.salvar()
+                if extracoes is not None:
+                    extracoes.salvar()
+                if chave and destino:
+                    chaves_tarefa.setdefault(chave, entrada.identificador)
+                documentos.append({
+                    "identificador": entrada.identificador,
+                    "membro": entrada.membro,
+                    "chave_acesso": chave,
+                    "destino": str(destino) if destino else None,
+                    "erro": erro_msg,
+                    "agregado": self._celula_agregado(resultado) if destino else None,
+                })
+            grupo.clear()
+
+        for entrada in entradas:
+            cabecalho = ler_cabecalho(entrada.fonte) if entrada.extensao == '.xml' and not entrada.erro else None
+            chave = cabecalho.chave_acesso if cabecalho is not None and cabecalho.chave_completa else None
+            original = chave and (chaves_tarefa.get(chave) or fila.documento_da_chave(tarefa.run_id, chave))
+            if original and original != entrada.identificador:
+                print(f'♊ {entrada.identificador} tem a mesma chave de acesso de {original}; não será extraído de novo.')
+                documentos.append({"identificador": entrada.identificador, "membro": entrada.membro,
+                                   "chave_acesso": chave, "destino": None, "erro": None, "duplicada": original})
+                continue
+            grupo.append((entrada, chave, self._processar_entrada_lote(entrada, estado, governador)))
+            if len(grupo) >= TAMANHO_GRUPO_ANOMALIAS:
+                concluir_grupo()
+            if time.monotonic() - ultima_renovacao > fila.lease_segundos / 3:
+                fila.renovar(tarefa.id, trabalhador)
+                ultima_renovacao = time.monotonic()
+        concluir_grupo()
+        return {"documentos": documentos}
+
+    @_serializar_saida
+    def consolidar_lote_distribuido(self, fila: FilaTrabalho, run_id: str, aguardar: bool = True,
+                                    intervalo: float = 2.0) -> Dict[str, Any]:
+        """
+        Junta no diário e nos agregados os resultados das tarefas concluídas do lote distribuído.
+        Com `aguardar`, repete a cada `intervalo` segundos até a fila do lote esvaziar e então
+        gera o relatório final (mesmo formato de `processar_lote_notas`).
+
+        Os documentos que o trabalhador não extraiu por repetirem a chave de acesso de outro já
+        concluído, e os que dois trabalhadores concluíram ao mesmo tempo com a mesma chave (fica
+        o primeiro registrado na fila), são registrados como 'duplicada', sem entrar nos agregados.
+        """
+        input_path = self.input_dir
+        output_path = self.output_dir
+        diario = DiarioLote(output_path / ARQUIVO_CONTROLE_LOTES, input_path, run_id=run_id)
+        agregados = AgregadosLote(output_path / ARQUIVO_CONTROLE_LOTES, conn=diario.conn)
+        diario.ao_fazer_checkpoint(agregados.aplicar_pendentes)
+        duplicadas = 0
+
+        try:
+            while True:
+                # Lê o estado da fila antes de consolidar, para não encerrar antes de juntar a última tarefa.
+                pendente = fila.ha_trabalho(run_id)
+                finalizadas = fila.finalizadas_nao_consolidadas(run_id)
+                for _, arquivo, assinatura, resultado in finalizadas:
+                    documentos = resultado.get("documentos") or [
+                        {"identificador": arquivo, "membro": None, "destino": None,
+                         "erro": resultado.get("erro", "Tarefa sem resultado.")}
+                    ]
+                    for doc in documentos:
+                        if diario.ja_processado(doc["identificador"], assinatura):
+                            continue
+                        original = doc.get("duplicada")
+                        if original is None and doc.get("chave_acesso") and doc["destino"]:
+                            original = fila.documento_da_chave(run_id, doc["chave_acesso"])
+                        if original is not None and original != doc["identificador"]:
+                            duplicadas += 1
+                            diario.registrar(doc["identificador"], assinatura, arquivo, doc["membro"], duplicada=True)
+                            continue
+                        if doc.get("agregado"):
+                            agregados.registrar(**doc["agregado"])
+                        diario.registrar(doc["identificador"], assinatura, arquivo, doc["membro"],
+                                         destino=doc["destino"], erro=doc["erro"])
+                if finalizadas:
+                    diario.checkpoint()
+                    fila.marcar_consolidadas([tarefa_id for tarefa_id, *_ in finalizadas])
+                    print(f'📥 {len(finalizadas)} tarefas consolidadas; situação da fila: {fila.contar_status(run_id)}')
+
+                if not pendente or not aguardar:
+                    break
+                time.sleep(intervalo)
+
+            if pendente:
+                return {"run_id": run_id, "em_andamento": True, "fila": fila.contar_status(run_id)}
+            if duplicadas:
+                print(f'♊ {duplicadas} notas duplicadas (mesma chave de acesso) não foram contabilizadas de novo.')
+            relatorio = diario.finalizar(output_path / PASTA_RELATORIOS)
+        finally:
+            agregados.fechar()
+            diario.fechar()
+
+        return {
+            "run_id": run_id,
+            "retomado": False,
+            "sucesso": relatorio["sucesso"],
+            "falhas": relatorio["falhas"],
+            "duplicadas": relatorio["duplicadas"],
+            "total": relatorio["total"],
+            "output_path": str(output_path.resolve()),
+            "relatorio_path": relatorio["relatorio_path"],
+            "documentos": relatorio["documentos"],
+        }
+
+    @_serializar_saida
+    def reclassificar_extracoes(self) -> Dict[str, Any]:
+        """
+        Relê a configuração (tabela de CFOPs, ramos, centros de custo, mapa CNAE, regras setoriais)
+        e reclassifica, a partir das extrações guardadas pelos lotes, só os documentos que leram
+        alguma parte da configuração que mudou desde a sua última classificação; nenhum arquivo é
+        relido e nenhum OCR é refeito. Documentos cujo resultado mudou têm o índice de busca e os
+        totais acumulados atualizados, e a cópia organizada é movida se o ramo mudou.
+
+        Documentos que falhavam na classificação e passam a ser classificados continuam na pasta
+        de entrada: aparecem no resultado para que o lote seja reprocessado.
+        """
+        output_path = self.output_dir
+        caminho_db = output_path / ARQUIVO_EXTRACOES
+        if not caminho_db.is_file():
+            return {"info": f"Nenhuma extração guardada em '{output_path}'. Processe um lote antes de reclassificar."}
+
+        estado = self.recarregar_configuracao()
+        instantaneo = dict(estado.instantaneo)
+        extracoes = ArmazemExtracoes(caminho_db)
+        versao = extracoes.registrar_versao(instantaneo)
+        indice = IndiceNotas(output_path / ARQUIVO_INDICE_NOTAS)
+        agregados = AgregadosLote(output_path / ARQUIVO_CONTROLE_LOTES)
+        pacotes = PacotesNotas()
+        avaliados = 0
+        alterados = []
+
+        try:
+            for antiga in extracoes.versoes_em_uso():
+                if antiga == versao:
+                    continue
+                alteradas = chaves_alteradas(extracoes.instantaneo(antiga), instantaneo)
+                for registro in extracoes.afetadas(antiga, alteradas):
+                    avaliados += 1
+                    alteracao = self._reclassificar_registro(registro, output_path, extracoes, indice,
+                                                             agregados, pacotes, versao, estado)
+                    if alteracao:
+                        alterados.append(alteracao)
+                # As demais extrações dessa versão não leram nada que mudou: só recebem a versão nova.
+                extracoes.migrar_versao(antiga, versao)
+            indice.salvar()
+            agregados.salvar()
+            extracoes.salvar()
+            total = extracoes.contar()
+        finally:
+            pacotes.fechar()
+            agregados.fechar()
+            indice.fechar()
+            extracoes.fechar()
+
+        print(f'🔁 Reclassificação: {avaliados} de {total} documentos reavaliados, {len(alterados)} alterados.')
+        return {"versao_config": versao, "total": total, "avaliados": avaliados,
+                "alterados": len(alterados), "documentos": alterados}
+
+    def _reclassificar_registro(self, registro: ExtracaoArmazenada, output_path: Path, extracoes: ArmazemExtracoes,
+                                indice: IndiceNotas, agregados: AgregadosLote, pacotes: PacotesNotas,
+                                versao: str, estado: EstadoConfiguracao) -> Optional[Dict[str, Any]]:
+        """Reclassifica uma extração guardada; retorna o resumo da alteração, ou None se nada mudou."""
+        dados = DocumentoFiscal.from_dict(registro.dados)
+        classificado = self._classificar_extracao(dados, estado)
+        analise = classificado.get('analise_classificacao') or {"erro": classificado.get("erro")}
+        if registro.resultado.get('alertas_valor') and "erro" not in analise:
+            analise['alertas_especificos'] = [*analise['alertas_especificos'], *registro.resultado['alertas_valor']]
+            analise['alertas_valor'] = registro.resultado['alertas_valor']
+        resultado = {"dados_do_documento": dados, "analise_classificacao": analise}
+        destino = registro.destino
+
+        mudou = impressao_digital(analise) != impressao_digital(registro.resultado)
+        if mudou and destino and "erro" not in analise:
+            anterior = {"dados_do_documento": registro.dados, "analise_classificacao": registro.resultado}
+            destino = self._realocar_documento(registro, resultado, output_path, pacotes)
+            indice.indexar(dados, analise, caminho=destino, origem=registro.identificador)
+            if "erro" not in registro.resultado:
+                agregados.corrigir(self._celula_agregado(anterior), self._celula_agregado(resultado))
+        self._guardar_extracao(extracoes, registro.identificador, registro.nome, destino, resultado, versao, estado)
+
+        if not mudou:
+            return None
+        if "erro" in analise:
+            situacao = "falha"
+        elif not registro.destino:
+            situacao = "reprocessar_lote"
+        else:
+            situacao = "atualizado"
+        return {
+            "identificador": registro.identificador,
+            "situacao": situacao,
+            "destino": destino,
+            "ramo_anterior": registro.resultado.get('ramo_empresa_detectado'),
+            "ramo": analise.get('ramo_empresa_detectado'),
+            "centro_custo_anterior": registro.resultado.get('centro_custo'),
+            "centro_custo": analise.get('centro_custo'),
+            "erro": analise.get('erro'),
+        }
+
+    def _organizar_documento(self, entrada: EntradaLote, resultado: Dict[str, Any], output_path: Path,
+                             pacotes: Optional[PacotesNotas] = None) -> Path:
+        """
+        Copia o documento para 'output/<Ramo>/<AAAA-MM>' de acordo com a classificação.
+        Membros de arquivos compactados são gravados diretamente a partir dos bytes lidos.
+        Com `pacotes`, o documento é anexado a 'output/<Ramo>/<AAAA-MM>.notas.gz' e o destino
+        retornado é '<pacote>!<chave>' (lido com `tools.note_bundles.ler_destino`).
+        """
+        dados_doc = resultado['dados_do_documento']['cabecalho']
+        pasta_ramo, ano_mes = self._pasta_organizada(resultado, output_path)
+
+        if pacotes is not None:
+            conteudo = entrada.conteudo if entrada.conteudo is not None else entrada.caminho.read_bytes()
+            # Sem chave de acesso (ex.: PDF sem chave legível), a nota é identificada pelo conteúdo.
+            chave = dados_doc.get('chave_acesso') or chave_conteudo(conteudo)
+            return Path(pacotes.adicionar(pasta_ramo, ano_mes, chave, entrada.nome, conteudo))
+
+        destination_folder = pasta_ramo / ano_mes
+        destination_folder.mkdir(parents=True, exist_ok=True)
+        destino = destination_folder / entrada.nome
+
+        # Grava em um arquivo temporário e o renomeia, para que o destino nunca fique pela metade.
+        temporario = destino.with_name(destino.name + '.tmp')
+        if entrada.conteudo is None:
+            shutil.copyfile(str(entrada.caminho), temporario)
+        else:
+            temporario.write_bytes(entrada.conteudo)
+        os.replace(temporario, destino)
+        return destino
+
+    def _pasta_organizada(self, resultado: Dict[str, Any], output_path: Path) -> Tuple[Path, str]:
+        """Retorna ('output/<Ramo>', 'AAAA-MM') do documento classificado."""
+        analise = resultado['analise_classificacao']
+        ramo = analise.get('ramo_empresa_detectado', 'Ramo_Nao_Identificado').replace(" ", "_").capitalize()
+        return output_path / ramo, self._ano_mes_emissao(resultado['dados_do_documento']['cabecalho'])
+
+    def _realocar_documento(self, registro: ExtracaoArmazenada, resultado: Dict[str, Any], output_path: Path,
+                            pacotes: PacotesNotas) -> str:
+        """
+        Move a cópia organizada de um documento reclassificado para a pasta (ou pacote) do
+        novo ramo, se ele mudou. Retorna o destino atualizado.
+        """
+        pasta_ramo, ano_mes = self._pasta_organizada(resultado, output_path)
+        em_pacote = is_destino_pacote(registro.destino)
+        if em_pacote:
+            pacote, chave = separar_destino(registro.destino)
+            if pacote.parent == pasta_ramo:
+                return registro.destino
+            novo = f"{caminho_pacote(pasta_ramo, ano_mes)}!{chave}"
+        else:
+            atual = Path(registro.destino)
+            if atual.parent == pasta_ramo / ano_mes:
+                return registro.destino
+            novo = str(pasta_ramo / ano_mes / atual.name)
+
+        try:
+            conteudo = ler_destino(registro.destino) if em_pacote else atual.read_bytes()
+        except (FileNotFoundError, KeyError):
+            # Outra entrada com o mesmo destino (ex.: a mesma nota solta e dentro de um ZIP) já foi realocada.
+            return novo
+        entrada = EntradaLote(Path(registro.nome), conteudo=conteudo)
+        destino = self._organizar_documento(entrada, resultado, output_path, pacotes if em_pacote else None)
+        if em_pacote:
+            pacotes.remover(registro.destino)
+        else:
+            atual.unlink(missing_ok=True)
+        return str(destino)
+
+    @staticmethod
+    def _ano_mes_emissao(cabecalho: Dict[str, Any]) -> str:
+        """Retorna 'AAAA-MM' da data de emissão, ou 'Sem_Data_Valida'."""
+        try:
+            data_emissao_str = cabecalho.get('data_emissao', '')
+            return datetime.fromisoformat(data_emissao_str).strftime('%Y-%m')
+        except (ValueError, TypeError):
+            return "Sem_Data_Valida"
+
+    def _celula_agregado(self, resultado: Dict[str, Any]) -> Dict[str, Any]:
+        """Argumentos de `AgregadosLote.registrar` para um documento classificado."""
+        analise = resultado['analise_classificacao']
+        cabecalho = resultado['dados_do_documento']['cabecalho']
+        return {
+            "ramo": analise.get('ramo_empresa_detectado', 'Não identificado'),
+            "mes": self._ano_mes_emissao(cabecalho),
+            "centro_custo": analise.get('centro_custo', 'Não definido'),
+            "cfop": analise.get('cfop_info', {}).get('cfop', ''),
+            "valor_total": cabecalho.get('valor_total') or 0.0,
+            "chave_acesso": cabecalho.get('chave_acesso'),
+        }
+
+    def _registrar_agregados(self, agregados: AgregadosLote, resultado: Dict[str, Any]):
+        """Soma o documento classificado aos totais por ramo, mês, centro de custo e CFOP."""
+        agregados.registrar(**self._celula_agregado(resultado))
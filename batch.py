@@ -0,0 +1,111 @@
+"""
+Processamento em lote pela linha de comando.
+
+    python batch.py                              # lote local (o mesmo do botão do dashboard)
+    python batch.py coordenar --trabalhadores 4  # lote distribuído com 4 trabalhadores locais
+    python batch.py trabalhar                    # trabalhador avulso (em outro processo ou máquina)
+    python batch.py --pacotes                    # grava as notas em pacotes mensais compactados
+    python batch.py reclassificar                # reclassifica as notas já extraídas após mudar a configuração
+    python batch.py --max-rss-mb 4096            # lote com teto de memória (e --max-documentos/--max-paginas)
+    python batch.py --perfil --perfil-memoria    # lote local com perfil (cProfile, flamegraph e tracemalloc)
+
+No modo distribuído, o coordenador enfileira os arquivos de 'data/notas' em
+'output/fila_lote.db' e espera os trabalhadores esvaziarem a fila. Trabalhadores em
+outras máquinas precisam enxergar as mesmas pastas 'data/notas' e 'output' (volume
+compartilhado) e devem ser iniciados com --sem-wal. Os limites --max-* valem para cada
+trabalhador; os trabalhadores locais iniciados por 'coordenar' dividem entre si o teto de memória.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+from agent_analyst.orchestrator_agent import OrchestratorAgent, ARQUIVO_FILA_LOTE
+from tools.work_queue import FilaTrabalho, LEASE_PADRAO
+from tools.resource_governor import GovernadorRecursos, MAX_DOCUMENTOS_PADRAO, MAX_PAGINAS_PADRAO, limite_rss_padrao_mb
+
+
+def _resumo(resultado: dict) -> str:
+    return json.dumps({k: v for k, v in resultado.items() if k != 'documentos'}, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Processamento em lote das notas de 'data/notas'.")
+    parser.add_argument('modo', nargs='?', choices=('local', 'coordenar', 'trabalhar', 'reclassificar'), default='local')
+    parser.add_argument('--fila', default=str(Path('output') / ARQUIVO_FILA_LOTE),
+                        help="Banco SQLite da fila de trabalho compartilhada.")
+    parser.add_argument('--trabalhadores', type=int, default=0,
+                        help="(coordenar) Quantos processos trabalhadores iniciar nesta máquina.")
+    parser.add_argument('--lease', type=float, default=LEASE_PADRAO,
+                        help="Segundos que um trabalhador detém uma tarefa sem renovar.")
+    parser.add_argument('--sem-wal', action='store_true',
+                        help="Não usa journal WAL (necessário com trabalhadores em outras máquinas).")
+    parser.add_argument('--novo', action='store_true', help="Inicia um novo lote em vez de retomar o interrompido.")
+    parser.add_argument('--aguardar', action='store_true',
+                        help="(trabalhar) Continua esperando novas tarefas quando a fila esvazia.")
+    parser.add_argument('--pacotes', action='store_true',
+                        help="Anexa as notas a pacotes mensais compactados (output/<Ramo>/<AAAA-MM>.notas.gz) "
+                             "em vez de copiar um arquivo por nota.")
+    parser.add_argument('--max-documentos', type=int, default=MAX_DOCUMENTOS_PADRAO,
+                        help="Máximo de documentos lidos e ainda não concluídos (por processo).")
+    parser.add_argument('--max-paginas', type=int, default=MAX_PAGINAS_PADRAO,
+                        help="Máximo de páginas de PDF renderizadas ao mesmo tempo pelo OCR (por processo).")
+    parser.add_argument('--max-rss-mb', type=float, default=None,
+                        help="Teto de memória residente do processo; acima dele a leitura de novos "
+                             "documentos pausa. Padrão: 80%% da memória disponível; 0 desliga. Com 'coordenar', "
+                             "o teto é dividido entre os trabalhadores locais.")
+    parser.add_argument('--perfil', action='store_true',
+                        help="(local) Captura o perfil do lote (cProfile e pilhas para flamegraph) em "
+                             "output/relatorios/perfil_lote_<run_id>.*")
+    parser.add_argument('--perfil-memoria', action='store_true',
+                        help="(local) Com --perfil, também registra os locais com mais memória alocada (tracemalloc).")
+    args = parser.parse_args()
+
+    agent = OrchestratorAgent()
+
+    if args.modo == 'reclassificar':
+        print(_resumo(agent.reclassificar_extracoes()))
+        return
+
+    governador = GovernadorRecursos(max_documentos=args.max_documentos, max_paginas=args.max_paginas,
+                                    max_rss_mb=args.max_rss_mb)
+    if args.modo == 'local':
+        print(_resumo(agent.processar_lote_notas(retomar=not args.novo, em_pacotes=args.pacotes,
+                                                 governador=governador, perfilar=args.perfil,
+                                                 perfilar_memoria=args.perfil and args.perfil_memoria)))
+        return
+
+    fila = FilaTrabalho(Path(args.fila), lease_segundos=args.lease, wal=not args.sem_wal)
+    try:
+        if args.modo == 'trabalhar':
+            print(_resumo(agent.executar_trabalhador_lote(fila, aguardar_novas=args.aguardar,
+                                                          em_pacotes=args.pacotes, governador=governador)))
+            return
+
+        enfileirado = agent.enfileirar_lote_notas(fila, retomar=not args.novo)
+        if 'run_id' not in enfileirado:
+            print(_resumo(enfileirado))
+            return
+
+        # Os trabalhadores locais dividem o teto de memória da máquina (o padrão ou o informado).
+        max_rss_mb = limite_rss_padrao_mb() if args.max_rss_mb is None else args.max_rss_mb
+        if max_rss_mb and args.trabalhadores:
+            max_rss_mb /= args.trabalhadores
+        comando = [sys.executable, str(Path(__file__).resolve()), 'trabalhar', '--fila', args.fila,
+                   '--lease', str(args.lease), '--max-documentos', str(args.max_documentos),
+                   '--max-paginas', str(args.max_paginas), '--max-rss-mb', str(max_rss_mb or 0)] \
+            + (['--sem-wal'] if args.sem_wal else []) + (['--pacotes'] if args.pacotes else [])
+        processos = [subprocess.Popen(comando) for _ in range(args.trabalhadores)]
+        try:
+            print(_resumo(agent.consolidar_lote_distribuido(fila, enfileirado['run_id'])))
+        finally:
+            for processo in processos:
+                processo.wait()
+    finally:
+        fila.fechar()
+
+
+if __name__ == "__main__":
+    main()
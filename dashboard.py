@@ -1,8 +1,9 @@
 import streamlit as st
+import pandas as pd
 import sys
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-import os
-import json
 
 # Configuração da página
 st.set_page_config(
@@ -11,15 +12,209 @@ st.set_page_config(
     layout="wide"
 )
 
+# Número máximo de documentos analisados em paralelo no upload múltiplo.
+MAX_ANALISES_PARALELAS = 4
+
 # Configuração do path para importação
 sys.path.insert(0, str(Path(__file__).parent))
-from agent_analyst.orchestrator_agent import OrchestratorAgent
+from agent_analyst.orchestrator_agent import OrchestratorAgent, ARQUIVO_CONTROLE_LOTES, ARQUIVO_INDICE_NOTAS
+from tools.batch_aggregates import consultar_agregados
+from tools.notes_index import buscar_notas
+from tools.document_model import para_dict
+
+
+@st.cache_resource(show_spinner=False)
+def obter_orquestrador() -> OrchestratorAgent:
+    """
+    Cria um único orquestrador compartilhado por todas as sessões do navegador,
+    evitando recriar os agentes e recarregar a base de CFOPs a cada nova sessão.
+    O orquestrador pode ser usado por várias threads ao mesmo tempo; as pastas são as
+    do projeto, qualquer que seja o diretório de onde o Streamlit foi iniciado.
+    """
+    raiz = Path(__file__).parent
+    return OrchestratorAgent(data_dir=raiz / "data", output_dir=raiz / "output")
+
+
+@st.cache_data(max_entries=500, show_spinner=False)
+def analisar_upload(hash_conteudo: str, extensao: str, _conteudo: memoryview) -> dict:
+    """
+    Analisa um upload diretamente da memória.
+    O cache é indexado pelo hash do conteúdo (o parâmetro `_conteudo` não entra na chave),
+    então reenviar a mesma nota devolve o resultado imediatamente.
+    """
+    return obter_orquestrador().processar_conteudo(f"upload{extensao}", _conteudo)
+
+
+def analisar_arquivo(arquivo, perfilar: bool = False, perfilar_memoria: bool = False) -> dict:
+    """
+    Analisa um arquivo enviado. Sem perfil, usa o cache de `analisar_upload`; com o perfil
+    ligado, a análise é sempre refeita (um resultado do cache não diria nada sobre o tempo gasto).
+    """
+    # Visão do buffer do upload (sem cópia); os extratores aceitam memoryview.
+    conteudo = arquivo.getbuffer()
+    if perfilar:
+        return obter_orquestrador().processar_conteudo(arquivo.name, conteudo, perfilar=True,
+                                                       perfilar_memoria=perfilar_memoria)
+    hash_conteudo = hashlib.sha256(conteudo).hexdigest()
+    return analisar_upload(hash_conteudo, Path(arquivo.name).suffix.lower(), conteudo)
+
+
+def exibir_perfil(arquivos: dict):
+    """Indica onde foram salvos os arquivos de uma captura de perfil."""
+    rotulos = {'resumo': 'resumo', 'pilhas': 'flamegraph', 'alocacoes': 'alocações', 'cprofile': 'cProfile'}
+    salvos = [f"{rotulo}: `{arquivos[tipo]}`" for tipo, rotulo in rotulos.items() if tipo in arquivos]
+    st.caption("🔬 Perfil salvo — " + " · ".join(salvos))
+
+def resumir_resultado(nome_arquivo: str, resultado: dict) -> dict:
+    """
+    Reduz o resultado completo de uma análise a uma linha da tabela de resumo.
+    """
+    erro = resultado.get('erro') or resultado.get('analise_classificacao', {}).get('erro')
+    cabecalho = resultado.get('dados_do_documento', {}).get('cabecalho', {})
+    analise = resultado.get('analise_classificacao', {})
+    return {
+        'arquivo': nome_arquivo,
+        'status': 'Erro' if erro else 'Sucesso',
+        'numero_nf': cabecalho.get('numero_nf'),
+        'data_emissao': cabecalho.get('data_emissao'),
+        'emitente': cabecalho.get('emitente_nome'),
+        'emitente_cnpj': cabecalho.get('emitente_cnpj'),
+        'valor_total': cabecalho.get('valor_total'),
+        'cfop': analise.get('cfop_info', {}).get('cfop'),
+        'ramo': analise.get('ramo_empresa_detectado'),
+        'tipo_documento': analise.get('tipo_documento'),
+        'centro_custo': analise.get('centro_custo'),
+        'alertas': len(analise.get('alertas_especificos', [])),
+        'dpi_ocr': (resultado.get('dados_do_documento', {}).get('ocr') or {}).get('dpi'),
+        'erro': erro,
+    }
+
+
+def analisar_varios_uploads(uploaded_files: list, perfilar: bool = False, perfilar_memoria: bool = False) -> dict:
+    """
+    Distribui os uploads entre um pool limitado de threads e mostra o status
+    de cada arquivo à medida que sua análise termina. Com o perfil ligado, os
+    arquivos são analisados um por vez, para que cada perfil mostre só o seu documento.
+    Retorna um dicionário {nome_arquivo: resultado}.
+    """
+    # Nomes repetidos recebem um sufixo para que cada upload tenha sua própria linha.
+    nomes = []
+    for arquivo in uploaded_files:
+        nome = arquivo.name
+        while nome in nomes:
+            nome = f"{Path(nome).stem}_{len(nomes)}{Path(nome).suffix}"
+        nomes.append(nome)
+
+    status = {nome: '⏳ Na fila' for nome in nomes}
+    resultados = {}
+
+    barra = st.progress(0.0, text="Analisando documentos...")
+    tabela_status = st.empty()
+    tabela_status.dataframe(pd.DataFrame(status.items(), columns=['arquivo', 'status']), hide_index=True)
+
+    paralelas = 1 if perfilar else MAX_ANALISES_PARALELAS
+    with ThreadPoolExecutor(max_workers=min(paralelas, len(uploaded_files))) as executor:
+        futuros = {executor.submit(analisar_arquivo, arquivo, perfilar, perfilar_memoria): nome
+                   for nome, arquivo in zip(nomes, uploaded_files)}
+
+        for concluidos, futuro in enumerate(as_completed(futuros), start=1):
+            nome = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                resultado = {"erro": f"Falha inesperada na análise: {e}"}
+            resultados[nome] = resultado
+            status[nome] = '❌ Erro' if resumir_resultado(nome, resultado)['erro'] else '✅ Concluído'
+
+            barra.progress(concluidos / len(futuros), text=f"{concluidos}/{len(futuros)} documentos analisados")
+            tabela_status.dataframe(pd.DataFrame(status.items(), columns=['arquivo', 'status']), hide_index=True)
+
+    barra.empty()
+    tabela_status.empty()
+    return resultados
+
+
+def formatar_resultados_lote(resultados: dict):
+    """
+    Renderiza a tabela de resumo (ordenável) das análises de vários uploads,
+    o botão de download em CSV e o detalhamento de um documento escolhido.
+    """
+    resumo = pd.DataFrame([resumir_resultado(nome, resultado) for nome, resultado in resultados.items()])
+
+    col_total, col_sucesso, col_falha = st.columns(3)
+    col_total.metric("Total de Arquivos", len(resumo))
+    col_sucesso.metric("Classificados com Sucesso", int((resumo['status'] == 'Sucesso').sum()))
+    col_falha.metric("Falhas", int((resumo['status'] == 'Erro').sum()))
+
+    st.subheader("Sumário das Classificações")
+    st.dataframe(resumo, hide_index=True)
+    st.download_button(
+        "📥 Baixar classificações (CSV)",
+        data=resumo.to_csv(index=False).encode('utf-8'),
+        file_name="classificacoes_nfe.csv",
+        mime="text/csv",
+    )
+
+    st.markdown("---")
+    arquivo_escolhido = st.selectbox("Ver análise detalhada de:", list(resultados.keys()))
+    if arquivo_escolhido:
+        formatar_resultado(resultados[arquivo_escolhido])
+
+
+def exibir_agregados():
+    """
+    Exibe os totais acumulados dos lotes (quantidade e valor por ramo, mês,
+    centro de custo e CFOP), com filtros. Os totais já vêm prontos do banco
+    de controle dos lotes, sem reprocessar nenhum arquivo.
+    """
+    agregados = pd.DataFrame(consultar_agregados(obter_orquestrador().output_dir / ARQUIVO_CONTROLE_LOTES))
+    if agregados.empty:
+        st.caption("Nenhum lote processado ainda. Os totais aparecem aqui após o primeiro processamento em lote.")
+        return
+
+    rotulos = {'ramo': 'Ramo', 'mes': 'Mês', 'centro_custo': 'Centro de Custo', 'cfop': 'CFOP'}
+    colunas_filtro = st.columns(len(rotulos))
+    for coluna, (dimensao, rotulo) in zip(colunas_filtro, rotulos.items()):
+        selecionados = coluna.multiselect(rotulo, sorted(agregados[dimensao].unique()), key=f"filtro_{dimensao}")
+        if selecionados:
+            agregados = agregados[agregados[dimensao].isin(selecionados)]
+
+    col_qtd, col_valor = st.columns(2)
+    col_qtd.metric("Notas", f"{int(agregados['quantidade'].sum()):,}")
+    col_valor.metric("Valor Total", f"R$ {agregados['valor_total'].sum():,.2f}")
+
+    agrupar_por = st.selectbox("Agrupar por", list(rotulos.keys()), format_func=rotulos.get)
+    tabela = (agregados.groupby(agrupar_por, as_index=False)[['quantidade', 'valor_total']].sum()
+              .sort_values('valor_total', ascending=False))
+    st.dataframe(tabela.rename(columns=rotulos), hide_index=True)
+
+
+def exibir_busca_notas():
+    """
+    Caixa de busca sobre o índice das notas já organizadas em lote.
+    """
+    termo = st.text_input(
+        "Buscar por chave de acesso, CNPJ, CFOP ou descrição de item",
+        placeholder="Ex.: 35240112345678000190550010000001231000001230, 12345678000190, 5.102 ou parafuso",
+    )
+    if not termo:
+        return
+
+    notas = buscar_notas(obter_orquestrador().output_dir / ARQUIVO_INDICE_NOTAS, termo)
+    if notas:
+        st.caption(f"{len(notas)} nota(s) encontrada(s).")
+        st.dataframe(pd.DataFrame(notas), hide_index=True)
+    else:
+        st.caption("Nenhuma nota encontrada no índice.")
 
 
 def formatar_resultado(resultado: dict):
     """
     Função dedicada a renderizar o dicionário de resultados na interface do Streamlit.
     """
+    if resultado.get('perfil'):
+        exibir_perfil(resultado['perfil'])
+
     if "erro" in resultado:
         st.error(f"❌ **Erro no Processamento:** {resultado['erro']}")
         return
@@ -30,7 +225,7 @@ def formatar_resultado(resultado: dict):
     if "erro" in analise:
         st.error(f"❌ **Erro na Classificação:** {analise['erro']}")
         with st.expander("Ver dados extraídos do documento (JSON)"):
-            st.json(dados_doc)
+            st.json(para_dict(dados_doc))
         return
 
     st.success("✅ Documento processado e classificado com sucesso!")
@@ -45,6 +240,11 @@ def formatar_resultado(resultado: dict):
         st.markdown(f"**Emissão:** `{cabecalho.get('data_emissao', 'N/A')}`")
         st.markdown(f"**Emitente:** `{cabecalho.get('emitente_nome', 'N/A')}`")
         st.markdown(f"**CNPJ Emitente:** `{cabecalho.get('emitente_cnpj', 'N/A')}`")
+        leitura_ocr = dados_doc.get('ocr')
+        if leitura_ocr:
+            st.caption(f"🔎 Lido por OCR em {leitura_ocr['dpi']} DPI ({leitura_ocr['tentativas']} renderização(ões)).")
+            if leitura_ocr['campos_invalidos']:
+                st.warning(f"Campos que não passaram na validação do OCR: {', '.join(leitura_ocr['campos_invalidos'])}.")
 
     with col2:
         st.subheader("📊 Classificação Automática")
@@ -91,7 +291,7 @@ def formatar_resultado(resultado: dict):
         st.caption("Nenhuma recomendação específica foi gerada.")
 
     with st.expander("Ver dados completos da análise (formato JSON)"):
-        st.json(resultado)
+        st.json(para_dict(resultado))
 
 
 def main():
@@ -101,19 +301,32 @@ def main():
     st.title("🤖 Analisador e Classificador de Notas Fiscais")
 
     try:
-        if 'agent' not in st.session_state:
-            with st.spinner("🚀 Inicializando agentes e carregando configurações..."):
-                st.session_state.agent = OrchestratorAgent()
-
-        agent = st.session_state.agent
+        with st.spinner("🚀 Inicializando agentes e carregando configurações..."):
+            agent = obter_orquestrador()
 
         st.sidebar.title("⚙️ Ações")
         st.sidebar.header("Processamento em Lote")
-        st.sidebar.info("Processe e organize todos os arquivos da pasta `data/notas/`.")
+        st.sidebar.info("Processe e organize todos os arquivos da pasta `data/notas/`, inclusive os que estão dentro de arquivos `.zip`/`.tar`.")
+
+        em_pacotes = st.sidebar.checkbox(
+            "Gravar em pacotes mensais compactados",
+            help="Anexa as notas a `output/<Ramo>/<AAAA-MM>.notas.gz` (com índice por chave de acesso) "
+                 "em vez de copiar um arquivo por nota.")
+
+        with st.sidebar.expander("🔬 Perfil de desempenho"):
+            perfilar = st.checkbox(
+                "Capturar perfil (cProfile)",
+                help="Vale para o lote e para a análise de uploads. Salva o perfil, um resumo e as pilhas "
+                     "para flamegraph em `output/relatorios/perfil_*`.")
+            perfilar_memoria = st.checkbox(
+                "Incluir alocações de memória (tracemalloc)", disabled=not perfilar,
+                help="Registra os locais com mais memória alocada. Deixa a execução bem mais lenta.")
+            perfilar_memoria = perfilar and perfilar_memoria
 
         if st.sidebar.button("Organizar Notas em Lote"):
             with st.spinner("⏳ Processando arquivos em lote... Isso pode levar alguns minutos."):
-                resultado_lote = agent.processar_lote_notas()
+                resultado_lote = agent.processar_lote_notas(em_pacotes=em_pacotes, perfilar=perfilar,
+                                                            perfilar_memoria=perfilar_memoria)
 
             st.header("🏁 Resultado do Processamento em Lote")
             if "erro" in resultado_lote:
@@ -123,6 +336,9 @@ def main():
             else:
                 # Mensagem de sucesso clara
                 st.success("✅ Organização da Pasta Concluída com Sucesso!")
+                if resultado_lote.get('retomado'):
+                    st.info(f"🔁 O lote `{resultado_lote['run_id']}` havia sido interrompido e foi retomado "
+                            "de onde parou; os documentos já concluídos não foram reprocessados.")
                 st.markdown("---")
 
                 # Tabela de Resumo
@@ -131,45 +347,79 @@ def main():
                 col_total.metric("Total de Arquivos", resultado_lote['total'])
                 col_sucesso.metric("Processados com Sucesso", resultado_lote['sucesso'])
                 col_falha.metric("Falhas (Mantidos na Entrada)", resultado_lote['falhas'])
+                if resultado_lote.get('duplicadas'):
+                    st.caption(f"♊ {resultado_lote['duplicadas']} arquivos repetiam a chave de acesso de outra nota "
+                               "do lote e não foram processados de novo.")
 
                 if resultado_lote['falhas'] > 0:
                     st.warning(
-                        f"⚠️ **Atenção:** {resultado_lote['falhas']} arquivos falharam no processamento e foram mantidos na pasta de entrada (`data/notas/`). Verifique o console para detalhes dos erros."
+                        f"⚠️ **Atenção:** {resultado_lote['falhas']} arquivos falharam no processamento e foram mantidos na pasta de entrada (`data/notas/`)."
                     )
+                    falhas = [doc for doc in resultado_lote.get('documentos', []) if doc['erro']]
+                    with st.expander("Ver documentos com falha"):
+                        st.dataframe(pd.DataFrame(falhas, columns=['arquivo', 'membro', 'erro']), hide_index=True)
 
                 st.info(
                     f"Os arquivos classificados foram **copiados** para a estrutura de pastas em: `{resultado_lote['output_path']}`")
                 st.caption("Os arquivos originais foram mantidos na pasta de entrada.")
+                st.caption(f"Lote `{resultado_lote['run_id']}` — relatório salvo em `{resultado_lote['relatorio_path']}`.")
+                recursos = resultado_lote.get('recursos')
+                if recursos:
+                    contencoes = sum(recursos['contencoes'].values())
+                    st.caption(f"Pico de memória: {recursos['pico_rss_mb']:,.0f} MB — "
+                               f"{contencoes} pausas por limite de recursos "
+                               f"(documentos: {recursos['contencoes']['documentos']}, "
+                               f"páginas: {recursos['contencoes']['paginas']}, "
+                               f"memória: {recursos['contencoes']['memoria']}).")
+                if resultado_lote.get('perfil'):
+                    exibir_perfil(resultado_lote['perfil'])
+
+        st.sidebar.header("Reclassificação")
+        st.sidebar.info("Após alterar ramos, centros de custo, mapa CNAE, regras ou a tabela de CFOPs, "
+                        "reclassifique as notas já processadas sem reler os arquivos.")
+        if st.sidebar.button("Reclassificar Notas Processadas"):
+            with st.spinner("🔁 Reclassificando a partir das extrações guardadas..."):
+                resultado_reclassificacao = agent.reclassificar_extracoes()
+            # Os resultados memorizados das análises de upload usavam a configuração anterior.
+            analisar_upload.clear()
+
+            st.header("🔁 Resultado da Reclassificação")
+            if "info" in resultado_reclassificacao:
+                st.info(resultado_reclassificacao["info"])
+            else:
+                col_total, col_avaliados, col_alterados = st.columns(3)
+                col_total.metric("Notas Guardadas", resultado_reclassificacao['total'])
+                col_avaliados.metric("Reavaliadas", resultado_reclassificacao['avaliados'])
+                col_alterados.metric("Com Resultado Alterado", resultado_reclassificacao['alterados'])
+                if resultado_reclassificacao['documentos']:
+                    st.dataframe(pd.DataFrame(resultado_reclassificacao['documentos']), hide_index=True)
 
         st.sidebar.markdown("---")
 
-        st.header("Análise de Arquivo Individual")
-        st.markdown("Faça o upload de um único arquivo **XML ou PDF** para uma análise detalhada.")
+        with st.expander("📈 Totais Acumulados dos Lotes"):
+            exibir_agregados()
 
-        uploaded_file = st.file_uploader(
-            "Selecione o arquivo da NF-e",
-            type=['xml', 'pdf'],
-            help="Arraste e solte ou clique para selecionar o arquivo XML ou PDF da sua nota fiscal."
-        )
+        with st.expander("🔎 Buscar Notas Processadas"):
+            exibir_busca_notas()
 
-        # --- LINHA CORRIGIDA ---
-        # Verifica se um novo arquivo foi carregado antes de reprocessar.
-        if uploaded_file is not None and uploaded_file != st.session_state.get('processed_file'):
-            # --- FIM DA CORREÇÃO ---
-            upload_dir = Path("data/uploads")
-            upload_dir.mkdir(exist_ok=True)
-            file_path = upload_dir / uploaded_file.name
+        st.header("Análise de Arquivos")
+        st.markdown("Faça o upload de um ou vários arquivos **XML ou PDF** para uma análise detalhada.")
 
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+        uploaded_files = st.file_uploader(
+            "Selecione os arquivos da NF-e",
+            type=['xml', 'pdf'],
+            accept_multiple_files=True,
+            help="Arraste e solte ou clique para selecionar os arquivos XML ou PDF das suas notas fiscais."
+        )
 
+        if len(uploaded_files) == 1:
+            uploaded_file = uploaded_files[0]
             with st.spinner(f"🔍 Analisando o documento `{uploaded_file.name}`..."):
-                resultado = agent.processar_documento(str(file_path))
-                formatar_resultado(resultado)
-
-            # Armazena a referência do arquivo processado para evitar reprocessamento
-            st.session_state.processed_file = uploaded_file
-            os.remove(file_path)
+                resultado = analisar_arquivo(uploaded_file, perfilar, perfilar_memoria)
+            formatar_resultado(resultado)
+        elif uploaded_files:
+            resultados = analisar_varios_uploads(uploaded_files, perfilar, perfilar_memoria)
+            formatar_resultados_lote(resultados)
 
     except Exception as e:
         st.error(f"❌ Ocorreu um erro fatal na aplicação: {str(e)}")
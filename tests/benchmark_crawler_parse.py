@@ -0,0 +1,44 @@
+"""
+Compara o tempo da tokenização antiga (regex com `.+?` e lookahead) com a passada única
+de `_tokenizar_cfops`/`_limpar_descricao`, na página salva do CONFAZ repetida e num texto
+patológico (marcadores longe uns dos outros e notas de redação sem fim).
+
+Uso: python tests/benchmark_crawler_parse.py [repeticoes]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from test_crawler_parse import pares_antigos, pares_novos, texto_fixture  # noqa: E402
+
+
+def _medir(funcao, texto, rodadas=5):
+    melhor = float('inf')
+    for _ in range(rodadas):
+        inicio = time.perf_counter()
+        resultado = funcao(texto)
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, resultado
+
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    textos = {
+        f"página do CONFAZ x{repeticoes}": texto_fixture() * repeticoes,
+        "texto patológico": " ".join(f"{i % 9 + 1}.{i % 1000:03d} - Redação anterior " + "palavra " * 400
+                                      for i in range(200)),
+    }
+    for nome, texto in textos.items():
+        tempo_antigo, antigos = _medir(pares_antigos, texto)
+        tempo_novo, novos = _medir(pares_novos, texto)
+        iguais = "✅ resultados iguais" if antigos == novos else "❌ resultados diferentes"
+        print(f"📊 {nome} ({len(texto) / 1024:.0f} KiB, {len(novos)} CFOPs): "
+              f"antiga {tempo_antigo * 1000:.1f} ms, nova {tempo_novo * 1000:.1f} ms "
+              f"({tempo_antigo / tempo_novo:.1f}x) — {iguais}")
+
+
+if __name__ == '__main__':
+    main()
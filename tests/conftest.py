@@ -0,0 +1,141 @@
+import csv
+import json
+import socket
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+# Os testes importam os módulos do projeto ('tools', 'agent_analyst') a partir da raiz.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class _Requisicao(BaseHTTPRequestHandler):
+    def do_GET(self):
+        servidor = self.server.local
+        servidor.requisicoes.append((self.path, dict(self.headers)))
+        rota = servidor.rotas.get(self.path)
+        if rota is None:
+            status, headers, corpo = 404, {}, b''
+        else:
+            status, headers, corpo = rota(self)
+        try:
+            self.send_response(status)
+            for nome, valor in headers.items():
+                self.send_header(nome, valor)
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+        except (BrokenPipeError, ConnectionResetError):
+            # O cliente desistiu (timeout ou resposta descartada).
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class ServidorLocal:
+    """
+    Servidor HTTP local que simula os endpoints remotos nos testes.
+    `rotas` associa um caminho a uma função (requisição) -> (status, headers, corpo);
+    `liberar` solta as rotas que ficam presas esperando.
+    """
+
+    def __init__(self):
+        self.rotas = {}
+        self.requisicoes = []
+        self.liberar = threading.Event()
+        self._http = ThreadingHTTPServer(('127.0.0.1', 0), _Requisicao)
+        self._http.daemon_threads = True
+        self._http.local = self
+        self._thread = threading.Thread(target=self._http.serve_forever, daemon=True)
+
+    def url(self, caminho: str) -> str:
+        return f"http://127.0.0.1:{self._http.server_address[1]}{caminho}"
+
+    def iniciar(self):
+        self._thread.start()
+
+    def parar(self):
+        self.liberar.set()
+        self._http.shutdown()
+        self._http.server_close()
+
+
+@pytest.fixture
+def servidor_http():
+    servidor = ServidorLocal()
+    servidor.iniciar()
+    yield servidor
+    servidor.parar()
+
+
+@pytest.fixture
+def porta_recusada():
+    """URL de uma porta local sem nenhum servidor escutando (conexão recusada)."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        porta = sock.getsockname()[1]
+    return f"http://127.0.0.1:{porta}/"
+
+
+NS_NFE = 'http://www.portalfiscal.inf.br/nfe'
+# (CNAE, CFOP, descrição dos itens) de uma nota de cada ramo configurado em `pasta_dados`.
+PERFIS_NOTA = [
+    ("0111301", "5.101", "Soja em grãos"),
+    ("2910701", "5.401", "pneu aro 15"),
+    ("1091100", "1.101", "matéria-prima x"),
+    ("4711302", "5.405", "Mercadoria"),
+    ("9430800", "5.933", "serviço de manutenção"),
+]
+CFOPS_TABELA = ["1.101", "1.102", "2.101", "5.101", "5.102", "5.401", "5.403", "5.405",
+                "6.101", "6.102", "6.401", "5.933", "6.933"]
+
+
+def gerar_nfe(numero: int, cnae: str, cfop: str, descricao: str = "Produto", itens: int = 3,
+              valor_total: Optional[float] = None, chave: Optional[str] = None) -> bytes:
+    """XML de uma NF-e mínima (ide/emit/dest, itens e total) para os testes."""
+    dets = "".join(
+        f'<det nItem="{k + 1}"><prod><cProd>P{k}</cProd><xProd>{descricao} {k}</xProd>'
+        f'<CFOP>{cfop.replace(".", "")}</CFOP><qCom>2</qCom><vUnCom>10.5</vUnCom><vProd>21.0</vProd></prod></det>'
+        for k in range(itens))
+    chave = chave or f"352401{numero:038d}"
+    valor_total = 100 + numero if valor_total is None else valor_total
+    return (f'<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="{NS_NFE}"><NFe><infNFe Id="NFe{chave}">'
+            f'<ide><nNF>{numero}</nNF><dhEmi>2024-0{1 + numero % 3}-10T10:00:00-03:00</dhEmi></ide>'
+            f'<emit><CNPJ>1234567800019{numero % 3}</CNPJ><xNome>Emitente {numero % 3}</xNome><CNAE>{cnae}</CNAE></emit>'
+            f'<dest><CNPJ>00394460000141</CNPJ><xNome>Destinatario</xNome></dest>{dets}'
+            f'<total><ICMSTot><vNF>{valor_total:.2f}</vNF></ICMSTot></total></infNFe></NFe></nfeProc>').encode('utf-8')
+
+
+@pytest.fixture
+def pasta_dados(tmp_path):
+    """Pasta 'data' com a configuração mínima (centros de custo, ramos, mapa CNAE e tabela de CFOPs)."""
+    dados = tmp_path / "data"
+    (dados / "notas").mkdir(parents=True)
+    (dados / "centros_custo.json").write_text(json.dumps({"centros_custo": {
+        "suprimentos": {"nome": "Suprimentos", "cfops_associados": ["1.101", "2.101", "1.102"]},
+        "vendas": {"nome": "Vendas", "cfops_associados": ["5.101", "5.102", "6.102"]},
+    }}), encoding='utf-8')
+    (dados / "ramos_atividade.json").write_text(json.dumps({
+        ramo: {"nome": ramo.capitalize(), "centros_custo_prioritarios": ["suprimentos", "vendas"],
+               "impostos_especificos": ["ICMS", "IPI"], "particularidades": [f"Particularidade {ramo}"],
+               "documentos_obrigatorios": ["Contrato"], "cfops_entrada_comuns": ["1.101"],
+               "cfops_saida_comuns": ["5.101"]}
+        for ramo in ("agronegocio", "automotivo", "industria", "comercio", "servicos")
+    }), encoding='utf-8')
+    (dados / "cnae_ramo_map.json").write_text(json.dumps({
+        "01": "agronegocio", "29": "automotivo", "10": "industria", "47": "comercio", "94": "servicos",
+        "default": "comercio",
+    }), encoding='utf-8')
+    with open(dados / "cfop_confaz_20240101_000000.csv", 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=['cfop', 'descricao', 'tipo_operacao', 'fonte', 'data_extracao'])
+        escritor.writeheader()
+        for cfop in CFOPS_TABELA:
+            escritor.writerow({"cfop": cfop, "descricao": f"Descrição {cfop}",
+                               "tipo_operacao": "Entrada" if cfop[0] in "123" else "Saída",
+                               "fonte": "CONFAZ", "data_extracao": "2024-01-01 00:00:00"})
+    return dados
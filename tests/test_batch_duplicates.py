@@ -0,0 +1,78 @@
+import zipfile
+
+import pytest
+
+from agent_analyst.orchestrator_agent import OrchestratorAgent
+
+from conftest import PERFIS_NOTA, gerar_nfe
+
+CNAE, CFOP, DESCRICAO = PERFIS_NOTA[3]
+
+
+def _status(relatorio):
+    return {(doc["arquivo"], doc["membro"]): doc["status"] for doc in relatorio["documentos"]}
+
+
+def _zip(caminho, membros):
+    with zipfile.ZipFile(caminho, 'w') as zf:
+        for nome, conteudo in membros.items():
+            zf.writestr(nome, conteudo)
+
+
+@pytest.fixture
+def orquestrador(pasta_dados, tmp_path):
+    return OrchestratorAgent(data_dir=pasta_dados, output_dir=tmp_path / "output")
+
+
+def test_copias_sao_duplicadas_quando_a_primeira_da_certo(orquestrador, pasta_dados):
+    nota = gerar_nfe(1, CNAE, CFOP, DESCRICAO)
+    (pasta_dados / "notas" / "nota.xml").write_bytes(nota)
+    _zip(pasta_dados / "notas" / "b.zip", {"copia.xml": nota})
+
+    relatorio = orquestrador.processar_lote_notas()
+
+    assert _status(relatorio) == {("nota.xml", None): "sucesso", ("b.zip", "copia.xml"): "duplicada"}
+    assert (relatorio["sucesso"], relatorio["falhas"], relatorio["duplicadas"]) == (1, 0, 1)
+
+
+def test_copia_seguinte_e_processada_quando_a_primeira_falha(orquestrador, pasta_dados):
+    # Mesma chave de acesso, mas a cópia solta não tem CFOP nos itens e falha na classificação.
+    (pasta_dados / "notas" / "nota.xml").write_bytes(gerar_nfe(1, CNAE, "", DESCRICAO))
+    nota = gerar_nfe(1, CNAE, CFOP, DESCRICAO)
+    _zip(pasta_dados / "notas" / "b.zip", {"copia.xml": nota})
+    _zip(pasta_dados / "notas" / "c.zip", {"copia.xml": nota})
+
+    relatorio = orquestrador.processar_lote_notas()
+
+    assert _status(relatorio) == {("nota.xml", None): "falha", ("b.zip", "copia.xml"): "sucesso",
+                                  ("c.zip", "copia.xml"): "duplicada"}
+
+
+def test_todas_as_copias_falhando_sao_todas_tentadas(orquestrador, pasta_dados):
+    nota_sem_cfop = gerar_nfe(1, CNAE, "", DESCRICAO)
+    (pasta_dados / "notas" / "nota.xml").write_bytes(nota_sem_cfop)
+    _zip(pasta_dados / "notas" / "b.zip", {"copia.xml": nota_sem_cfop})
+
+    relatorio = orquestrador.processar_lote_notas()
+
+    assert set(_status(relatorio).values()) == {"falha"}
+    assert relatorio["falhas"] == 2
+
+
+def test_retomada_nao_marca_duplicada_a_copia_de_um_original_que_falhou(orquestrador, pasta_dados, monkeypatch):
+    (pasta_dados / "notas" / "nota.xml").write_bytes(gerar_nfe(1, CNAE, "", DESCRICAO))
+    _zip(pasta_dados / "notas" / "b.zip", {"copia.xml": gerar_nfe(1, CNAE, CFOP, DESCRICAO)})
+
+    def interromper(self, identificador):
+        raise KeyboardInterrupt
+
+    # Interrompe o lote logo depois da primeira passada, antes de as cópias adiadas serem resolvidas.
+    with monkeypatch.context() as contexto:
+        contexto.setattr("tools.batch_journal.DiarioLote.concluido_com_sucesso", interromper)
+        with pytest.raises(KeyboardInterrupt):
+            orquestrador.processar_lote_notas()
+
+    relatorio = orquestrador.processar_lote_notas()
+
+    assert relatorio["retomado"]
+    assert _status(relatorio) == {("nota.xml", None): "falha", ("b.zip", "copia.xml"): "sucesso"}
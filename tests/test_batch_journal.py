@@ -0,0 +1,43 @@
+import os
+
+from tools import batch_journal
+from tools.batch_journal import DiarioLote
+
+
+def test_checkpoint_sincroniza_so_as_copias_do_grupo(tmp_path, monkeypatch):
+    sincronizados = []
+
+    def fsync(caminho, diretorio=False):
+        sincronizados.append((caminho, diretorio))
+
+    def sync():
+        raise AssertionError("o checkpoint não deve sincronizar o sistema de arquivos inteiro")
+
+    monkeypatch.setattr(batch_journal, "_fsync", fsync)
+    monkeypatch.setattr(os, "sync", sync, raising=False)
+
+    ramo = tmp_path / "output" / "Agronegocio"
+    pacote = tmp_path / "output" / "Varejo" / "2024-01.notas.gz"
+    diario = DiarioLote(tmp_path / "controle_lotes.db", tmp_path / "notas")
+    try:
+        diario.registrar("a.xml", "1:1", "a.xml", None, destino=str(ramo / "a.xml"))
+        diario.registrar("b.xml", "1:1", "b.xml", None, destino=str(ramo / "b.xml"))
+        diario.registrar("c.zip/c.xml", "1:1", "c.zip", "c.xml", destino=f"{pacote}!3524")
+        diario.registrar("d.zip/d.xml", "1:1", "d.zip", "d.xml", destino=f"{pacote}!3525")
+        diario.registrar("e.xml", "1:1", "e.xml", None, erro="CFOP ausente")
+        diario.checkpoint()
+    finally:
+        diario.fechar()
+
+    assert sorted(sincronizados) == sorted([
+        (ramo / "a.xml", False), (ramo / "b.xml", False), (pacote, False),
+        (ramo, True), (pacote.parent, True),
+    ])
+    assert diario.total_concluidos == 5
+
+
+def test_sincronizar_destinos_no_disco(tmp_path):
+    arquivo = tmp_path / "nota.xml"
+    arquivo.write_bytes(b"<nfe/>")
+    # Arquivos existentes e removidos (ex.: substituídos depois) são aceitos sem erro.
+    batch_journal.sincronizar_destinos([str(arquivo), str(tmp_path / "removida.xml"), None])
@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+from tools.crawler import CFOPConfazCrawler
+
+PAGINA_CFOP = ("<html><body><div id='content'>"
+               "1.101 - Compra para industrialização ou produção rural. "
+               "5.101 - Venda de produção do estabelecimento."
+               "</div></body></html>").encode('utf-8')
+PAGINA_SEM_CFOP = b"<html><body>Sistema em manutencao. Tente novamente mais tarde.</body></html>"
+
+
+def _ok(requisicao):
+    return 200, {'Content-Type': 'text/html; charset=utf-8'}, PAGINA_CFOP
+
+
+def _lento(atraso):
+    def rota(requisicao):
+        time.sleep(atraso)
+        return _ok(requisicao)
+    return rota
+
+
+def _erro_500(requisicao):
+    return 500, {}, b'erro interno'
+
+
+def _sem_cfops(requisicao):
+    return 200, {'Content-Type': 'text/html'}, PAGINA_SEM_CFOP
+
+
+@pytest.fixture
+def servidor(servidor_http):
+    servidor_http.rotas.update({
+        '/ok': _ok,
+        '/lento': _lento(1.0),
+        '/erro': _erro_500,
+        '/sem_cfops': _sem_cfops,
+        # Aceita a conexão e nunca responde (até o fim do teste).
+        '/trava': lambda requisicao: (servidor_http.liberar.wait(60), _ok(requisicao))[1],
+    })
+    return servidor_http
+
+
+def _crawler(tmp_path, urls, prazo_total=10.0, atraso_hedge=0.3):
+    return CFOPConfazCrawler(urls=urls, data_dir=tmp_path, prazo_total=prazo_total, atraso_hedge=atraso_hedge)
+
+
+def _buscar(crawler):
+    inicio = time.monotonic()
+    resposta = crawler.tentar_conexao_segura()
+    return resposta, time.monotonic() - inicio
+
+
+def test_primeira_url_valida_responde_sem_hedge(tmp_path, servidor):
+    crawler = _crawler(tmp_path, [servidor.url('/ok'), servidor.url('/lento')], atraso_hedge=5.0)
+    resposta, duracao = _buscar(crawler)
+
+    assert resposta.url == servidor.url('/ok')
+    assert duracao < 2.0
+    # A resposta chegou antes do atraso do hedge: a segunda URL nem foi consultada.
+    assert [caminho for caminho, _ in servidor.requisicoes] == ['/ok']
+
+
+def test_url_travada_e_superada_pelo_hedge(tmp_path, servidor):
+    crawler = _crawler(tmp_path, [servidor.url('/trava'), servidor.url('/ok')], atraso_hedge=0.3)
+    resposta, duracao = _buscar(crawler)
+
+    assert resposta.url == servidor.url('/ok')
+    # A segunda URL só começa depois do atraso do hedge, e a resposta não espera a primeira.
+    assert 0.3 <= duracao < 2.0
+
+
+def test_url_rapida_vence_a_lenta_iniciada_antes(tmp_path, servidor):
+    crawler = _crawler(tmp_path, [servidor.url('/lento'), servidor.url('/ok')], atraso_hedge=0.2)
+    resposta, duracao = _buscar(crawler)
+
+    assert resposta.url == servidor.url('/ok')
+    assert 0.2 <= duracao < 1.0
+
+
+def test_falhas_antecipam_a_proxima_url(tmp_path, servidor, porta_recusada):
+    # Com todas as URLs iniciadas já falhando, a próxima começa sem esperar o atraso do hedge.
+    crawler = _crawler(tmp_path, [porta_recusada, servidor.url('/erro'), servidor.url('/sem_cfops'),
+                                  servidor.url('/ok')], atraso_hedge=30.0)
+    resposta, duracao = _buscar(crawler)
+
+    assert resposta.url == servidor.url('/ok')
+    assert duracao < 10.0
+
+
+def test_resposta_200_sem_tabela_nao_e_aceita(tmp_path, servidor):
+    crawler = _crawler(tmp_path, [servidor.url('/sem_cfops'), servidor.url('/lento')], atraso_hedge=5.0)
+    resposta, _ = _buscar(crawler)
+
+    assert resposta.url == servidor.url('/lento')
+    assert b'1.101' in resposta.content
+
+
+def test_todas_falham_retorna_none_antes_do_prazo(tmp_path, servidor, porta_recusada):
+    crawler = _crawler(tmp_path, [servidor.url('/erro'), servidor.url('/sem_cfops'), porta_recusada],
+                       prazo_total=30.0, atraso_hedge=0.1)
+    resposta, duracao = _buscar(crawler)
+
+    assert resposta is None
+    assert duracao < 10.0
+
+
+def test_retorna_none_ao_esgotar_o_prazo_total(tmp_path, servidor):
+    crawler = _crawler(tmp_path, [servidor.url('/trava'), servidor.url('/trava')],
+                       prazo_total=1.0, atraso_hedge=0.2)
+    resposta, duracao = _buscar(crawler)
+
+    assert resposta is None
+    assert 1.0 <= duracao < 1.5
+
+
+def test_304_da_requisicao_condicional_e_aceito(tmp_path, servidor):
+    def condicional(requisicao):
+        if requisicao.headers.get('If-None-Match') == '"v1"':
+            return 304, {'ETag': '"v1"'}, b''
+        return 200, {'ETag': '"v1"'}, PAGINA_CFOP
+    servidor.rotas['/condicional'] = condicional
+    url = servidor.url('/condicional')
+
+    resposta = _crawler(tmp_path, [url]).tentar_conexao_segura({url: {'etag': '"v1"'}})
+
+    assert resposta.status_code == 304
+    assert servidor.requisicoes[-1][1].get('If-None-Match') == '"v1"'
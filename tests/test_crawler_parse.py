@@ -0,0 +1,72 @@
+import re
+from pathlib import Path
+
+import pytest
+from bs4 import BeautifulSoup
+
+from tools.crawler import CFOPConfazCrawler, _limpar_descricao, _tokenizar_cfops
+
+FIXTURE_CONFAZ = Path(__file__).parent / "fixtures" / "cfop_confaz.html"
+
+# Tokenização anterior à passada única: regex com `.+?` e lookahead, mais as duas limpezas com `.*?`.
+_RE_CFOP_ANTIGA = re.compile(r'(\d\.\d{3})\s*[-–—]\s*(.+?)(?=\s*\d\.\d{3}\s*[-–—]|$)', re.DOTALL)
+
+
+def pares_antigos(texto):
+    pares = []
+    for codigo, descricao in _RE_CFOP_ANTIGA.findall(texto):
+        descricao_limpa = re.sub(r'\s+', ' ', descricao).strip()
+        descricao_limpa = re.sub(r'Redação.*?(?=Classificam-se|$)', '', descricao_limpa, flags=re.IGNORECASE)
+        descricao_limpa = re.sub(r'Classificam-se neste código.*?(?=\d\.\d{3}|$)', '', descricao_limpa,
+                                 flags=re.IGNORECASE)
+        pares.append((codigo.strip(), descricao_limpa.strip()))
+    return pares
+
+
+def pares_novos(texto):
+    return [(codigo, _limpar_descricao(descricao)) for codigo, descricao in _tokenizar_cfops(texto)]
+
+
+def texto_fixture():
+    secao = BeautifulSoup(FIXTURE_CONFAZ.read_bytes(), 'lxml').select_one('div#content')
+    return secao.get_text(separator=' ')
+
+
+def test_pagina_salva_tokeniza_igual_a_regex_antiga():
+    texto = texto_fixture()
+    novos = pares_novos(texto)
+
+    assert novos == pares_antigos(texto)
+    assert len(novos) > 30
+    assert ("1.102", "Compra para comercialização") in novos
+
+
+@pytest.mark.parametrize('texto', [
+    "",
+    "sem nenhum código",
+    "1.101 -",
+    "1.101 - ",
+    "1.101 -x",
+    "1.101 - 5.102 - Venda",
+    "1.101 -5.102 - Venda",
+    "1.101 –\n\tCompra\r\n 5.102—Venda 6.933 -",
+    "1.101 - Compra Redação anterior: x 5.102 - Venda",
+    "1.101 - Compra Redação anterior Classificam-se neste código as compras 5.102 - Venda",
+    "1.101 - Compra REDAÇÃO dada Classificam-se neste código 1.234 ver 5.102 - Venda",
+    "1.101 - Compra Classificam-se neste código ... redação: 9.999 fim",
+    "12.345 - não é CFOP 1.101 - Compra 1.1010 - x",
+])
+def test_casos_limite_tokenizam_igual_a_regex_antiga(texto):
+    assert pares_novos(texto) == pares_antigos(texto)
+
+
+def test_parsear_html_da_pagina_salva(tmp_path):
+    crawler = CFOPConfazCrawler(urls=[], data_dir=tmp_path)
+    cfops = crawler._parsear_html(FIXTURE_CONFAZ.read_bytes())
+
+    codigos = [cfop['cfop'] for cfop in cfops]
+    assert codigos == sorted(set(codigos), key=lambda codigo: [int(parte) for parte in codigo.split('.')])
+    por_codigo = {cfop['cfop']: cfop for cfop in cfops}
+    assert por_codigo['5.102']['descricao'] == "Venda de mercadoria adquirida ou recebida de terceiros"
+    assert por_codigo['5.102']['tipo_operacao'] == 'Saída'
+    assert por_codigo['2.102']['tipo_operacao'] == 'Entrada'
@@ -0,0 +1,148 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from tools import crawler as modulo_crawler
+from tools.crawler import ARQUIVO_PONTEIRO_ATUAL, CFOPConfazCrawler
+
+TABELA_INICIAL = {
+    "1.101": "Compra para industrialização ou produção rural",
+    "1.102": "Compra para comercialização",
+    "5.101": "Venda de produção do estabelecimento",
+    "5.102": "Venda de mercadoria adquirida ou recebida de terceiros",
+}
+
+
+def _pagina(tabela, aviso=""):
+    linhas = "".join(f"<p>{codigo} - {descricao}</p>" for codigo, descricao in tabela.items())
+    return f"<html><body>{aviso}<div id='content'>{linhas}</div></body></html>".encode('utf-8')
+
+
+class _Pagina:
+    """Rota da página de CFOPs: responde 304 quando o If-None-Match confere com o ETag atual."""
+
+    def __init__(self, corpo, etag=None):
+        self.corpo = corpo
+        self.etag = etag
+
+    def __call__(self, requisicao):
+        if self.etag and requisicao.headers.get('If-None-Match') == self.etag:
+            return 304, {'ETag': self.etag}, b''
+        headers = {'Content-Type': 'text/html; charset=utf-8'}
+        if self.etag:
+            headers['ETag'] = self.etag
+        return 200, headers, self.corpo
+
+
+@pytest.fixture(autouse=True)
+def relogio(monkeypatch):
+    """Cada leitura do relógio avança um segundo: duas versões nunca recebem o mesmo nome."""
+    instantes = iter(datetime(2024, 1, 1) + timedelta(seconds=i) for i in range(10 ** 6))
+
+    class Relogio(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return next(instantes)
+
+    monkeypatch.setattr(modulo_crawler, "datetime", Relogio)
+
+
+@pytest.fixture
+def pagina(servidor_http):
+    rota = _Pagina(_pagina(TABELA_INICIAL))
+    servidor_http.rotas['/cfop'] = rota
+    return rota
+
+
+@pytest.fixture
+def crawler(tmp_path, servidor_http, pagina):
+    return CFOPConfazCrawler(urls=[servidor_http.url('/cfop')], data_dir=tmp_path, prazo_total=10.0)
+
+
+def _ler_json(caminho):
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _ponteiro(tmp_path):
+    return _ler_json(tmp_path / ARQUIVO_PONTEIRO_ATUAL)
+
+
+def test_primeira_carga_grava_a_versao_e_o_ponteiro(crawler, tmp_path):
+    resultado = crawler.atualizar_tabela()
+
+    assert resultado["status"] == "atualizado"
+    assert resultado["adicionados"] == sorted(TABELA_INICIAL)
+    ponteiro = _ponteiro(tmp_path)
+    versao = resultado["versao_atual"]
+    assert ponteiro["versao"] == versao
+    assert ponteiro["total"] == len(TABELA_INICIAL)
+    for chave in ("csv", "json", "sqlite", "diff"):
+        assert (tmp_path / ponteiro[chave]).is_file()
+    assert {cfop["cfop"]: cfop["descricao"] for cfop in _ler_json(tmp_path / ponteiro["json"])} == TABELA_INICIAL
+    diff = _ler_json(tmp_path / f"cfop_diff_{versao}.json")
+    assert diff["versao_anterior"] is None
+    assert diff["adicionados"] == sorted(TABELA_INICIAL)
+
+
+def test_304_nao_grava_versao_nova(crawler, tmp_path, pagina, servidor_http):
+    pagina.etag = '"v1"'
+    versao = crawler.atualizar_tabela()["versao_atual"]
+    arquivos = sorted(tmp_path.iterdir())
+
+    resultado = crawler.atualizar_tabela()
+
+    assert resultado == {"status": "nao_modificado", "versao_atual": versao}
+    assert servidor_http.requisicoes[-1][1].get('If-None-Match') == '"v1"'
+    assert sorted(tmp_path.iterdir()) == arquivos
+
+
+def test_pagina_identica_nao_e_parseada_de_novo(crawler, tmp_path, monkeypatch):
+    versao = crawler.atualizar_tabela()["versao_atual"]
+
+    def parsear(conteudo):
+        raise AssertionError("a página idêntica não deveria ser parseada")
+
+    monkeypatch.setattr(crawler, "_parsear_html", parsear)
+    resultado = crawler.atualizar_tabela()
+
+    assert resultado == {"status": "sem_alteracoes", "versao_atual": versao}
+    assert len(list(tmp_path.glob("cfop_diff_*.json"))) == 1
+
+
+def test_pagina_diferente_com_a_mesma_tabela_nao_grava_versao_nova(crawler, tmp_path, pagina):
+    versao = crawler.atualizar_tabela()["versao_atual"]
+    pagina.corpo = _pagina(TABELA_INICIAL, aviso="<p>Página atualizada em 02/01/2024</p>")
+
+    resultado = crawler.atualizar_tabela()
+
+    assert resultado == {"status": "sem_alteracoes", "versao_atual": versao}
+    assert _ponteiro(tmp_path)["versao"] == versao
+    assert len(list(tmp_path.glob("cfop_confaz_*.json"))) == 1
+
+
+def test_tabela_alterada_grava_diff_e_move_o_ponteiro(crawler, tmp_path, pagina):
+    anterior = crawler.atualizar_tabela()["versao_atual"]
+    tabela = dict(TABELA_INICIAL)
+    del tabela["1.102"]
+    tabela["5.102"] = "Venda de mercadoria adquirida de terceiros"
+    tabela["5.405"] = "Venda de mercadoria sujeita a substituição tributária, na condição de substituído"
+    pagina.corpo = _pagina(tabela)
+
+    resultado = crawler.atualizar_tabela()
+
+    assert resultado["status"] == "atualizado"
+    versao = resultado["versao_atual"]
+    assert versao != anterior
+    diff = _ler_json(tmp_path / f"cfop_diff_{versao}.json")
+    assert diff["versao_anterior"] == anterior
+    assert (diff["adicionados"], diff["removidos"]) == (["5.405"], ["1.102"])
+    assert diff["alterados"] == [{"cfop": "5.102", "campos": ["descricao"],
+                                  "antes": {"descricao": TABELA_INICIAL["5.102"]},
+                                  "depois": {"descricao": tabela["5.102"]}}]
+
+    ponteiro = _ponteiro(tmp_path)
+    assert (ponteiro["versao"], ponteiro["diff"], ponteiro["total"]) == (versao, f"cfop_diff_{versao}.json", 4)
+    # A versão anterior continua no disco.
+    assert (tmp_path / f"cfop_confaz_{anterior}.json").is_file()
@@ -0,0 +1,118 @@
+import json
+import sqlite3
+import zipfile
+
+import pytest
+
+from agent_analyst.orchestrator_agent import OrchestratorAgent
+from tools.resource_governor import GovernadorRecursos
+from tools.work_queue import FilaTrabalho
+
+from conftest import PERFIS_NOTA, gerar_nfe
+
+
+class GovernadorContado(GovernadorRecursos):
+    """Governador que conta os documentos iniciados e confere que todos foram concluídos."""
+
+    def __init__(self):
+        super().__init__(max_rss_mb=0)
+        self.iniciados = 0
+        self.em_execucao = 0
+
+    def iniciar_documento(self):
+        super().iniciar_documento()
+        self.iniciados += 1
+        self.em_execucao += 1
+
+    def concluir_documento(self):
+        self.em_execucao -= 1
+        super().concluir_documento()
+
+
+@pytest.fixture
+def orquestrador(pasta_dados, tmp_path):
+    for i in range(4):
+        (pasta_dados / "notas" / f"nota_{i}.xml").write_bytes(gerar_nfe(i, *PERFIS_NOTA[i % len(PERFIS_NOTA)]))
+    with zipfile.ZipFile(pasta_dados / "notas" / "lote.zip", 'w') as zf:
+        for i in range(4, 7):
+            zf.writestr(f"nota_{i}.xml", gerar_nfe(i, *PERFIS_NOTA[i % len(PERFIS_NOTA)]))
+    return OrchestratorAgent(data_dir=pasta_dados, output_dir=tmp_path / "output")
+
+
+@pytest.fixture
+def fila(tmp_path):
+    fila = FilaTrabalho(tmp_path / "output" / "fila_lote.db")
+    yield fila
+    fila.fechar()
+
+
+def test_trabalhador_processa_cada_documento_sob_o_governador(orquestrador, fila):
+    orquestrador.enfileirar_lote_notas(fila)
+    governador = GovernadorContado()
+
+    resumo = orquestrador.executar_trabalhador_lote(fila, governador=governador)
+
+    assert resumo["concluidas"] == 5
+    assert governador.iniciados == 7
+    assert governador.em_execucao == 0
+    assert resumo["recursos"]["limites"]["rss_mb"] is None
+
+
+def _lote_distribuido(orquestrador, fila, novo=False):
+    enfileirado = orquestrador.enfileirar_lote_notas(fila, retomar=not novo)
+    orquestrador.executar_trabalhador_lote(fila)
+    return orquestrador.consolidar_lote_distribuido(fila, enfileirado["run_id"])
+
+
+def test_trabalhador_pontua_anomalias_de_valor(pasta_dados, tmp_path, fila):
+    notas = pasta_dados / "notas"
+    orquestrador = OrchestratorAgent(data_dir=pasta_dados, output_dir=tmp_path / "output")
+    # Histórico: notas do mesmo emitente com valores parecidos.
+    for i in range(0, 36, 3):
+        (notas / f"nota_{i}.xml").write_bytes(gerar_nfe(i, *PERFIS_NOTA[0], valor_total=100 + i % 7))
+    _lote_distribuido(orquestrador, fila)
+    assert (tmp_path / "output" / "estatisticas_valores.npz").is_file()
+
+    for arquivo in notas.iterdir():
+        arquivo.unlink()
+    (notas / "fora_da_curva.xml").write_bytes(gerar_nfe(99, *PERFIS_NOTA[0], valor_total=250000))
+    relatorio = _lote_distribuido(orquestrador, fila, novo=True)
+    assert relatorio["sucesso"] == 1
+
+    with sqlite3.connect(tmp_path / "output" / "extracoes.db") as conn:
+        resultado = json.loads(conn.execute(
+            "SELECT resultado FROM extracoes WHERE identificador = 'fora_da_curva.xml'").fetchone()[0])
+    assert any("Valor total" in alerta for alerta in resultado["alertas_valor"])
+    assert set(resultado["alertas_valor"]) <= set(resultado["alertas_especificos"])
+
+
+def _status(relatorio):
+    return {(doc["arquivo"], doc["membro"]): doc["status"] for doc in relatorio["documentos"]}
+
+
+def test_lote_distribuido_marca_copias_como_duplicadas(pasta_dados, tmp_path, fila):
+    nota = gerar_nfe(1, *PERFIS_NOTA[3])
+    (pasta_dados / "notas" / "nota.xml").write_bytes(nota)
+    with zipfile.ZipFile(pasta_dados / "notas" / "b.zip", 'w') as zf:
+        zf.writestr("copia.xml", nota)
+    orquestrador = OrchestratorAgent(data_dir=pasta_dados, output_dir=tmp_path / "output")
+
+    relatorio = _lote_distribuido(orquestrador, fila)
+
+    assert _status(relatorio) == {("nota.xml", None): "sucesso", ("b.zip", "copia.xml"): "duplicada"}
+    assert (relatorio["sucesso"], relatorio["falhas"], relatorio["duplicadas"]) == (1, 0, 1)
+
+
+def test_lote_distribuido_processa_a_copia_quando_a_primeira_falha(pasta_dados, tmp_path, fila):
+    cnae, cfop, descricao = PERFIS_NOTA[3]
+    # Mesma chave de acesso, mas a cópia solta não tem CFOP nos itens e falha na classificação.
+    (pasta_dados / "notas" / "nota.xml").write_bytes(gerar_nfe(1, cnae, "", descricao))
+    for nome_zip in ("b.zip", "c.zip"):
+        with zipfile.ZipFile(pasta_dados / "notas" / nome_zip, 'w') as zf:
+            zf.writestr("copia.xml", gerar_nfe(1, cnae, cfop, descricao))
+    orquestrador = OrchestratorAgent(data_dir=pasta_dados, output_dir=tmp_path / "output")
+
+    relatorio = _lote_distribuido(orquestrador, fila)
+
+    assert _status(relatorio) == {("nota.xml", None): "falha", ("b.zip", "copia.xml"): "sucesso",
+                                  ("c.zip", "copia.xml"): "duplicada"}
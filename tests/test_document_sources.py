@@ -0,0 +1,98 @@
+import io
+import mmap
+import os
+from contextlib import contextmanager
+
+import fitz
+import pytest
+
+from tools.data_extractor import extract_from_xml
+from tools.document_model import para_dict
+from tools.document_source import LIMIAR_MMAP
+from tools.pdf_parser import parse_pdf_to_structured_data
+
+from conftest import gerar_nfe
+
+TEXTO_DANFE = (
+    "DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRONICA\n"
+    "NF-e n° 123456\n"
+    "CHAVE DE ACESSO 3524 0112 3456 7800 0195 5500 1000 1234 5610 0012 3453\n"
+    "CNPJ: 11.222.333/0001-81 EMPRESA EXEMPLO LTDA\n"
+    "CFOP 5102 VENDA DE MERCADORIA ADQUIRIDA DE TERCEIROS\n"
+    "VALOR TOTAL R$ 1.234,56\n"
+)
+
+FONTES = ['caminho', 'caminho_str', 'bytes', 'bytearray', 'memoryview', 'mmap', 'arquivo', 'bytesio']
+
+
+@contextmanager
+def _abrir_fonte(tipo, caminho):
+    """A mesma nota entregue ao extrator como cada tipo de fonte aceito."""
+    if tipo == 'caminho':
+        yield caminho
+    elif tipo == 'caminho_str':
+        yield str(caminho)
+    elif tipo == 'bytes':
+        yield caminho.read_bytes()
+    elif tipo == 'bytearray':
+        yield bytearray(caminho.read_bytes())
+    elif tipo == 'memoryview':
+        yield memoryview(caminho.read_bytes())
+    elif tipo == 'bytesio':
+        yield io.BytesIO(caminho.read_bytes())
+    else:
+        with open(caminho, 'rb') as arquivo:
+            if tipo == 'arquivo':
+                yield arquivo
+            else:
+                with mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+                    yield mapa
+
+
+@pytest.fixture(scope='module', params=['pequeno', 'grande'])
+def xml_nota(request, tmp_path_factory):
+    # A versão grande passa do limiar e é mapeada em memória ao ser aberta pelo caminho.
+    itens = 3 if request.param == 'pequeno' else LIMIAR_MMAP // 150
+    caminho = tmp_path_factory.mktemp('xml') / f'nota_{request.param}.xml'
+    caminho.write_bytes(gerar_nfe(7, "4711302", "5.102", descricao="Mercadoria", itens=itens))
+    assert (os.path.getsize(caminho) >= LIMIAR_MMAP) == (request.param == 'grande')
+    return caminho
+
+
+@pytest.fixture(scope='module', params=['pequeno', 'grande'])
+def pdf_nota(request, tmp_path_factory):
+    doc = fitz.open()
+    pagina = doc.new_page()
+    pagina.insert_text((40, 60), TEXTO_DANFE, fontsize=9)
+    if request.param == 'grande':
+        # Um anexo incompressível leva o PDF além do limiar sem mudar o texto das páginas.
+        doc.embfile_add('anexo.bin', os.urandom(LIMIAR_MMAP + 4096))
+    caminho = tmp_path_factory.mktemp('pdf') / f'nota_{request.param}.pdf'
+    doc.save(caminho)
+    doc.close()
+    assert (os.path.getsize(caminho) >= LIMIAR_MMAP) == (request.param == 'grande')
+    return caminho
+
+
+@pytest.mark.parametrize('tipo', FONTES)
+def test_xml_igual_para_qualquer_fonte(xml_nota, tipo):
+    referencia = para_dict(extract_from_xml(xml_nota))
+    assert "erro" not in referencia
+    assert len(referencia["itens"]) > 0
+
+    with _abrir_fonte(tipo, xml_nota) as fonte:
+        resultado = para_dict(extract_from_xml(fonte))
+
+    assert resultado == referencia
+
+
+@pytest.mark.parametrize('tipo', FONTES)
+def test_pdf_igual_para_qualquer_fonte(pdf_nota, tipo):
+    referencia = para_dict(parse_pdf_to_structured_data(pdf_nota, permitir_ocr=False))
+    assert "erro" not in referencia
+    assert referencia["cabecalho"]["numero_nf"] == "123456"
+
+    with _abrir_fonte(tipo, pdf_nota) as fonte:
+        resultado = para_dict(parse_pdf_to_structured_data(fonte, permitir_ocr=False))
+
+    assert resultado == referencia
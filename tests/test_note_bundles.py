@@ -0,0 +1,41 @@
+import re
+import zipfile
+
+from agent_analyst.orchestrator_agent import OrchestratorAgent
+from tools.note_bundles import PacoteNotas, chave_conteudo, ler_destino, listar_notas
+
+from conftest import PERFIS_NOTA, gerar_nfe
+
+
+def _sem_chave(xml: bytes) -> bytes:
+    return re.sub(rb'Id="NFe\d+"', b'Id=""', xml)
+
+
+def test_notas_sem_chave_com_o_mesmo_nome_nao_se_substituem(pasta_dados, tmp_path):
+    notas = [_sem_chave(gerar_nfe(i, *PERFIS_NOTA[3])) for i in (1, 4)]
+    for nome_zip, nota in zip(("a.zip", "b.zip"), notas):
+        with zipfile.ZipFile(pasta_dados / "notas" / nome_zip, 'w') as zf:
+            zf.writestr("nota.xml", nota)
+
+    orquestrador = OrchestratorAgent(data_dir=pasta_dados, output_dir=tmp_path / "output")
+    relatorio = orquestrador.processar_lote_notas(em_pacotes=True)
+
+    assert relatorio["sucesso"] == 2
+    destinos = sorted(doc["destino"] for doc in relatorio["documentos"] if doc.get("destino"))
+    assert len(set(destinos)) == 2
+    assert sorted(ler_destino(destino) for destino in destinos) == sorted(notas)
+
+
+def test_nota_reenviada_com_o_mesmo_conteudo_nao_e_anexada_de_novo(tmp_path):
+    conteudo = _sem_chave(gerar_nfe(1, *PERFIS_NOTA[0]))
+    pacote = PacoteNotas(tmp_path / "2024-01.notas.gz")
+    try:
+        primeiro = pacote.adicionar(chave_conteudo(conteudo), "nota.xml", conteudo)
+        tamanho = pacote.caminho.stat().st_size
+        segundo = pacote.adicionar(chave_conteudo(conteudo), "nota.xml", conteudo)
+    finally:
+        pacote.fechar()
+
+    assert primeiro == segundo
+    assert pacote.caminho.stat().st_size == tamanho
+    assert len(listar_notas(pacote.caminho)) == 1
@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+from tools.notes_index import IndiceNotas, buscar_notas
+
+CNPJ = "12345678000195"
+
+
+def _nota(numero, emitente, destinatario):
+    return {"cabecalho": {"chave_acesso": f"3524{numero:040d}", "numero_nf": str(numero),
+                          "emitente_cnpj": emitente, "destinatario_cpf_cnpj": destinatario},
+            "itens": []}
+
+
+def test_busca_por_cnpj_traz_as_notas_mais_recentes_primeiro(tmp_path):
+    caminho = tmp_path / "indice_notas.db"
+    indice = IndiceNotas(caminho)
+    # O CNPJ alterna entre emitente e destinatário; a nota 5 tem o CNPJ nos dois papéis.
+    for numero in range(1, 9):
+        emitente = CNPJ if numero % 2 or numero == 4 else "99999999000191"
+        destinatario = CNPJ if not numero % 2 or numero == 5 else "11111111000191"
+        indice.indexar(_nota(numero, emitente, destinatario), {}, f"nota_{numero}.json", f"nota_{numero}.xml")
+    indice.fechar()
+
+    notas = buscar_notas(caminho, "12.345.678/0001-95", limite=3)
+    assert [nota["numero_nf"] for nota in notas] == ["8", "7", "6"]
+
+    todas = buscar_notas(caminho, CNPJ)
+    assert [nota["numero_nf"] for nota in todas] == [str(numero) for numero in range(8, 0, -1)]
+    assert "id" not in todas[0]
+
+
+def test_busca_textual_ignora_operadores_e_nao_esconde_outros_erros(tmp_path):
+    caminho = tmp_path / "indice_notas.db"
+    indice = IndiceNotas(caminho)
+    nota = _nota(1, CNPJ, "11111111000191")
+    nota["itens"] = [{"descricao": "PARAFUSO SEXTAVADO M8", "cfop": "5102"}]
+    indice.indexar(nota, {}, "nota_1.json", "nota_1.xml")
+    indice.fechar()
+
+    for termo in ('"parafuso (sext*', 'paraf*:', 'm8 ^sextavado', '-parafuso', 'parafuso "m8"'):
+        assert [nota["numero_nf"] for nota in buscar_notas(caminho, termo)] == ["1"], termo
+
+    # Um erro do banco (aqui, um índice sem as tabelas) chega a quem chamou.
+    sem_tabelas = tmp_path / "vazio.db"
+    sqlite3.connect(sem_tabelas).close()
+    with pytest.raises(sqlite3.OperationalError):
+        buscar_notas(sem_tabelas, "parafuso")
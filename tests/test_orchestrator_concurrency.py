@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from agent_analyst.orchestrator_agent import OrchestratorAgent
+from tools.document_model import para_dict
+
+from conftest import PERFIS_NOTA, gerar_nfe
+
+THREADS = 8
+RODADAS = 6
+
+
+@pytest.fixture
+def orquestrador(pasta_dados, tmp_path):
+    return OrchestratorAgent(data_dir=pasta_dados, output_dir=tmp_path / "output")
+
+
+@pytest.fixture
+def notas():
+    return {f"nota_{i}.xml": gerar_nfe(i, *PERFIS_NOTA[i % len(PERFIS_NOTA)]) for i in range(10)}
+
+
+def test_processamento_concorrente_com_recargas_iguala_o_sequencial(orquestrador, notas):
+    # Referência: cada nota processada sozinha, numa única thread.
+    referencia = {nome: para_dict(orquestrador.processar_conteudo(nome, conteudo))
+                  for nome, conteudo in notas.items()}
+    assert all("erro" not in resultado for resultado in referencia.values())
+
+    terminou = threading.Event()
+    recargas = []
+
+    def recarregar():
+        while not terminou.is_set():
+            recargas.append(orquestrador.recarregar_configuracao())
+
+    def processar(nome):
+        return nome, para_dict(orquestrador.processar_conteudo(nome, notas[nome]))
+
+    recarregador = threading.Thread(target=recarregar)
+    recarregador.start()
+    try:
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            resultados = list(executor.map(processar, [nome for _ in range(RODADAS) for nome in notas]))
+    finally:
+        terminou.set()
+        recarregador.join()
+
+    assert len(recargas) > 0
+    assert len(resultados) == RODADAS * len(notas)
+    for nome, resultado in resultados:
+        assert resultado == referencia[nome], nome
+
+
+def test_cfop_info_compartilhado_e_somente_leitura(orquestrador, notas):
+    resultado = orquestrador.processar_conteudo("nota_0.xml", notas["nota_0.xml"])
+    cfop_info = resultado["analise_classificacao"]["cfop_info"]
+    descricao = cfop_info["descricao"]
+
+    with pytest.raises(TypeError):
+        cfop_info["descricao"] = "alterada"
+    with pytest.raises(TypeError):
+        cfop_info.update(descricao="alterada")
+    with pytest.raises(TypeError):
+        del cfop_info["descricao"]
+    with pytest.raises(TypeError):
+        cfop_info.pop("descricao")
+
+    # O registro da tabela, visto pela próxima classificação, continua intacto.
+    outro = orquestrador.processar_conteudo("nota_0.xml", notas["nota_0.xml"])
+    assert outro["analise_classificacao"]["cfop_info"]["descricao"] == descricao
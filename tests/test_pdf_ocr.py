@@ -0,0 +1,58 @@
+import pytest
+
+from tools import pdf_parser
+
+CHAVE_VALIDA = "3524 0112 3456 7800 0195 5500 1000 1234 5610 0012 3459"
+CHAVE_ERRADA = "3524 0112 3456 7800 0195 5500 1000 1234 5610 0012 3450"
+CFOPS = {"5.102"}
+
+
+@pytest.fixture
+def leituras(monkeypatch):
+    """Substitui a renderização e o Tesseract pelo texto definido para cada zoom."""
+    textos = {}
+    zooms_lidos = []
+
+    def ocr_documento(doc, zoom, prazo, governador=None):
+        zooms_lidos.append(zoom)
+        return textos[zoom]
+
+    monkeypatch.setattr(pdf_parser, "_ocr_documento", ocr_documento)
+    return textos, zooms_lidos
+
+
+def _ocr(zooms=pdf_parser.ZOOMS_OCR_ADAPTATIVO):
+    return pdf_parser._ocr_adaptativo(None, None, CFOPS, zooms)
+
+
+def test_campos_ausentes_nao_sobem_o_zoom(leituras):
+    textos, zooms_lidos = leituras
+    textos[1.5] = "CUPOM FISCAL\nVALOR TOTAL R$ 10,00\n"
+
+    _, leitura = _ocr()
+
+    assert zooms_lidos == [1.5]
+    assert leitura.campos_invalidos == ()
+
+
+def test_sobe_o_zoom_enquanto_reduz_os_campos_invalidos(leituras):
+    textos, zooms_lidos = leituras
+    textos[1.5] = f"CHAVE {CHAVE_ERRADA}\nCNPJ: 11.222.333/0001-80 EMPRESA\nCFOP 5102\n"
+    textos[2] = f"CHAVE {CHAVE_ERRADA}\nCNPJ: 11.222.333/0001-81 EMPRESA\nCFOP 5102\n"
+    textos[3] = f"CHAVE {CHAVE_VALIDA}\nCNPJ: 11.222.333/0001-81 EMPRESA\nCFOP 5102\n"
+
+    texto, leitura = _ocr()
+
+    assert zooms_lidos == [1.5, 2, 3]
+    assert (texto, leitura.zoom, leitura.campos_invalidos) == (textos[3], 3, ())
+
+
+def test_para_quando_o_zoom_maior_nao_melhora(leituras):
+    textos, zooms_lidos = leituras
+    for zoom in (1.5, 2, 3):
+        textos[zoom] = f"CHAVE {CHAVE_ERRADA}\nCFOP 5102\n"
+
+    _, leitura = _ocr()
+
+    assert zooms_lidos == [1.5, 2]
+    assert (leitura.zoom, leitura.tentativas, leitura.campos_invalidos) == (2, 2, ('chave_acesso',))
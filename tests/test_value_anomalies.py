@@ -0,0 +1,73 @@
+import numpy as np
+
+from tools.value_anomalies import (LARGURA_FAIXA, LOG_MINIMO, N_FAIXAS, SERIE_TOTAL_EMITENTE,
+                                   DetectorAnomalias, HistoricoCompartilhado)
+
+
+def _nota(i: int, valor_total: float, emitente: str = "11222333000181") -> dict:
+    return {"cabecalho": {"chave_acesso": f"{i:044d}", "valor_total": valor_total, "emitente_cnpj": emitente},
+            "itens": [{"codigo_produto": "P1", "cfop": "5.102", "quantidade": 2.0, "valor_unitario": valor_total / 2}]}
+
+
+def _estatisticas(detector: DetectorAnomalias, serie: str, chaves):
+    histogramas = detector.series[serie]
+    return histogramas.estatisticas(histogramas.indices(chaves))
+
+
+def test_historico_no_formato_denso_anterior_e_lido(tmp_path):
+    caminho = tmp_path / "estatisticas_valores.npz"
+    faixas = np.round((np.log10([100.0, 120.0, 120.0, 150.0, 1000.0]) - LOG_MINIMO) / LARGURA_FAIXA).astype(int)
+    contagens = np.zeros((2, N_FAIXAS), dtype=np.float32)
+    np.add.at(contagens[0], faixas, 1)
+    contagens[1, 10] = 3
+    np.savez(caminho, n_faixas=np.int64(N_FAIXAS), notas_vistas=np.zeros(0, dtype=np.uint64),
+             **{f"{SERIE_TOTAL_EMITENTE}_chaves": np.array(["A", "B"]),
+                f"{SERIE_TOTAL_EMITENTE}_contagens": contagens})
+
+    detector = DetectorAnomalias(caminho)
+    mediana, mad, peso = _estatisticas(detector, SERIE_TOTAL_EMITENTE, ["A", "B"])
+
+    assert peso.tolist() == [5, 3]
+    assert abs(mediana[0] - (LOG_MINIMO + (faixas[2] + 0.5) * LARGURA_FAIXA)) < LARGURA_FAIXA / 2
+    assert abs(mediana[1] - (LOG_MINIMO + 10.5 * LARGURA_FAIXA)) < 1e-9
+    assert mad[1] < LARGURA_FAIXA
+
+    # Regravado no formato esparso, o histórico continua o mesmo.
+    detector.salvar()
+    relido = DetectorAnomalias(caminho)
+    for antes, depois in zip((mediana, mad, peso), _estatisticas(relido, SERIE_TOTAL_EMITENTE, ["A", "B"])):
+        np.testing.assert_allclose(antes, depois)
+
+
+def test_mediana_e_mad_batem_com_os_valores(tmp_path):
+    rng = np.random.default_rng(3)
+    valores = 10 ** rng.normal(3, 0.2, 400)
+    detector = DetectorAnomalias(tmp_path / "estatisticas_valores.npz")
+    # Em vários lotes, para passar pela compactação do histograma.
+    for inicio in range(0, len(valores), 37):
+        detector.atualizar([_nota(i, v) for i, v in enumerate(valores[inicio:inicio + 37], inicio)])
+
+    mediana, mad, peso = _estatisticas(detector, SERIE_TOTAL_EMITENTE, ["11222333000181"])
+    logs = np.log10(valores)
+    assert peso[0] == len(valores)
+    assert abs(mediana[0] - np.median(logs)) <= LARGURA_FAIXA
+    assert abs(mad[0] - np.median(np.abs(logs - np.median(logs)))) <= LARGURA_FAIXA
+
+
+def test_historico_compartilhado_junta_os_documentos_dos_processos(tmp_path):
+    caminho = tmp_path / "estatisticas_valores.npz"
+    primeiro = HistoricoCompartilhado(caminho, a_cada_documentos=10, a_cada_segundos=3600)
+    segundo = HistoricoCompartilhado(caminho, a_cada_documentos=10, a_cada_segundos=3600)
+
+    primeiro.avaliar_lote([_nota(i, 100 + i % 5) for i in range(6)])
+    assert not caminho.exists()
+    # Segundo processo: reenvia três notas do primeiro e atinge o limite de documentos.
+    segundo.avaliar_lote([_nota(i, 100 + i % 5) for i in range(3, 13)])
+    primeiro.fechar()
+    segundo.fechar()
+
+    _, _, peso = _estatisticas(DetectorAnomalias(caminho), SERIE_TOTAL_EMITENTE, ["11222333000181"])
+    assert peso[0] == 13
+    # Depois de juntar, cada processo pontua com o histórico de todos.
+    alertas = primeiro.avaliar_lote([_nota(99, 250000)])
+    assert any("Valor total" in alerta for alerta in alertas[0])
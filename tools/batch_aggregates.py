@@ -0,0 +1,142 @@
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+_SQL_CRIAR_TABELAS = """
+CREATE TABLE IF NOT EXISTS agregados (
+    ramo TEXT NOT NULL,
+    mes TEXT NOT NULL,
+    centro_custo TEXT NOT NULL,
+    cfop TEXT NOT NULL,
+    quantidade INTEGER NOT NULL,
+    valor_total REAL NOT NULL,
+    PRIMARY KEY (ramo, mes, centro_custo, cfop)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS notas_contabilizadas (
+    chave_acesso TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+# Soma os deltas pendentes às células já persistidas.
+_SQL_SOMAR_DELTA = """
+INSERT INTO agregados (ramo, mes, centro_custo, cfop, quantidade, valor_total)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (ramo, mes, centro_custo, cfop) DO UPDATE SET
+    quantidade = quantidade + excluded.quantidade,
+    valor_total = valor_total + excluded.valor_total
+"""
+
+
+class AgregadosLote:
+    """
+    Totais acumulados dos lotes processados: quantidade de notas e soma de `valor_total`
+    por (ramo, mês, centro de custo, CFOP).
+
+    Cada documento atualiza apenas a sua célula em memória (O(1)). Na gravação, somente
+    os deltas pendentes são somados ao banco SQLite, que guarda os totais entre execuções.
+    Notas com chave de acesso são contabilizadas uma única vez, mesmo que a mesma pasta
+    seja processada de novo.
+
+    `conn` permite compartilhar uma conexão já aberta com o mesmo banco (ex.: a do diário
+    do lote), para que as consultas de deduplicação enxerguem as gravações feitas nela.
+    """
+
+    def __init__(self, caminho_db: Path, conn: Optional[sqlite3.Connection] = None):
+        self.caminho_db = Path(caminho_db)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conexao_propria = conn is None
+        if conn is not None:
+            conn.executescript(_SQL_CRIAR_TABELAS)
+            self._conn = conn
+        self._pendentes: Dict[Tuple[str, str, str, str], List[float]] = {}
+        self._chaves_pendentes = set()
+        self._chaves_corrigidas = set()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.caminho_db.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.caminho_db)
+            self._conn.executescript(_SQL_CRIAR_TABELAS)
+        return self._conn
+
+    def registrar(self, ramo: str, mes: str, centro_custo: str, cfop: str, valor_total: float,
+                  chave_acesso: Optional[str] = None) -> bool:
+        """
+        Soma um documento à célula correspondente (em memória, até a próxima gravação).
+        Retorna False, sem somar, se a nota (pela chave de acesso) já foi contabilizada.
+        """
+        if chave_acesso:
+            if chave_acesso in self._chaves_pendentes or self.conn.execute(
+                    "SELECT 1 FROM notas_contabilizadas WHERE chave_acesso = ?", (chave_acesso,)).fetchone():
+                return False
+            self._chaves_pendentes.add(chave_acesso)
+
+        celula = self._pendentes.setdefault((ramo, mes, centro_custo, cfop), [0, 0.0])
+        celula[0] += 1
+        celula[1] += valor_total or 0.0
+        return True
+
+    def corrigir(self, antiga: Dict, nova: Dict) -> bool:
+        """
+        Move um documento já contabilizado da célula `antiga` para a `nova` (ex.: após uma
+        reclassificação). Os argumentos têm o formato de `registrar`. Como em `registrar`, uma
+        nota (pela chave de acesso) é movida uma única vez; retorna False se já tiver sido.
+        """
+        chave_acesso = nova.get('chave_acesso')
+        if chave_acesso:
+            if chave_acesso in self._chaves_corrigidas:
+                return False
+            self._chaves_corrigidas.add(chave_acesso)
+        for celula, sinal in ((antiga, -1), (nova, 1)):
+            delta = self._pendentes.setdefault(
+                (celula['ramo'], celula['mes'], celula['centro_custo'], celula['cfop']), [0, 0.0])
+            delta[0] += sinal
+            delta[1] += sinal * (celula.get('valor_total') or 0.0)
+        return True
+
+    def aplicar_pendentes(self, conn: sqlite3.Connection):
+        """
+        Escreve os deltas pendentes na conexão informada, sem fazer commit.
+        Permite gravar os agregados na mesma transação de outros registros do lote.
+        """
+        conn.executemany(_SQL_SOMAR_DELTA, [
+            (*chave, quantidade, valor) for chave, (quantidade, valor) in self._pendentes.items()
+        ])
+        conn.executemany("INSERT OR IGNORE INTO notas_contabilizadas VALUES (?)",
+                         [(chave,) for chave in self._chaves_pendentes])
+        # Células esvaziadas por `corrigir` deixam de aparecer nos totais.
+        conn.execute("DELETE FROM agregados WHERE quantidade <= 0")
+        self._pendentes.clear()
+        self._chaves_pendentes.clear()
+
+    def salvar(self):
+        """Grava os deltas pendentes em uma única transação."""
+        if not self._pendentes and not self._chaves_pendentes:
+            return
+        with self.conn:
+            self.aplicar_pendentes(self.conn)
+
+    def fechar(self):
+        if self._conn is not None:
+            if self._conexao_propria:
+                self._conn.close()
+            self._conn = None
+
+
+def consultar_agregados(caminho_db: Path) -> List[Dict]:
+    """
+    Lê todas as células persistidas (uma linha por ramo/mês/centro de custo/CFOP).
+    Retorna lista vazia se nenhum lote foi processado ainda.
+    """
+    caminho_db = Path(caminho_db)
+    if not caminho_db.is_file():
+        return []
+    conn = sqlite3.connect(f"{caminho_db.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        conn.row_factory = sqlite3.Row
+        return [dict(linha) for linha in conn.execute("SELECT * FROM agregados")]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
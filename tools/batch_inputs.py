@@ -0,0 +1,94 @@
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional, Tuple, Union
+
+# Extensões de documentos fiscais aceitas pelos extratores.
+EXTENSOES_DOCUMENTO = ('.xml', '.pdf')
+# Extensões de arquivos compactados lidos diretamente, sem extração para o disco.
+EXTENSOES_COMPACTADAS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+class EntradaLote(NamedTuple):
+    """
+    Um documento a ser processado em lote.
+    Para arquivos soltos, `membro` e `conteudo` são None e o extrator lê `caminho`.
+    Para membros de um ZIP/TAR, `caminho` é o arquivo compactado, `membro` o nome
+    interno e `conteudo` os bytes já lidos do stream.
+    Se o arquivo compactado não pôde ser lido, a entrada traz a mensagem em `erro`.
+    """
+    caminho: Path
+    membro: Optional[str] = None
+    conteudo: Optional[bytes] = None
+    erro: Optional[str] = None
+
+    @property
+    def nome(self) -> str:
+        """Nome do documento (sem diretórios internos do arquivo compactado)."""
+        return Path(self.membro).name if self.membro else self.caminho.name
+
+    @property
+    def extensao(self) -> str:
+        return Path(self.nome).suffix.lower()
+
+    @property
+    def identificador(self) -> str:
+        """Identificador legível e único dentro da pasta de entrada ('lote.zip!pasta/nota.xml')."""
+        return f"{self.caminho.name}!{self.membro}" if self.membro else self.caminho.name
+
+    @property
+    def fonte(self) -> Union[str, bytes]:
+        """O que deve ser entregue ao extrator: o caminho no disco ou os bytes do membro."""
+        return self.conteudo if self.conteudo is not None else str(self.caminho)
+
+
+def is_arquivo_compactado(caminho: Path) -> bool:
+    nome = caminho.name.lower()
+    return caminho.is_file() and nome.endswith(EXTENSOES_COMPACTADAS)
+
+
+def iterar_membros_compactados(caminho: Path) -> Iterator[Tuple[str, bytes]]:
+    """
+    Lê os membros XML/PDF de um ZIP ou TAR como streams, na ordem física do arquivo,
+    sem extrair nada para o disco. Gera pares (nome_do_membro, conteudo).
+    """
+    if caminho.name.lower().endswith('.zip'):
+        with zipfile.ZipFile(caminho) as zf:
+            # Ordena pela posição no arquivo para manter a leitura sequencial.
+            membros = sorted(zf.infolist(), key=lambda info: info.header_offset)
+            for info in membros:
+                if not info.is_dir() and info.filename.lower().endswith(EXTENSOES_DOCUMENTO):
+                    yield info.filename, zf.read(info)
+    else:
+        # Modo 'r|*' lê o TAR (compactado ou não) como um stream, membro a membro.
+        with tarfile.open(caminho, mode='r|*') as tf:
+            for membro in tf:
+                if membro.isfile() and membro.name.lower().endswith(EXTENSOES_DOCUMENTO):
+                    arquivo = tf.extractfile(membro)
+                    if arquivo is not None:
+                        yield membro.name, arquivo.read()
+
+
+def listar_entradas_lote(pasta_entrada: Path) -> Tuple[list, list]:
+    """
+    Separa o conteúdo da pasta de entrada em documentos soltos (.xml/.pdf)
+    e arquivos compactados (.zip/.tar[.gz|.bz2|.xz]).
+    """
+    documentos = list(pasta_entrada.glob("*.xml")) + list(pasta_entrada.glob("*.pdf"))
+    compactados = sorted(p for p in pasta_entrada.iterdir() if is_arquivo_compactado(p))
+    return documentos, compactados
+
+
+def iterar_entradas_lote(documentos: list, compactados: list) -> Iterator[EntradaLote]:
+    """
+    Gera as entradas do lote: primeiro os documentos soltos, depois os membros de cada
+    arquivo compactado, lidos sob demanda à medida que o lote avança.
+    """
+    for documento in documentos:
+        yield EntradaLote(documento)
+    for compactado in compactados:
+        try:
+            for membro, conteudo in iterar_membros_compactados(compactado):
+                yield EntradaLote(compactado, membro, conteudo)
+        except (zipfile.BadZipFile, tarfile.TarError, OSError, EOFError) as e:
+            yield EntradaLote(compactado, erro=f"Falha ao ler o arquivo compactado: {e}")
@@ -0,0 +1,238 @@
+import json
+import os
+import sqlite3
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from tools.note_bundles import is_destino_pacote, separar_destino
+
+_SQL_CRIAR_TABELAS = """
+CREATE TABLE IF NOT EXISTS lotes (
+    run_id TEXT PRIMARY KEY,
+    pasta_entrada TEXT NOT NULL,
+    status TEXT NOT NULL,
+    iniciado_em TEXT NOT NULL,
+    retomado_em TEXT,
+    finalizado_em TEXT
+);
+CREATE TABLE IF NOT EXISTS lote_documentos (
+    run_id TEXT NOT NULL,
+    identificador TEXT NOT NULL,
+    assinatura TEXT NOT NULL,
+    arquivo TEXT NOT NULL,
+    membro TEXT,
+    status TEXT NOT NULL,
+    destino TEXT,
+    erro TEXT,
+    PRIMARY KEY (run_id, identificador)
+) WITHOUT ROWID;
+"""
+
+STATUS_EM_ANDAMENTO = 'em_andamento'
+STATUS_CONCLUIDO = 'concluido'
+
+# Quantidade de documentos gravados no diário por transação.
+TAMANHO_GRUPO_PADRAO = 200
+
+
+def assinatura_arquivo(caminho: Path) -> str:
+    """Identifica a versão de um arquivo de entrada (tamanho + data de modificação)."""
+    info = caminho.stat()
+    return f"{info.st_size}:{info.st_mtime_ns}"
+
+
+def _fsync(caminho: Path, diretorio: bool = False):
+    # No Windows, o fsync exige um descritor com escrita, e diretórios não podem ser abertos.
+    if os.name == 'nt':
+        if diretorio:
+            return
+        modo = os.O_RDWR
+    else:
+        modo = os.O_RDONLY
+    try:
+        fd = os.open(caminho, modo)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sincronizar_destinos(destinos: Iterable[str]):
+    """
+    Sincroniza com o disco os arquivos de destino (ou os pacotes, para destinos '<pacote>!<chave>')
+    e, uma vez cada, as pastas que os contêm, para que as renomeações também estejam no disco.
+    """
+    arquivos = {separar_destino(destino)[0] if is_destino_pacote(destino) else Path(destino)
+                for destino in destinos if destino}
+    for arquivo in arquivos:
+        _fsync(arquivo)
+    for pasta in {arquivo.parent for arquivo in arquivos}:
+        _fsync(pasta, diretorio=True)
+
+
+class DiarioLote:
+    """
+    Diário durável de um processamento em lote, gravado no banco de controle dos lotes.
+
+    Cada documento concluído (com sucesso ou falha) é anotado em memória e gravado em
+    grupos de `tamanho_grupo`, numa única transação por grupo. Antes do commit, os
+    arquivos copiados para 'output/' pelo grupo (e as pastas deles) são sincronizados com
+    o disco, e os callbacks de
+    checkpoint gravam na mesma transação tudo o que depende do grupo (ex.: os deltas dos
+    agregados). Assim, após uma queda, o diário só lista documentos cujo resultado já está
+    no disco, e os documentos fora dele são refeitos (a cópia de destino é determinística
+    e atômica, então refazer nunca duplica nem deixa arquivo pela metade).
+
+    Um lote interrompido para a mesma pasta de entrada é retomado com o mesmo run_id.
+    Informando `run_id`, o diário reabre exatamente esse lote (ex.: o coordenador de um
+    lote distribuído consolidando o que os trabalhadores concluíram).
+    """
+
+    def __init__(self, caminho_db: Path, pasta_entrada: Path, retomar: bool = True,
+                 tamanho_grupo: int = TAMANHO_GRUPO_PADRAO, run_id: Optional[str] = None):
+        self.caminho_db = Path(caminho_db)
+        self.caminho_db.parent.mkdir(parents=True, exist_ok=True)
+        self.pasta_entrada = str(Path(pasta_entrada).resolve())
+        self.tamanho_grupo = tamanho_grupo
+        self.conn = sqlite3.connect(self.caminho_db)
+        self.conn.executescript(_SQL_CRIAR_TABELAS)
+
+        self._pendentes: List[tuple] = []
+        self._callbacks_checkpoint: List[Callable[[sqlite3.Connection], None]] = []
+        self.retomado = False
+
+        agora = datetime.now().isoformat(timespec='seconds')
+        if run_id is not None:
+            interrompido = self.conn.execute("SELECT run_id FROM lotes WHERE run_id = ?", (run_id,)).fetchone()
+            if interrompido is None:
+                raise ValueError(f"Lote '{run_id}' não encontrado em {self.caminho_db}.")
+        elif retomar:
+            interrompido = self.conn.execute(
+                "SELECT run_id FROM lotes WHERE pasta_entrada = ? AND status = ? ORDER BY iniciado_em DESC LIMIT 1",
+                (self.pasta_entrada, STATUS_EM_ANDAMENTO)
+            ).fetchone()
+        else:
+            interrompido = None
+
+        with self.conn:
+            if interrompido:
+                self.run_id = interrompido[0]
+                self.retomado = True
+                self.conn.execute("UPDATE lotes SET retomado_em = ? WHERE run_id = ?", (agora, self.run_id))
+            else:
+                self.run_id = f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
+                self.conn.execute(
+                    "INSERT INTO lotes (run_id, pasta_entrada, status, iniciado_em) VALUES (?, ?, ?, ?)",
+                    (self.run_id, self.pasta_entrada, STATUS_EM_ANDAMENTO, agora)
+                )
+
+        # Documentos já concluídos neste run (identificador -> assinatura).
+        self._concluidos: Dict[str, str] = dict(self.conn.execute(
+            "SELECT identificador, assinatura FROM lote_documentos WHERE run_id = ?", (self.run_id,)
+        ).fetchall())
+        # Documentos concluídos com sucesso neste run (ver `concluido_com_sucesso`).
+        self._sucessos: Set[str] = {identificador for (identificador,) in self.conn.execute(
+            "SELECT identificador FROM lote_documentos WHERE run_id = ? AND status = 'sucesso'", (self.run_id,)
+        )}
+
+    @property
+    def total_concluidos(self) -> int:
+        return len(self._concluidos)
+
+    def ao_fazer_checkpoint(self, callback: Callable[[sqlite3.Connection], None]):
+        """Registra uma função chamada dentro da transação de cada checkpoint."""
+        self._callbacks_checkpoint.append(callback)
+
+    def ja_processado(self, identificador: str, assinatura: str) -> bool:
+        """True se o documento (na mesma versão) já foi concluído neste run."""
+        return self._concluidos.get(identificador) == assinatura
+
+    def concluido_com_sucesso(self, identificador: str) -> bool:
+        """True se o documento foi concluído com sucesso neste run (ex.: a primeira cópia de uma nota duplicada)."""
+        return identificador in self._sucessos
+
+    def registrar(self, identificador: str, assinatura: str, arquivo: str, membro: Optional[str],
+                  destino: Optional[str] = None, erro: Optional[str] = None, duplicada: bool = False):
+        """
+        Anota a conclusão de um documento (falha se `erro` for informado; 'duplicada' se for
+        outra cópia de uma nota já concluída com sucesso no lote) e grava um checkpoint a cada
+        grupo completo.
+        """
+        status = 'duplicada' if duplicada else 'falha' if erro else 'sucesso'
+        self._pendentes.append((self.run_id, identificador, assinatura, arquivo, membro, status, destino, erro))
+        self._concluidos[identificador] = assinatura
+        if status == 'sucesso':
+            self._sucessos.add(identificador)
+        else:
+            self._sucessos.discard(identificador)
+        if len(self._pendentes) >= self.tamanho_grupo:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Grava o grupo pendente (e os dados dos callbacks) em uma única transação."""
+        if not self._pendentes:
+            return
+        # Garante que as cópias anotadas neste grupo já estão no disco antes do commit.
+        sincronizar_destinos(pendente[6] for pendente in self._pendentes)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO lote_documentos VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pendentes
+            )
+            for callback in self._callbacks_checkpoint:
+                callback(self.conn)
+        self._pendentes.clear()
+
+    def finalizar(self, pasta_relatorios: Path, **extras: Any) -> Dict[str, Any]:
+        """
+        Grava o último grupo, marca o run como concluído e salva o relatório final
+        em '<pasta_relatorios>/lote_<run_id>.json', com as seções `extras` (ex.: recursos
+        usados) antes da lista de documentos. Retorna o relatório.
+        """
+        self.checkpoint()
+        agora = datetime.now().isoformat(timespec='seconds')
+        with self.conn:
+            self.conn.execute("UPDATE lotes SET status = ?, finalizado_em = ? WHERE run_id = ?",
+                              (STATUS_CONCLUIDO, agora, self.run_id))
+
+        lote = self.conn.execute(
+            "SELECT iniciado_em, retomado_em, finalizado_em FROM lotes WHERE run_id = ?", (self.run_id,)
+        ).fetchone()
+        documentos = [
+            {"arquivo": arquivo, "membro": membro, "status": status, "destino": destino, "erro": erro}
+            for arquivo, membro, status, destino, erro in self.conn.execute(
+                "SELECT arquivo, membro, status, destino, erro FROM lote_documentos WHERE run_id = ? "
+                "ORDER BY identificador", (self.run_id,))
+        ]
+        sucesso = sum(1 for doc in documentos if doc['status'] == 'sucesso')
+        duplicadas = sum(1 for doc in documentos if doc['status'] == 'duplicada')
+
+        relatorio = {
+            "run_id": self.run_id,
+            "pasta_entrada": self.pasta_entrada,
+            "iniciado_em": lote[0],
+            "retomado_em": lote[1],
+            "finalizado_em": lote[2],
+            "total": len(documentos),
+            "sucesso": sucesso,
+            "falhas": len(documentos) - sucesso - duplicadas,
+            "duplicadas": duplicadas,
+            **extras,
+            "documentos": documentos,
+        }
+
+        pasta_relatorios = Path(pasta_relatorios)
+        pasta_relatorios.mkdir(parents=True, exist_ok=True)
+        caminho_relatorio = pasta_relatorios / f"lote_{self.run_id}.json"
+        temporario = caminho_relatorio.with_suffix('.json.tmp')
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, ensure_ascii=False, indent=2)
+        os.replace(temporario, caminho_relatorio)
+        relatorio["relatorio_path"] = str(caminho_relatorio)
+        return relatorio
+
+    def fechar(self):
+        self.conn.close()
@@ -0,0 +1,144 @@
+import time
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from tools.batch_inputs import EntradaLote
+from tools.resource_governor import GovernadorRecursos
+from tools.run_profiler import CapturaPerfil
+
+# Faixas de processamento, da mais barata para a mais cara.
+FAIXA_XML = 'xml'
+FAIXA_PDF_TEXTO = 'pdf_texto'
+FAIXA_OCR = 'ocr'
+
+# Threads por faixa. O OCR roda no processo do Tesseract, então algumas threads já ocupam a CPU.
+TRABALHADORES_POR_FAIXA = {FAIXA_XML: 4, FAIXA_PDF_TEXTO: 2, FAIXA_OCR: 2}
+# Orçamento de tempo (s) por arquivo em cada faixa.
+ORCAMENTO_POR_FAIXA = {FAIXA_XML: 10.0, FAIXA_PDF_TEXTO: 30.0, FAIXA_OCR: 180.0}
+# Tolerância além do orçamento antes de o escalonador desistir de esperar um arquivo.
+TOLERANCIA_PRAZO = 10.0
+# Máximo de entradas lidas e ainda não concluídas (limita a memória com membros de ZIP/TAR).
+MAX_PENDENTES = 1000
+
+# Função que processa uma entrada em uma faixa até o prazo (time.monotonic()) e devolve o resultado.
+FuncaoProcessamento = Callable[[EntradaLote, str, float], Dict[str, Any]]
+
+
+def faixa_inicial(entrada: EntradaLote) -> str:
+    """XMLs vão para a faixa rápida; PDFs começam pela faixa de texto e só vão ao OCR se precisarem."""
+    return FAIXA_XML if entrada.extensao == '.xml' else FAIXA_PDF_TEXTO
+
+
+class EscalonadorLote:
+    """
+    Escalonador do processamento em lote com uma faixa (pool de threads) por custo:
+    XML, PDF com camada de texto e PDF escaneado (OCR).
+
+    Cada faixa tem seus próprios trabalhadores, então XMLs de milissegundos não ficam presos
+    atrás de um OCR de dezenas de segundos, e os resultados são devolvidos na ordem em que
+    ficam prontos. Um PDF cujo resultado traz `requer_ocr` é reenviado à faixa de OCR.
+
+    Cada arquivo recebe um prazo (orçamento da faixa) que `processar` deve respeitar de
+    forma cooperativa; se mesmo assim ele passar do prazo mais a tolerância, o arquivo é
+    dado como falha e o resultado tardio é descartado.
+
+    Com um `governador`, a leitura de novas entradas também pausa enquanto ele não as
+    admitir (documentos em andamento ou memória acima do limite). Com uma captura de `perfil`,
+    o processamento de cada arquivo nas threads das faixas entra no perfil (ver `CapturaPerfil.na_thread`).
+    """
+
+    def __init__(self, processar: FuncaoProcessamento, trabalhadores: Optional[Dict[str, int]] = None,
+                 orcamentos: Optional[Dict[str, float]] = None, max_pendentes: int = MAX_PENDENTES,
+                 governador: Optional[GovernadorRecursos] = None, perfil: Optional[CapturaPerfil] = None):
+        self.processar = processar
+        self.trabalhadores = {**TRABALHADORES_POR_FAIXA, **(trabalhadores or {})}
+        self.orcamentos = {**ORCAMENTO_POR_FAIXA, **(orcamentos or {})}
+        self.max_pendentes = max_pendentes
+        self.governador = governador
+        self.perfil = perfil
+        self.estatisticas = {faixa: {"concluidos": 0, "tempo_total": 0.0, "prazo_excedido": 0}
+                             for faixa in self.trabalhadores}
+        self.estatisticas[FAIXA_PDF_TEXTO]["encaminhados_ocr"] = 0
+
+    def _executar(self, entrada: EntradaLote, faixa: str, marca: Dict[str, float]) -> Tuple[Dict[str, Any], float]:
+        if self.governador is not None:
+            # Espera a memória comportar mais um documento; a espera não conta no prazo.
+            self.governador.iniciar_documento()
+        inicio = time.monotonic()
+        # Registra o início real (e não o envio), para o prazo não contar o tempo na fila.
+        marca["inicio"] = inicio
+        try:
+            with self.perfil.na_thread() if self.perfil is not None else nullcontext():
+                resultado = self.processar(entrada, faixa, inicio + self.orcamentos[faixa])
+        except Exception as e:
+            resultado = {"erro": str(e)}
+        finally:
+            if self.governador is not None:
+                self.governador.concluir_documento()
+        return resultado, time.monotonic() - inicio
+
+    def executar(self, entradas: Iterable[EntradaLote]) -> Iterator[Tuple[EntradaLote, str, Dict[str, Any]]]:
+        """
+        Processa as entradas e gera (entrada, faixa, resultado) à medida que cada uma termina.
+        A leitura das entradas pausa enquanto houver `max_pendentes` em andamento ou o
+        governador não admitir mais nenhuma.
+        """
+        pools = {faixa: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"lote-{faixa}")
+                 for faixa, n in self.trabalhadores.items()}
+        # Futuro -> (entrada, faixa, marca com o instante em que a thread começou o arquivo).
+        pendentes: Dict[Future, Tuple[EntradaLote, str, Dict[str, float]]] = {}
+        iterador = iter(entradas)
+        esgotado = False
+
+        def enviar(entrada: EntradaLote, faixa: str):
+            marca: Dict[str, float] = {}
+            pendentes[pools[faixa].submit(self._executar, entrada, faixa, marca)] = (entrada, faixa, marca)
+
+        try:
+            while pendentes or not esgotado:
+                while (not esgotado and len(pendentes) < self.max_pendentes
+                       and (self.governador is None or self.governador.admitir(len(pendentes)))):
+                    entrada = next(iterador, None)
+                    if entrada is None:
+                        esgotado = True
+                        break
+                    if entrada.erro:
+                        yield entrada, faixa_inicial(entrada), {"erro": entrada.erro}
+                        continue
+                    enviar(entrada, faixa_inicial(entrada))
+
+                if not pendentes:
+                    continue
+                prontos, _ = wait(list(pendentes), timeout=1.0, return_when=FIRST_COMPLETED)
+
+                for futuro in prontos:
+                    entrada, faixa, _ = pendentes.pop(futuro)
+                    resultado, duracao = futuro.result()
+                    estatisticas = self.estatisticas[faixa]
+                    estatisticas["concluidos"] += 1
+                    estatisticas["tempo_total"] += duracao
+                    if resultado.get("prazo_excedido"):
+                        estatisticas["prazo_excedido"] += 1
+                    if resultado.get("requer_ocr") and faixa == FAIXA_PDF_TEXTO:
+                        estatisticas["encaminhados_ocr"] += 1
+                        enviar(entrada, FAIXA_OCR)
+                        continue
+                    yield entrada, faixa, resultado
+
+                # Arquivos que ignoraram o prazo cooperativo: desiste de esperar por eles.
+                agora = time.monotonic()
+                atrasados = [futuro for futuro, (_, faixa, marca) in pendentes.items()
+                             if not futuro.done() and "inicio" in marca
+                             and agora - marca["inicio"] > self.orcamentos[faixa] + TOLERANCIA_PRAZO]
+                for futuro in atrasados:
+                    entrada, faixa, _ = pendentes.pop(futuro)
+                    self.estatisticas[faixa]["prazo_excedido"] += 1
+                    yield entrada, faixa, {
+                        "erro": f"Tempo limite de {self.orcamentos[faixa]:g}s excedido na faixa '{faixa}'.",
+                        "prazo_excedido": True,
+                    }
+        finally:
+            for pool in pools.values():
+                # Não espera threads presas em arquivos abandonados.
+                pool.shutdown(wait=False, cancel_futures=True)
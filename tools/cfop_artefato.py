@@ -0,0 +1,7 @@
+# tools/cfop_artefato.py
+# Formato do artefato SQLite da tabela de CFOPs, compartilhado entre quem o grava (o crawler)
+# e quem o lê (CFOPClassifierAgent.carregar_dados_cfop). Sem dependências: o classificador
+# importa daqui sem carregar requests e bs4.
+
+# Versão do formato do artefato; muda quando o esquema do .db muda.
+FORMATO_ARTEFATO_CFOP = 1
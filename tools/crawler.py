@@ -4,20 +4,115 @@ from bs4 import BeautifulSoup
 import re
 from datetime import datetime
 import csv
+import hashlib
 import json
+import queue
+import sqlite3
+import threading
+import time
 import urllib3
 import os
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from pathlib import Path  # Importar a biblioteca Path
 
+try:
+    from tools.cfop_artefato import FORMATO_ARTEFATO_CFOP
+except ImportError:  # executado como script: python tools/crawler.py
+    from cfop_artefato import FORMATO_ARTEFATO_CFOP
+
 # Desabilitar warnings de SSL (apenas para desenvolvimento)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
+# Ponteiro estável para a versão vigente da tabela de CFOPs (lido pelo orquestrador na inicialização).
+ARQUIVO_PONTEIRO_ATUAL = "cfop_atual.json"
+# Estado da última consulta ao CONFAZ (validadores HTTP e hashes), usado nas atualizações condicionais.
+ARQUIVO_ESTADO = "cfop_crawler_estado.json"
+# Campos que definem o conteúdo da tabela; 'data_extracao' muda a cada execução e fica de fora.
+CAMPOS_CONTEUDO = ('cfop', 'descricao', 'tipo_operacao')
+# Prazo total (s) para obter a página, somando todas as URLs e estratégias.
+PRAZO_TOTAL_PADRAO = 60.0
+# Após quantos segundos sem resposta a próxima URL também é consultada (requisição "hedge").
+ATRASO_HEDGE_PADRAO = 2.0
+# Timeouts (s) de cada tentativa: conexão e intervalo máximo entre bytes recebidos.
+TIMEOUT_CONEXAO = 5
+TIMEOUT_LEITURA = 20
+
+# Marcador de início de um CFOP na listagem ("1.101 - ..."). Não há quantificadores
+# abertos: cada busca avança sobre o texto sem retrocesso.
+_RE_MARCADOR_CFOP = re.compile(r'(\d\.\d{3})\s*[-–—](\s*)')
+_RE_CODIGO_CFOP = re.compile(r'\d\.\d{3}')
+_RE_REDACAO = re.compile(r'Redação', re.IGNORECASE)
+_RE_CLASSIFICAM_SE = re.compile(r'Classificam-se', re.IGNORECASE)
+_RE_CLASSIFICAM_NESTE_CODIGO = re.compile(r'Classificam-se neste código', re.IGNORECASE)
+# Um marcador "X.XXX -" nos bytes da resposta (hífen, ou travessão em UTF-8 ou cp1252):
+# uma página 200 sem nenhum é um erro disfarçado (manutenção, portal de login etc.).
+_RE_MARCADOR_CFOP_BYTES = re.compile(rb'\d\.\d{3}\s*(?:-|\xe2\x80[\x93\x94]|[\x96\x97])')
+
+
+def _tokenizar_cfops(texto):
+    """
+    Divide o texto da página em pares (codigo, descricao) em uma única passada.
+
+    Os marcadores "X.XXX -" são localizados uma vez; a descrição de cada CFOP é a fatia
+    do texto até o próximo marcador. Equivale à antiga regex com `.+?` e lookahead
+    (inclusive na regra de que a descrição tem ao menos um caractere, o que faz um
+    marcador colado ao anterior ser absorvido pela descrição), mas sem backtracking.
+    """
+    marcadores = list(_RE_MARCADOR_CFOP.finditer(texto))
+    pares = []
+    i = 0
+    while i < len(marcadores):
+        marcador = marcadores[i]
+        inicio = marcador.end()
+
+        proximo = i + 1
+        while proximo < len(marcadores) and marcadores[proximo].start() <= inicio:
+            proximo += 1
+        fim = marcadores[proximo].start() if proximo < len(marcadores) else len(texto)
+
+        # No fim do texto só há descrição se sobrou ao menos um espaço após o hífen.
+        if fim > inicio or marcador.group(2):
+            pares.append((marcador.group(1), texto[inicio:fim]))
+        i = proximo
+    return pares
+
+
+def _remover_trechos(texto, padrao_inicio, padrao_fim):
+    """
+    Remove cada trecho que começa em `padrao_inicio` e vai até o próximo `padrao_fim`
+    (exclusive) ou até o fim do texto. Substitui `re.sub(r'inicio.*?(?=fim|$)', '', texto)`
+    com buscas que só avançam.
+    """
+    partes = []
+    posicao = 0
+    while True:
+        inicio = padrao_inicio.search(texto, posicao)
+        if inicio is None:
+            break
+        partes.append(texto[posicao:inicio.start()])
+        fim = padrao_fim.search(texto, inicio.end())
+        if fim is None:
+            posicao = len(texto)
+            break
+        posicao = fim.start()
+    partes.append(texto[posicao:])
+    return ''.join(partes)
+
+
+def _limpar_descricao(descricao):
+    """Normaliza espaços e remove as notas de redação anterior e os textos explicativos do CFOP."""
+    descricao_limpa = ' '.join(descricao.split())
+    descricao_limpa = _remover_trechos(descricao_limpa, _RE_REDACAO, _RE_CLASSIFICAM_SE)
+    descricao_limpa = _remover_trechos(descricao_limpa, _RE_CLASSIFICAM_NESTE_CODIGO, _RE_CODIGO_CFOP)
+    return descricao_limpa.strip()
+
+
 class CFOPConfazCrawler:
-    def __init__(self):
-        self.urls = [
+    def __init__(self, urls=None, data_dir=None, prazo_total=PRAZO_TOTAL_PADRAO,
+                 atraso_hedge=ATRASO_HEDGE_PADRAO):
+        self.urls = urls or [
             "https://www.confaz.fazenda.gov.br/legislacao/ajustes/sinief/cfop_cvsn_70_vigente",
             "http://www.confaz.fazenda.gov.br/legislacao/ajustes/sinief/cfop_cvsn_70_vigente",  # HTTP como fallback
         ]
@@ -30,20 +125,12 @@ class CFOPConfazCrawler:
         # 4. / "data" anexa a pasta de dados.
         # O resultado final é o caminho absoluto e correto para '.../grupo_i2a2/data'
         project_root = Path(__file__).parent.parent
-        self.data_dir = project_root / "data"
+        self.data_dir = Path(data_dir) if data_dir else project_root / "data"
         os.makedirs(self.data_dir, exist_ok=True)
         # --- FIM DA CORREÇÃO ---
 
-        # Configurar sessão com retry strategy
-        self.session = requests.Session()
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+        self.prazo_total = prazo_total
+        self.atraso_hedge = atraso_hedge
 
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
@@ -52,37 +139,136 @@ class CFOPConfazCrawler:
             'Accept-Encoding': 'gzip, deflate, br'
         }
 
-    def tentar_conexao_segura(self):
-        """Tenta diferentes métodos de conexão"""
-        estrategias = [
-            {'verify': True},  # Tentativa padrão
-            {'verify': False},  # Sem verificação SSL
+    def _criar_sessao(self):
+        """Sessão com retry curto: a alternância entre URLs cobre as falhas mais longas."""
+        session = requests.Session()
+        retry_strategy = Retry(
+            total=2,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+        )
+        adapter = HTTPAdapter(max_retries=retry_strategy)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def tentar_conexao_segura(self, validadores=None):
+        """
+        Busca a página nas URLs candidatas em paralelo e retorna a primeira resposta válida.
+
+        Cada URL tem sua própria thread, que tenta as estratégias de verificação SSL em
+        sequência (só avança quando a anterior falha). A primeira URL começa na hora; cada
+        seguinte começa `atraso_hedge` segundos depois, ou imediatamente se todas as já
+        iniciadas falharam. Ao chegar a primeira resposta válida (200 com a tabela de CFOPs,
+        ou 304), as demais threads são abandonadas: não iniciam novas tentativas e descartam
+        o que receberem. Nada espera além de `prazo_total` segundos; esgotado o prazo, retorna None.
+
+        `validadores` é um dicionário {url: {'etag': ..., 'last_modified': ...}} da consulta anterior;
+        quando presente, a requisição é condicional e o servidor pode responder 304 (não modificado).
+        """
+        validadores = validadores or {}
+        estrategias = self._estrategias_verificacao()
+        prazo = time.monotonic() + self.prazo_total
+        cancelado = threading.Event()
+        resultados = queue.Queue()
+        # Threads daemon: uma tentativa abandonada não impede o processo de terminar.
+        faixas = [
+            threading.Thread(target=self._buscar_url, daemon=True,
+                             args=(url, estrategias, validadores.get(url, {}), prazo, cancelado, resultados))
+            for url in self.urls
         ]
 
-        # Tentar caminhos de certificados comuns se os básicos falharem
-        if Path('/etc/ssl/certs/ca-certificates.crt').exists():
-            estrategias.append({'verify': '/etc/ssl/certs/ca-certificates.crt'})
-        if Path('cacert.pem').exists():
-            estrategias.append({'verify': 'cacert.pem'})
+        iniciadas = terminadas = 0
+        proximo_inicio = time.monotonic()
+        try:
+            while True:
+                agora = time.monotonic()
+                if agora >= prazo:
+                    print(f"⏰ Prazo de {self.prazo_total:.0f}s esgotado sem resposta válida.")
+                    return None
+                if iniciadas < len(faixas) and (agora >= proximo_inicio or terminadas == iniciadas):
+                    faixas[iniciadas].start()
+                    iniciadas += 1
+                    proximo_inicio = agora + self.atraso_hedge
+                    continue
+                if terminadas == len(faixas):
+                    return None
 
-        for url in self.urls:
+                espera = prazo - agora
+                if iniciadas < len(faixas):
+                    espera = min(espera, proximo_inicio - agora)
+                try:
+                    response = resultados.get(timeout=max(espera, 0))
+                except queue.Empty:
+                    continue
+                if response is None:
+                    # A thread de uma URL esgotou suas estratégias.
+                    terminadas += 1
+                    continue
+                return response
+        finally:
+            cancelado.set()
+
+    def _buscar_url(self, url, estrategias, validador, prazo, cancelado, resultados):
+        """
+        Thread de uma URL: tenta as estratégias em sequência, publica a primeira resposta
+        válida em `resultados` e, ao terminar sem sucesso, publica None.
+        """
+        # Estratégias de verificação SSL não fazem diferença em HTTP simples.
+        if not url.lower().startswith('https://'):
+            estrategias = estrategias[:1]
+        session = self._criar_sessao()
+        try:
             for estrategia in estrategias:
+                restante = prazo - time.monotonic()
+                if cancelado.is_set() or restante <= 0:
+                    return
                 try:
                     print(f"🔗 Tentando {url} com verify={estrategia['verify']}...")
-                    response = self.session.get(
+                    response = session.get(
                         url,
-                        headers=self.headers,
-                        timeout=30,
+                        headers=self._headers_condicionais(validador),
+                        timeout=(min(TIMEOUT_CONEXAO, restante), min(TIMEOUT_LEITURA, restante)),
                         **estrategia
                     )
                     response.raise_for_status()
-                    print(f"✅ Conexão bem-sucedida com {url}")
-                    return response
+                    if response.status_code != 304 and not _RE_MARCADOR_CFOP_BYTES.search(response.content):
+                        raise ValueError("a resposta não contém a tabela de CFOPs")
                 except Exception as e:
-                    print(f"❌ Falha: {e}")
+                    print(f"❌ Falha em {url}: {e}")
                     continue
+                if cancelado.is_set():
+                    # Outra URL já respondeu; esta resposta é descartada.
+                    return
+                print(f"✅ Conexão bem-sucedida com {url} (HTTP {response.status_code})")
+                resultados.put(response)
+                return
+        finally:
+            session.close()
+            resultados.put(None)
+
+    def _estrategias_verificacao(self):
+        """Estratégias de verificação SSL, na ordem em que são tentadas para cada URL HTTPS."""
+        estrategias = [
+            {'verify': True},  # Tentativa padrão
+            {'verify': False},  # Sem verificação SSL
+        ]
 
-        return None
+        # Tentar caminhos de certificados comuns se os básicos falharem
+        if Path('/etc/ssl/certs/ca-certificates.crt').exists():
+            estrategias.append({'verify': '/etc/ssl/certs/ca-certificates.crt'})
+        if Path('cacert.pem').exists():
+            estrategias.append({'verify': 'cacert.pem'})
+        return estrategias
+
+    def _headers_condicionais(self, validador):
+        """Acrescenta If-None-Match / If-Modified-Since aos headers quando há validadores salvos."""
+        headers = dict(self.headers)
+        if validador.get('etag'):
+            headers['If-None-Match'] = validador['etag']
+        if validador.get('last_modified'):
+            headers['If-Modified-Since'] = validador['last_modified']
+        return headers
 
     def extrair_cfop_confaz(self):
         try:
@@ -93,8 +279,17 @@ class CFOPConfazCrawler:
                 print("🚨 Todas as tentativas de conexão falharam.")
                 return None
 
+            return self._parsear_html(response.content)
+
+        except Exception as e:
+            print(f"❌ Erro geral na extração: {e}")
+            return None
+
+    def _parsear_html(self, conteudo):
+        """Localiza a seção principal da página do CONFAZ e extrai os CFOPs."""
+        try:
             print("📖 Parseando HTML...")
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = BeautifulSoup(conteudo, 'lxml')
 
             # Estratégias para encontrar o conteúdo
             seletores = [
@@ -121,29 +316,22 @@ class CFOPConfazCrawler:
             return self._parsear_cfops(secao_principal)
 
         except Exception as e:
-            print(f"❌ Erro geral na extração: {e}")
+            print(f"❌ Erro ao parsear o HTML: {e}")
             return None
 
     def _parsear_cfops(self, secao):
         cfops_dict = {}  # Usar um dicionário para evitar duplicatas de código
 
-        # Padrão regex para encontrar códigos e descrições
-        padrao_cfop = re.compile(r'(\d\.\d{3})\s*[-–—]\s*(.+?)(?=\s*\d\.\d{3}\s*[-–—]|$)', re.DOTALL)
-
         texto_completo = secao.get_text(separator=' ')
-        matches = padrao_cfop.findall(texto_completo)
+        matches = _tokenizar_cfops(texto_completo)
 
         print(f"🔍 Encontrados {len(matches)} possíveis CFOPs...")
 
-        for codigo, descricao in matches:
-            codigo = codigo.strip()
+        # A data de extração é a mesma para toda a tabela.
+        data_extracao = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-            # Limpeza avançada da descrição
-            descricao_limpa = re.sub(r'\s+', ' ', descricao).strip()
-            descricao_limpa = re.sub(r'Redação.*?(?=Classificam-se|$)', '', descricao_limpa, flags=re.IGNORECASE)
-            descricao_limpa = re.sub(r'Classificam-se neste código.*?(?=\d\.\d{3}|$)', '', descricao_limpa,
-                                     flags=re.IGNORECASE)
-            descricao_limpa = descricao_limpa.strip()
+        for codigo, descricao in matches:
+            descricao_limpa = _limpar_descricao(descricao)
 
             # Se o código já existe, só atualizamos se a nova descrição for maior (mais completa)
             if codigo not in cfops_dict or len(descricao_limpa) > len(cfops_dict[codigo]['descricao']):
@@ -160,7 +348,7 @@ class CFOPConfazCrawler:
                     'descricao': descricao_limpa,
                     'tipo_operacao': tipo,
                     'fonte': 'CONFAZ',
-                    'data_extracao': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    'data_extracao': data_extracao
                 }
 
         cfops = sorted(list(cfops_dict.values()), key=lambda x: [int(part) for part in x['cfop'].split('.')])
@@ -168,6 +356,160 @@ class CFOPConfazCrawler:
         print(f"✅ Processados {len(cfops)} CFOPs únicos.")
         return cfops
 
+    def atualizar_tabela(self):
+        """
+        Atualização incremental da tabela de CFOPs.
+
+        1. Faz uma requisição condicional (ETag / If-Modified-Since); um 304 encerra a atualização.
+        2. Compara o hash da página com o da última consulta; página idêntica não é parseada.
+        3. Compara o hash do conteúdo da tabela com a versão vigente; só grava uma nova versão
+           (CSV + JSON) se algum CFOP foi adicionado, removido ou alterado.
+        4. Registra o diff da nova versão e atualiza o ponteiro estável 'cfop_atual.json'.
+
+        Retorna um dicionário com o status da atualização.
+        """
+        estado = self._carregar_estado()
+        atual = self.carregar_ponteiro_atual()
+
+        print("🌐 Conectando ao CONFAZ (requisição condicional)...")
+        # Os validadores só valem se a versão vigente que eles descrevem ainda existe.
+        validadores = estado.get('validadores', {}) if atual else {}
+        response = self.tentar_conexao_segura(validadores)
+        if response is None:
+            print("🚨 Todas as tentativas de conexão falharam.")
+            return {"status": "erro", "mensagem": "Todas as tentativas de conexão falharam."}
+
+        # Os validadores ficam associados à URL solicitada (antes de eventuais redirecionamentos).
+        url_solicitada = response.history[0].url if response.history else response.url
+        validadores = estado.get('validadores', {})
+        validador = validadores.setdefault(url_solicitada, {})
+        if response.headers.get('ETag'):
+            validador['etag'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            validador['last_modified'] = response.headers['Last-Modified']
+        estado['validadores'] = validadores
+        estado['ultima_consulta'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        if response.status_code == 304:
+            print("✅ CONFAZ informou que a página não mudou (HTTP 304). Nenhuma versão nova gravada.")
+            self._salvar_estado(estado)
+            return {"status": "nao_modificado", "versao_atual": atual.get('versao')}
+
+        hash_pagina = hashlib.sha256(response.content).hexdigest()
+        if atual and hash_pagina == estado.get('hash_pagina'):
+            print("✅ Conteúdo da página idêntico ao da última consulta. Nenhuma versão nova gravada.")
+            self._salvar_estado(estado)
+            return {"status": "sem_alteracoes", "versao_atual": atual.get('versao')}
+
+        cfops = self._parsear_html(response.content)
+        if not cfops:
+            return {"status": "erro", "mensagem": "Nenhum CFOP encontrado na página."}
+
+        estado['hash_pagina'] = hash_pagina
+        hash_tabela = self.calcular_hash_tabela(cfops)
+        if atual and hash_tabela == atual.get('hash_tabela'):
+            print("✅ A tabela de CFOPs não mudou. Nenhuma versão nova gravada.")
+            self._salvar_estado(estado)
+            return {"status": "sem_alteracoes", "versao_atual": atual.get('versao')}
+
+        anteriores = self._carregar_versao(atual) if atual else []
+        diff = self.calcular_diff(anteriores, cfops)
+
+        versao = datetime.now().strftime('%Y%m%d_%H%M%S')
+        csv_file = self.salvar_csv(cfops, f'cfop_confaz_{versao}.csv')
+        json_file = self.salvar_json(cfops, f'cfop_confaz_{versao}.json')
+        sqlite_file = self.salvar_sqlite(cfops, f'cfop_confaz_{versao}.db', hash_tabela=hash_tabela)
+
+        diff_file = self.data_dir / f'cfop_diff_{versao}.json'
+        self._gravar_json_atomico(diff_file, {
+            "versao": versao,
+            "versao_anterior": atual.get('versao') if atual else None,
+            **diff,
+        })
+
+        self._gravar_json_atomico(self.data_dir / ARQUIVO_PONTEIRO_ATUAL, {
+            "versao": versao,
+            "csv": Path(csv_file).name,
+            "json": Path(json_file).name,
+            "sqlite": Path(sqlite_file).name,
+            "diff": diff_file.name,
+            "hash_tabela": hash_tabela,
+            "total": len(cfops),
+            "atualizado_em": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        self._salvar_estado(estado)
+
+        print(f"🆕 Nova versão {versao}: {len(diff['adicionados'])} adicionados, "
+              f"{len(diff['removidos'])} removidos, {len(diff['alterados'])} alterados.")
+        return {"status": "atualizado", "versao_atual": versao, "cfops": cfops, **diff}
+
+    @staticmethod
+    def calcular_hash_tabela(cfops):
+        """Hash do conteúdo da tabela, independente da ordem e da data de extração."""
+        linhas = sorted(tuple(cfop.get(campo, '') for campo in CAMPOS_CONTEUDO) for cfop in cfops)
+        return hashlib.sha256(json.dumps(linhas, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def calcular_diff(anteriores, atuais):
+        """Lista os CFOPs adicionados, removidos e alterados entre duas versões da tabela."""
+        antes = {c['cfop']: c for c in anteriores}
+        depois = {c['cfop']: c for c in atuais}
+
+        alterados = []
+        for codigo in sorted(antes.keys() & depois.keys()):
+            campos = [campo for campo in CAMPOS_CONTEUDO if antes[codigo].get(campo) != depois[codigo].get(campo)]
+            if campos:
+                alterados.append({
+                    "cfop": codigo,
+                    "campos": campos,
+                    "antes": {campo: antes[codigo].get(campo) for campo in campos},
+                    "depois": {campo: depois[codigo].get(campo) for campo in campos},
+                })
+
+        return {
+            "adicionados": sorted(depois.keys() - antes.keys()),
+            "removidos": sorted(antes.keys() - depois.keys()),
+            "alterados": alterados,
+        }
+
+    def carregar_ponteiro_atual(self):
+        """Lê o ponteiro da versão vigente; retorna {} se ainda não existe ou se aponta para arquivos removidos."""
+        caminho = self.data_dir / ARQUIVO_PONTEIRO_ATUAL
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                ponteiro = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if not (self.data_dir / ponteiro.get('json', '')).is_file():
+            return {}
+        return ponteiro
+
+    def _carregar_versao(self, ponteiro):
+        """Carrega os CFOPs da versão indicada pelo ponteiro (usada como base do diff)."""
+        try:
+            with open(self.data_dir / ponteiro['json'], 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (KeyError, FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def _carregar_estado(self):
+        try:
+            with open(self.data_dir / ARQUIVO_ESTADO, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _salvar_estado(self, estado):
+        self._gravar_json_atomico(self.data_dir / ARQUIVO_ESTADO, estado)
+
+    @staticmethod
+    def _gravar_json_atomico(caminho, dados):
+        """Grava em um arquivo temporário e o renomeia, para que leitores nunca vejam um JSON pela metade."""
+        temporario = caminho.with_suffix(caminho.suffix + '.tmp')
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, ensure_ascii=False, indent=2)
+        os.replace(temporario, caminho)
+
     def salvar_csv(self, cfops, filename=None):
         if not cfops: return None
         if filename is None:
@@ -199,6 +541,45 @@ class CFOPConfazCrawler:
         print(f"💾 JSON salvo em: {filepath}")
         return filepath
 
+    def salvar_sqlite(self, cfops, filename=None, hash_tabela=None):
+        """
+        Grava o artefato compacto e pré-normalizado da tabela (SQLite, uma linha por CFOP),
+        que o classificador carrega em milissegundos sem depender do pandas.
+        """
+        if not cfops: return None
+        if filename is None:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f'cfop_confaz_{timestamp}.db'
+
+        filepath = self.data_dir / filename
+        temporario = filepath.with_suffix('.db.tmp')
+        temporario.unlink(missing_ok=True)
+
+        conn = sqlite3.connect(temporario)
+        try:
+            conn.execute("CREATE TABLE meta (chave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE cfop (cfop TEXT PRIMARY KEY, descricao TEXT, tipo_operacao TEXT, "
+                "fonte TEXT, data_extracao TEXT) WITHOUT ROWID"
+            )
+            # Os códigos extraídos pelo crawler já estão no formato normalizado 'X.XXX'.
+            conn.executemany(
+                "INSERT OR IGNORE INTO cfop VALUES (:cfop, :descricao, :tipo_operacao, :fonte, :data_extracao)",
+                cfops
+            )
+            conn.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ('formato_versao', str(FORMATO_ARTEFATO_CFOP)),
+                ('hash_tabela', hash_tabela or self.calcular_hash_tabela(cfops)),
+                ('gerado_em', datetime.now().strftime('%Y-%m-%d %H:%M:%S')),
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(temporario, filepath)
+
+        print(f"💾 Artefato SQLite salvo em: {filepath}")
+        return filepath
+
     def mostrar_estatisticas(self, cfops):
         if not cfops:
             print("❌ Nenhum CFOP para exibir estatísticas.")
@@ -229,18 +610,20 @@ def main():
     print("🚀 Iniciando extração de CFOPs do CONFAZ...")
 
     crawler = CFOPConfazCrawler()
-    cfops = crawler.extrair_cfop_confaz()
+    resultado = crawler.atualizar_tabela()
 
-    if cfops:
-        crawler.mostrar_estatisticas(cfops)
-        csv_file = crawler.salvar_csv(cfops)
-        json_file = crawler.salvar_json(cfops)
+    if resultado['status'] == 'atualizado':
+        crawler.mostrar_estatisticas(resultado['cfops'])
+        ponteiro = crawler.carregar_ponteiro_atual()
 
         print(f"\n🎯 Extração concluída!")
-        if csv_file and json_file:
-            print(f"📁 Arquivos gerados na pasta 'data':")
-            print(f"   - {Path(csv_file).name}")
-            print(f"   - {Path(json_file).name}")
+        print(f"📁 Arquivos gerados na pasta 'data':")
+        print(f"   - {ponteiro['csv']}")
+        print(f"   - {ponteiro['json']}")
+        print(f"   - {ponteiro['sqlite']}")
+        print(f"   - {ponteiro['diff']}")
+    elif resultado['status'] in ('nao_modificado', 'sem_alteracoes'):
+        print(f"\n🎯 Tabela de CFOPs já está atualizada (versão {resultado['versao_atual']}).")
     else:
         print("❌ Falha completa na extração. Nenhum arquivo foi gerado.")
 
@@ -1,16 +1,36 @@
 import xml.etree.ElementTree as ET
-from typing import Dict, Any
+from typing import Container, Dict, Any, Optional, Union
 
 # --- NOVO IMPORT MODULAR ---
 from tools.pdf_parser import parse_pdf_to_structured_data
+from tools.document_model import CabecalhoNota, DocumentoFiscal, ItemNota
+from tools.document_source import DocumentSource, abrir_conteudo
+from tools.resource_governor import GovernadorRecursos
 
 NS = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
 
-def extract_from_xml(file_path: str) -> Dict[str, Any]:
-    """Extrai dados de um arquivo XML de NF-e, incluindo o CNAE."""
+
+def _parse_xml(source: DocumentSource) -> ET.Element:
+    """
+    Faz o parse do XML a partir de qualquer fonte aceita, sem cópias intermediárias:
+    o conteúdo (bytes, visão de um buffer ou arquivo grande mapeado em memória) é
+    entregue de uma vez ao parser, em vez de lido em blocos por um BytesIO/arquivo.
+    """
+    parser = ET.XMLParser()
+    with abrir_conteudo(source) as conteudo:
+        parser.feed(conteudo)
+    return parser.close()
+
+
+def extract_from_xml(source: DocumentSource) -> Union[DocumentoFiscal, Dict[str, Any]]:
+    """
+    Extrai dados de um XML de NF-e, incluindo o CNAE.
+    Aceita o caminho do arquivo, o conteúdo em memória (bytes, bytearray, memoryview ou
+    mmap) ou um objeto de arquivo binário.
+    Retorna um DocumentoFiscal (com interface de dicionário) ou {"erro": ...}.
+    """
     try:
-        tree = ET.parse(file_path)
-        root = tree.getroot()
+        root = _parse_xml(source)
 
         infNFe = root.find('.//nfe:infNFe', NS)
         if infNFe is None:
@@ -21,42 +41,49 @@ def extract_from_xml(file_path: str) -> Dict[str, Any]:
         dest = infNFe.find('nfe:dest', NS)
         total = infNFe.find('nfe:total/nfe:ICMSTot', NS)
 
-        header_data = {
-            'chave_acesso': infNFe.attrib.get('Id', '').replace('NFe', ''),
-            'numero_nf': ide.findtext('nfe:nNF', namespaces=NS),
-            'data_emissao': ide.findtext('nfe:dhEmi', namespaces=NS),
-            'valor_total': float(total.findtext('nfe:vNF', default=0, namespaces=NS)),
-            'emitente_nome': emit.findtext('nfe:xNome', namespaces=NS),
-            'emitente_cnpj': emit.findtext('nfe:CNPJ', namespaces=NS),
-            'emitente_cnae': emit.findtext('nfe:CNAE', namespaces=NS), # Importante para detecção de ramo
-            'destinatario_nome': dest.findtext('nfe:xNome', namespaces=NS),
-            'destinatario_cpf_cnpj': dest.findtext('nfe:CPF', namespaces=NS) or dest.findtext('nfe:CNPJ', namespaces=NS),
-        }
+        header_data = CabecalhoNota(
+            chave_acesso=infNFe.attrib.get('Id', '').replace('NFe', ''),
+            numero_nf=ide.findtext('nfe:nNF', namespaces=NS),
+            data_emissao=ide.findtext('nfe:dhEmi', namespaces=NS),
+            valor_total=float(total.findtext('nfe:vNF', default=0, namespaces=NS)),
+            emitente_nome=emit.findtext('nfe:xNome', namespaces=NS),
+            emitente_cnpj=emit.findtext('nfe:CNPJ', namespaces=NS),
+            emitente_cnae=emit.findtext('nfe:CNAE', namespaces=NS), # Importante para detecção de ramo
+            destinatario_nome=dest.findtext('nfe:xNome', namespaces=NS),
+            destinatario_cpf_cnpj=dest.findtext('nfe:CPF', namespaces=NS) or dest.findtext('nfe:CNPJ', namespaces=NS),
+        )
 
         items_data = []
         for det in infNFe.findall('nfe:det', NS):
             prod = det.find('nfe:prod', NS)
-            item = {
-                'numero_item': det.attrib.get('nItem'),
-                'codigo_produto': prod.findtext('nfe:cProd', namespaces=NS),
-                'descricao': prod.findtext('nfe:xProd', namespaces=NS),
-                'cfop': prod.findtext('nfe:CFOP', namespaces=NS),
-                'quantidade': float(prod.findtext('nfe:qCom', default=0, namespaces=NS)),
-                'valor_unitario': float(prod.findtext('nfe:vUnCom', default=0, namespaces=NS)),
-                'valor_produto': float(prod.findtext('nfe:vProd', default=0, namespaces=NS)),
-            }
+            item = ItemNota(
+                numero_item=det.attrib.get('nItem'),
+                codigo_produto=prod.findtext('nfe:cProd', namespaces=NS),
+                descricao=prod.findtext('nfe:xProd', namespaces=NS),
+                cfop=prod.findtext('nfe:CFOP', namespaces=NS),
+                quantidade=float(prod.findtext('nfe:qCom', default=0, namespaces=NS)),
+                valor_unitario=float(prod.findtext('nfe:vUnCom', default=0, namespaces=NS)),
+                valor_produto=float(prod.findtext('nfe:vProd', default=0, namespaces=NS)),
+            )
             items_data.append(item)
 
-        return {"cabecalho": header_data, "itens": items_data}
+        return DocumentoFiscal(header_data, items_data)
 
     except Exception as e:
         return {"erro": f"Falha ao processar o XML: {str(e)}"}
 
 # --- FUNÇÃO ATUALIZADA ---
-def extract_data_from_pdf(file_path: str) -> Dict[str, Any]:
+def extract_data_from_pdf(source: DocumentSource, permitir_ocr: bool = True,
+                          prazo: Optional[float] = None, ocr_adaptativo: bool = True,
+                          cfops_validos: Optional[Container[str]] = None,
+                          governador: Optional[GovernadorRecursos] = None) -> Union[DocumentoFiscal, Dict[str, Any]]:
     """
     Função de fachada que chama o parser de PDF dedicado.
-    Mantém a interface do extrator consistente.
+    Mantém a interface do extrator consistente (caminho, conteúdo em memória ou objeto de arquivo).
+    `permitir_ocr`, `prazo`, `ocr_adaptativo`, `cfops_validos` e `governador` são repassados
+    ao parser (ver `parse_pdf_to_structured_data`).
     """
     print("🚀 Iniciando extração de dados do PDF...")
-    return parse_pdf_to_structured_data(file_path)
\ No newline at end of file
+    return parse_pdf_to_structured_data(source, permitir_ocr=permitir_ocr, prazo=prazo,
+                                        ocr_adaptativo=ocr_adaptativo, cfops_validos=cfops_validos,
+                                        governador=governador)
\ No newline at end of file
@@ -0,0 +1,153 @@
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+
+class _RegistroCompacto(Mapping):
+    """
+    Base dos registros do documento fiscal.
+
+    Os campos ficam em `__slots__` (sem um `__dict__` por instância), mas o registro
+    se comporta como um dicionário somente leitura: `registro['cfop']`,
+    `registro.get('cfop')`, `'cfop' in registro`, `dict(registro)` etc.
+    Assim o dashboard e os agentes setoriais continuam usando a mesma interface.
+    """
+    __slots__ = ()
+    _campos: Tuple[str, ...] = ()
+    _conjunto_campos: frozenset = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._campos = tuple(cls.__slots__)
+        cls._conjunto_campos = frozenset(cls._campos)
+
+    def __getitem__(self, chave: str) -> Any:
+        if chave in self._conjunto_campos:
+            return getattr(self, chave)
+        raise KeyError(chave)
+
+    def __iter__(self):
+        return iter(self._campos)
+
+    def __len__(self) -> int:
+        return len(self._campos)
+
+    def __repr__(self) -> str:
+        campos = ', '.join(f"{campo}={getattr(self, campo)!r}" for campo in self._campos)
+        return f"{type(self).__name__}({campos})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Cópia em dicionário comum (ex.: para serializar em JSON)."""
+        return {campo: getattr(self, campo) for campo in self._campos}
+
+
+def _intern(valor: Optional[str]) -> Optional[str]:
+    """
+    Interna strings que se repetem muito entre notas (CFOP, CNPJ, CNAE), para que
+    um lote grande guarde uma única cópia de cada valor.
+    """
+    return sys.intern(valor) if isinstance(valor, str) else valor
+
+
+class ItemNota(_RegistroCompacto):
+    """Item (det/prod) de uma nota fiscal."""
+    __slots__ = ('numero_item', 'codigo_produto', 'descricao', 'cfop',
+                 'quantidade', 'valor_unitario', 'valor_produto')
+
+    def __init__(self, numero_item: Optional[str] = None, codigo_produto: Optional[str] = None,
+                 descricao: Optional[str] = None, cfop: Optional[str] = None,
+                 quantidade: Optional[float] = None, valor_unitario: Optional[float] = None,
+                 valor_produto: Optional[float] = None):
+        self.numero_item = _intern(numero_item)
+        self.codigo_produto = codigo_produto
+        self.descricao = descricao
+        self.cfop = _intern(cfop)
+        self.quantidade = quantidade
+        self.valor_unitario = valor_unitario
+        self.valor_produto = valor_produto
+
+
+class CabecalhoNota(_RegistroCompacto):
+    """Dados de cabeçalho (ide/emit/dest/total) de uma nota fiscal."""
+    __slots__ = ('chave_acesso', 'numero_nf', 'data_emissao', 'valor_total',
+                 'emitente_nome', 'emitente_cnpj', 'emitente_cnae',
+                 'destinatario_nome', 'destinatario_cpf_cnpj')
+
+    def __init__(self, chave_acesso: Optional[str] = None, numero_nf: Optional[str] = None,
+                 data_emissao: Optional[str] = None, valor_total: Optional[float] = None,
+                 emitente_nome: Optional[str] = None, emitente_cnpj: Optional[str] = None,
+                 emitente_cnae: Optional[str] = None, destinatario_nome: Optional[str] = None,
+                 destinatario_cpf_cnpj: Optional[str] = None):
+        self.chave_acesso = chave_acesso
+        self.numero_nf = numero_nf
+        self.data_emissao = data_emissao
+        self.valor_total = valor_total
+        self.emitente_nome = _intern(emitente_nome)
+        self.emitente_cnpj = _intern(emitente_cnpj)
+        self.emitente_cnae = _intern(emitente_cnae)
+        self.destinatario_nome = _intern(destinatario_nome)
+        self.destinatario_cpf_cnpj = _intern(destinatario_cpf_cnpj)
+
+
+class LeituraOCR(_RegistroCompacto):
+    """
+    Como o texto de um PDF escaneado foi lido: o zoom (e a resolução em DPI) da renderização
+    usada, quantas renderizações foram feitas e os campos que continuaram sem validar.
+    """
+    __slots__ = ('zoom', 'dpi', 'tentativas', 'campos_invalidos')
+
+    def __init__(self, zoom: float, dpi: Optional[int] = None, tentativas: int = 1,
+                 campos_invalidos: Iterable[str] = ()):
+        self.zoom = zoom
+        self.dpi = dpi if dpi is not None else round(72 * zoom)
+        self.tentativas = tentativas
+        self.campos_invalidos = tuple(campos_invalidos)
+
+    def to_dict(self) -> Dict[str, Any]:
+        dados = super().to_dict()
+        dados['campos_invalidos'] = list(self.campos_invalidos)
+        return dados
+
+
+class DocumentoFiscal(_RegistroCompacto):
+    """
+    Documento fiscal extraído de um XML ou PDF.
+    Equivale ao antigo dicionário {"cabecalho": {...}, "itens": [{...}, ...]};
+    os itens ficam em uma tupla. Documentos lidos por OCR trazem também a `LeituraOCR`.
+    """
+    __slots__ = ('cabecalho', 'itens', 'ocr')
+
+    def __init__(self, cabecalho: CabecalhoNota, itens: Iterable[ItemNota] = (),
+                 ocr: Optional[LeituraOCR] = None):
+        self.cabecalho = cabecalho
+        self.itens = tuple(itens)
+        self.ocr = ocr
+
+    def to_dict(self) -> Dict[str, Any]:
+        dados = {"cabecalho": self.cabecalho.to_dict(), "itens": [item.to_dict() for item in self.itens]}
+        if self.ocr is not None:
+            dados["ocr"] = self.ocr.to_dict()
+        return dados
+
+    @classmethod
+    def from_dict(cls, dados: Dict[str, Any]) -> "DocumentoFiscal":
+        """Reconstrói o documento a partir do formato em dicionário (ex.: JSON persistido)."""
+        return cls(
+            CabecalhoNota(**dados.get("cabecalho", {})),
+            (ItemNota(**item) for item in dados.get("itens", [])),
+            LeituraOCR(**dados["ocr"]) if dados.get("ocr") else None,
+        )
+
+
+def para_dict(valor: Any) -> Any:
+    """
+    Converte recursivamente registros compactos (e listas/dicionários que os contenham)
+    em estruturas JSON comuns, por exemplo para `st.json` ou `json.dump`.
+    """
+    if isinstance(valor, _RegistroCompacto):
+        return para_dict(valor.to_dict())
+    if isinstance(valor, Mapping):
+        return {chave: para_dict(v) for chave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [para_dict(v) for v in valor]
+    return valor
@@ -0,0 +1,76 @@
+import io
+import mmap
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Union
+
+# Fonte aceita pelos extratores: caminho no disco, conteúdo em memória (bytes, bytearray,
+# memoryview ou mmap) ou objeto de arquivo binário.
+DocumentSource = Union[str, Path, bytes, bytearray, memoryview, mmap.mmap, BinaryIO]
+
+# A partir deste tamanho, arquivos no disco são mapeados em memória em vez de lidos.
+LIMIAR_MMAP = 1 << 20
+
+
+def is_caminho(source: DocumentSource) -> bool:
+    return isinstance(source, (str, Path))
+
+
+@contextmanager
+def _visao(objeto, inicio: int = 0) -> Iterator[memoryview]:
+    """Visão (sem cópia) do buffer de `objeto` a partir de `inicio`, liberada na saída."""
+    with memoryview(objeto) as visao:
+        with visao[inicio:].cast('B') as fatia:
+            yield fatia
+
+
+@contextmanager
+def _mapear(arquivo: BinaryIO, inicio: int = 0) -> Iterator[memoryview]:
+    """Mapeia o arquivo aberto (somente leitura) e gera uma visão a partir de `inicio`."""
+    with mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        # As visões são liberadas (pelo `with` interno) antes de o mapa ser fechado.
+        with _visao(mapa, inicio) as visao:
+            yield visao
+
+
+def _tamanho_restante(arquivo: BinaryIO) -> Optional[int]:
+    """Bytes entre a posição atual e o fim de um arquivo real do disco (None para outros streams)."""
+    try:
+        return os.fstat(arquivo.fileno()).st_size - arquivo.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+@contextmanager
+def abrir_conteudo(source: DocumentSource, limiar_mmap: int = LIMIAR_MMAP) -> Iterator[Union[bytes, memoryview]]:
+    """
+    Entrega o conteúdo da fonte como um objeto de bytes, sem copiá-lo sempre que possível:
+      - bytes são repassados; bytearray, memoryview, mmap e BytesIO viram uma visão
+        (memoryview de bytes) do próprio buffer;
+      - arquivos no disco (caminho ou objeto de arquivo) a partir de `limiar_mmap` bytes são
+        mapeados em memória; os menores são lidos normalmente.
+    As visões criadas aqui são liberadas na saída do `with`; o conteúdo não deve ser usado depois.
+    """
+    if isinstance(source, bytes):
+        yield source
+    elif isinstance(source, (bytearray, memoryview, mmap.mmap)):
+        with _visao(source) as visao:
+            yield visao
+    elif isinstance(source, io.BytesIO):
+        with _visao(source.getbuffer(), source.tell()) as visao:
+            yield visao
+    elif is_caminho(source):
+        with open(source, 'rb') as arquivo:
+            if os.fstat(arquivo.fileno()).st_size >= limiar_mmap:
+                with _mapear(arquivo) as visao:
+                    yield visao
+            else:
+                yield arquivo.read()
+    else:
+        restante = _tamanho_restante(source)
+        if restante is not None and restante >= limiar_mmap:
+            with _mapear(source, source.tell()) as visao:
+                yield visao
+        else:
+            yield source.read()
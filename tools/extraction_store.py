@@ -0,0 +1,145 @@
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+_SQL_CRIAR_TABELAS = """
+CREATE TABLE IF NOT EXISTS extracoes (
+    identificador TEXT PRIMARY KEY,
+    nome TEXT NOT NULL,
+    destino TEXT,
+    dados TEXT NOT NULL,
+    resultado TEXT NOT NULL,
+    versao_config TEXT NOT NULL,
+    atualizado_em TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_extracoes_versao ON extracoes (versao_config);
+CREATE TABLE IF NOT EXISTS dependencias (
+    chave TEXT NOT NULL,
+    identificador TEXT NOT NULL,
+    PRIMARY KEY (chave, identificador)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_dependencias_identificador ON dependencias (identificador);
+CREATE TABLE IF NOT EXISTS versoes_config (
+    versao TEXT PRIMARY KEY,
+    instantaneo TEXT NOT NULL,
+    criada_em TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class ExtracaoArmazenada(NamedTuple):
+    """Uma extração guardada: dados do documento e a última classificação obtida a partir deles."""
+    identificador: str
+    nome: str
+    destino: Optional[str]
+    dados: Dict[str, Any]
+    resultado: Dict[str, Any]
+
+
+def _serializar(valor: Any) -> Any:
+    # Registros compactos (DocumentoFiscal etc.) viram dicionários; o resto do JSON fica com o codificador em C.
+    return valor.to_dict() if hasattr(valor, 'to_dict') else str(valor)
+
+
+def impressao_digital(valor: Any) -> str:
+    """Resumo estável (independente da ordem das chaves) de um valor de configuração ou resultado."""
+    texto = json.dumps(valor, sort_keys=True, ensure_ascii=False, default=_serializar)
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()[:16]
+
+
+def versao_instantaneo(instantaneo: Dict[str, str]) -> str:
+    """Versão da configuração: o resumo de todas as impressões digitais do instantâneo."""
+    return impressao_digital(sorted(instantaneo.items()))
+
+
+def chaves_alteradas(antigo: Dict[str, str], novo: Dict[str, str]) -> Set[str]:
+    """Chaves de configuração incluídas, removidas ou com valor diferente entre dois instantâneos."""
+    return {chave for chave in antigo.keys() | novo.keys() if antigo.get(chave) != novo.get(chave)}
+
+
+def _json(valor: Any) -> str:
+    return json.dumps(valor, ensure_ascii=False, default=_serializar)
+
+
+class ArmazemExtracoes:
+    """
+    Extrações persistidas (em 'output/extracoes.db'), separadas da classificação.
+
+    Para cada documento guarda os dados extraídos, a classificação obtida, a versão da
+    configuração usada e as chaves de configuração que a classificação leu (ex.: 'cfop:5.102',
+    'cnae:47', 'ramo:comercio', 'regras:comercio'). Cada versão da configuração é registrada
+    como um instantâneo {chave: impressão digital}; comparando o instantâneo antigo com o
+    atual, `afetadas` devolve só os documentos que leram alguma chave alterada, e os demais
+    apenas mudam de versão, sem reclassificação.
+    """
+
+    def __init__(self, caminho_db: Path):
+        self.caminho_db = Path(caminho_db)
+        self.caminho_db.parent.mkdir(parents=True, exist_ok=True)
+        # Tolera a espera pelo bloqueio quando vários trabalhadores de um lote distribuído gravam aqui.
+        self.conn = sqlite3.connect(self.caminho_db, timeout=60)
+        self.conn.executescript(_SQL_CRIAR_TABELAS)
+        # Versão registrada por último; é a usada por `gravar` quando nenhuma é informada.
+        self.versao_atual: Optional[str] = None
+
+    def registrar_versao(self, instantaneo: Dict[str, str]) -> str:
+        """Registra o instantâneo da configuração (se ainda não existir) e retorna sua versão."""
+        versao = versao_instantaneo(instantaneo)
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO versoes_config VALUES (?, ?, ?)",
+                              (versao, json.dumps(instantaneo, sort_keys=True), datetime.now().isoformat()))
+        self.versao_atual = versao
+        return versao
+
+    def instantaneo(self, versao: str) -> Dict[str, str]:
+        linha = self.conn.execute("SELECT instantaneo FROM versoes_config WHERE versao = ?", (versao,)).fetchone()
+        return json.loads(linha[0]) if linha else {}
+
+    def gravar(self, identificador: str, nome: str, destino: Optional[str], dados: Any, resultado: Any,
+               dependencias: Iterable[str], versao: Optional[str] = None):
+        """Grava (ou substitui) a extração e a classificação de um documento, sem fazer commit."""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO extracoes VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (identificador, nome, destino, _json(dados), _json(resultado), versao or self.versao_atual,
+             datetime.now().isoformat())
+        )
+        self.conn.execute("DELETE FROM dependencias WHERE identificador = ?", (identificador,))
+        self.conn.executemany("INSERT INTO dependencias VALUES (?, ?)",
+                              [(chave, identificador) for chave in set(dependencias)])
+
+    def versoes_em_uso(self) -> List[str]:
+        return [versao for (versao,) in self.conn.execute("SELECT DISTINCT versao_config FROM extracoes")]
+
+    def contar(self, versao: Optional[str] = None) -> int:
+        if versao is None:
+            return self.conn.execute("SELECT COUNT(*) FROM extracoes").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM extracoes WHERE versao_config = ?", (versao,)).fetchone()[0]
+
+    def afetadas(self, versao: str, chaves: Iterable[str]) -> Iterator[ExtracaoArmazenada]:
+        """Extrações classificadas na `versao` que leram pelo menos uma das `chaves` alteradas."""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS chaves_alteradas (chave TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM chaves_alteradas")
+        self.conn.executemany("INSERT OR IGNORE INTO chaves_alteradas VALUES (?)", [(c,) for c in chaves])
+        linhas = self.conn.execute(
+            "SELECT identificador, nome, destino, dados, resultado FROM extracoes "
+            "WHERE versao_config = ? AND identificador IN ("
+            "  SELECT d.identificador FROM dependencias d JOIN chaves_alteradas a ON a.chave = d.chave)",
+            (versao,)
+        ).fetchall()
+        for identificador, nome, destino, dados, resultado in linhas:
+            yield ExtracaoArmazenada(identificador, nome, destino, json.loads(dados), json.loads(resultado))
+
+    def migrar_versao(self, antiga: str, nova: str) -> int:
+        """Marca com a versão nova as extrações restantes da antiga (sem commit); retorna quantas."""
+        return self.conn.execute("UPDATE extracoes SET versao_config = ? WHERE versao_config = ?",
+                                 (nova, antiga)).rowcount
+
+    def salvar(self):
+        self.conn.commit()
+
+    def fechar(self):
+        self.conn.commit()
+        self.conn.close()
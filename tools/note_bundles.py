@@ -0,0 +1,275 @@
+import gzip
+import hashlib
+import sqlite3
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+_SQL_CRIAR_TABELAS = """
+CREATE TABLE IF NOT EXISTS notas (
+    chave TEXT PRIMARY KEY,
+    nome TEXT NOT NULL,
+    deslocamento INTEGER NOT NULL,
+    tamanho INTEGER NOT NULL,
+    tamanho_original INTEGER NOT NULL,
+    crc32 INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_notas_nome ON notas (nome);
+"""
+
+# Extensões do pacote (membros gzip concatenados) e do índice lateral (SQLite).
+EXTENSAO_PACOTE = '.notas.gz'
+EXTENSAO_INDICE = '.notas.idx'
+# Quantos pacotes ficam abertos ao mesmo tempo durante um lote.
+MAX_PACOTES_ABERTOS = 64
+# Nível de compressão dos membros (o padrão do gzip é 9, bem mais lento para pouco ganho).
+NIVEL_COMPRESSAO = 6
+
+
+def caminho_pacote(pasta_ramo: Path, ano_mes: str) -> Path:
+    """Pacote mensal de um ramo: 'output/<Ramo>/<AAAA-MM>.notas.gz'."""
+    return Path(pasta_ramo) / f"{ano_mes}{EXTENSAO_PACOTE}"
+
+
+def caminho_indice(pacote: Path) -> Path:
+    return Path(str(pacote)[:-len(EXTENSAO_PACOTE)] + EXTENSAO_INDICE)
+
+
+def is_destino_pacote(destino: str) -> bool:
+    """Diz se um destino gravado no diário aponta para uma nota dentro de um pacote."""
+    return str(separar_destino(destino)[0]).endswith(EXTENSAO_PACOTE)
+
+
+def chave_conteudo(conteudo: bytes) -> str:
+    """
+    Chave no pacote de uma nota sem chave de acesso (ex.: PDF sem chave legível): o hash do
+    conteúdo. O nome do arquivo não serve, pois notas diferentes podem ter o mesmo nome
+    (em pastas ou arquivos compactados diferentes) e uma substituiria a outra no índice.
+    """
+    return f"sem_chave_{hashlib.sha256(conteudo).hexdigest()}"
+
+
+def separar_destino(destino: str) -> Tuple[Path, str]:
+    """Separa um destino '<pacote>!<chave>' (como gravado no diário e no índice) em (pacote, chave)."""
+    pacote, _, chave = str(destino).rpartition('!')
+    return Path(pacote), chave
+
+
+class PacoteNotas:
+    """
+    Pacote mensal compactado de um ramo: as notas são gravadas uma após a outra como membros
+    gzip independentes (o arquivo inteiro continua sendo um .gz válido para `zcat`), e um
+    índice lateral SQLite guarda, por chave de acesso (ou `chave_conteudo`, para notas sem
+    chave), o deslocamento e o tamanho de cada membro. Ler uma nota custa uma consulta ao
+    índice e uma única leitura no pacote.
+
+    A gravação é só de acréscimo: cada nota é anexada ao fim do pacote e registrada no
+    índice dentro de uma transação `BEGIN IMMEDIATE`, que também serializa processos
+    diferentes gravando no mesmo pacote (trabalhadores de um lote distribuído). Os bytes do
+    pacote não são sincronizados a cada nota: o diário do lote faz o fsync dos pacotes que
+    receberam notas a cada checkpoint, como para os arquivos soltos. Uma nota reenviada com
+    a mesma chave e o mesmo conteúdo (lote retomado) não é gravada de novo; com outro
+    conteúdo, a nova versão é anexada e passa a ser a indicada no índice.
+
+    Como na fila de trabalho, use `wal=False` quando houver trabalhadores em outras máquinas
+    gravando no mesmo volume compartilhado.
+    """
+
+    def __init__(self, caminho: Path, wal: bool = True):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None: as transações são abertas explicitamente (BEGIN IMMEDIATE).
+        self.conn = sqlite3.connect(caminho_indice(self.caminho), timeout=60, isolation_level=None)
+        self.conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+        self.conn.execute("PRAGMA synchronous=NORMAL" if wal else "PRAGMA synchronous=FULL")
+        self.conn.executescript(_SQL_CRIAR_TABELAS)
+        self.arquivo = open(self.caminho, 'ab')
+
+    def adicionar(self, chave: str, nome: str, conteudo: bytes) -> str:
+        """Anexa a nota ao pacote (se ainda não estiver nele) e retorna o destino '<pacote>!<chave>'."""
+        crc = zlib.crc32(conteudo)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            existente = self.conn.execute(
+                "SELECT deslocamento, tamanho, tamanho_original, crc32 FROM notas WHERE chave = ?", (chave,)
+            ).fetchone()
+            if existente is None or existente[2:] != (len(conteudo), crc) or not self._membro_integro(*existente):
+                membro = gzip.compress(conteudo, compresslevel=NIVEL_COMPRESSAO, mtime=0)
+                # Com o lock de escrita do índice, nenhum outro processo anexa ao pacote agora.
+                self.arquivo.seek(0, 2)
+                deslocamento = self.arquivo.tell()
+                self.arquivo.write(membro)
+                self.arquivo.flush()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO notas VALUES (?, ?, ?, ?, ?, ?)",
+                    (chave, nome, deslocamento, len(membro), len(conteudo), crc)
+                )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return f"{self.caminho}!{chave}"
+
+    def remover(self, chave: str):
+        """Retira a nota do índice (os bytes continuam no pacote, que é só de acréscimo)."""
+        with self.conn:
+            self.conn.execute("DELETE FROM notas WHERE chave = ?", (chave,))
+
+    def _membro_integro(self, deslocamento: int, tamanho: int, tamanho_original: int, crc: int) -> bool:
+        """Confere se o membro indicado no índice chegou ao disco (ex.: após uma queda de energia)."""
+        try:
+            return zlib.crc32(_ler_membro(self.caminho, deslocamento, tamanho)) == crc
+        except (OSError, EOFError, zlib.error, gzip.BadGzipFile):
+            return False
+
+    def fechar(self):
+        self.arquivo.close()
+        self.conn.close()
+
+
+class PacotesNotas:
+    """
+    Conjunto de pacotes mensais abertos durante um lote, um por (pasta do ramo, mês).
+    Mantém no máximo `max_abertos` pacotes abertos, fechando os menos usados.
+    """
+
+    def __init__(self, max_abertos: int = MAX_PACOTES_ABERTOS, wal: bool = True):
+        self.max_abertos = max_abertos
+        self.wal = wal
+        self._abertos: "OrderedDict[Path, PacoteNotas]" = OrderedDict()
+
+    def _abrir(self, caminho: Path) -> PacoteNotas:
+        pacote = self._abertos.pop(caminho, None)
+        if pacote is None:
+            if len(self._abertos) >= self.max_abertos:
+                self._abertos.popitem(last=False)[1].fechar()
+            pacote = PacoteNotas(caminho, wal=self.wal)
+        self._abertos[caminho] = pacote
+        return pacote
+
+    def adicionar(self, pasta_ramo: Path, ano_mes: str, chave: str, nome: str, conteudo: bytes) -> str:
+        return self._abrir(caminho_pacote(pasta_ramo, ano_mes)).adicionar(chave, nome, conteudo)
+
+    def remover(self, destino: str):
+        """Retira do índice do seu pacote a nota de um destino '<pacote>!<chave>'."""
+        caminho, chave = separar_destino(destino)
+        self._abrir(caminho).remover(chave)
+
+    def fechar(self):
+        for pacote in self._abertos.values():
+            pacote.fechar()
+        self._abertos.clear()
+
+
+def _ler_membro(pacote: Path, deslocamento: int, tamanho: int) -> bytes:
+    with open(pacote, 'rb') as f:
+        f.seek(deslocamento)
+        membro = f.read(tamanho)
+    if len(membro) != tamanho:
+        raise EOFError(f"Membro truncado em {pacote} (deslocamento {deslocamento}).")
+    # O gzip confere o CRC-32 e o tamanho do conteúdo gravados no fim do membro.
+    return gzip.decompress(membro)
+
+
+def _conectar_indice(pacote: Path) -> sqlite3.Connection:
+    indice = caminho_indice(pacote)
+    if not indice.is_file():
+        raise FileNotFoundError(f"Índice do pacote não encontrado: {indice}")
+    return sqlite3.connect(f"{indice.resolve().as_uri()}?mode=ro", uri=True)
+
+
+class LeitorPacotes:
+    """
+    Leitor de notas para muitas consultas seguidas (ex.: busca no dashboard): mantém abertos
+    o índice e o arquivo de até `max_abertos` pacotes, e cada nota custa uma consulta ao
+    índice, um seek e uma leitura. Para uma leitura avulsa, use `ler_nota`/`ler_destino`.
+    """
+
+    def __init__(self, max_abertos: int = MAX_PACOTES_ABERTOS):
+        self.max_abertos = max_abertos
+        self._abertos: "OrderedDict[Path, Tuple[sqlite3.Connection, BinaryIO]]" = OrderedDict()
+
+    def _abrir(self, pacote: Path) -> Tuple[sqlite3.Connection, BinaryIO]:
+        aberto = self._abertos.pop(pacote, None)
+        if aberto is None:
+            if len(self._abertos) >= self.max_abertos:
+                self._fechar(*self._abertos.popitem(last=False)[1])
+            aberto = (_conectar_indice(pacote), open(pacote, 'rb'))
+        self._abertos[pacote] = aberto
+        return aberto
+
+    def ler(self, pacote: Path, chave: str) -> bytes:
+        conn, arquivo = self._abrir(Path(pacote))
+        linha = conn.execute("SELECT deslocamento, tamanho FROM notas WHERE chave = ?", (chave,)).fetchone()
+        if linha is None:
+            raise KeyError(chave)
+        deslocamento, tamanho = linha
+        arquivo.seek(deslocamento)
+        membro = arquivo.read(tamanho)
+        if len(membro) != tamanho:
+            raise EOFError(f"Membro truncado em {pacote} (deslocamento {deslocamento}).")
+        return gzip.decompress(membro)
+
+    def ler_destino(self, destino: str) -> bytes:
+        return self.ler(*separar_destino(destino))
+
+    @staticmethod
+    def _fechar(conn: sqlite3.Connection, arquivo: BinaryIO):
+        conn.close()
+        arquivo.close()
+
+    def fechar(self):
+        for aberto in self._abertos.values():
+            self._fechar(*aberto)
+        self._abertos.clear()
+
+
+def ler_nota(pacote: Path, chave: Optional[str] = None, nome: Optional[str] = None) -> bytes:
+    """
+    Lê uma nota de um pacote pela chave de acesso (ou pelo nome do arquivo original),
+    com uma consulta ao índice lateral e uma única leitura no pacote.
+    """
+    conn = _conectar_indice(Path(pacote))
+    try:
+        if chave is not None:
+            linha = conn.execute("SELECT deslocamento, tamanho FROM notas WHERE chave = ?", (chave,)).fetchone()
+        else:
+            linha = conn.execute("SELECT deslocamento, tamanho FROM notas WHERE nome = ? LIMIT 1", (nome,)).fetchone()
+    finally:
+        conn.close()
+    if linha is None:
+        raise KeyError(chave if chave is not None else nome)
+    return _ler_membro(Path(pacote), *linha)
+
+
+def ler_destino(destino: str) -> bytes:
+    """Lê a nota de um destino '<pacote>!<chave>' (o caminho gravado no diário e no índice de busca)."""
+    pacote, chave = separar_destino(destino)
+    return ler_nota(pacote, chave)
+
+
+def listar_notas(pacote: Path) -> List[Dict[str, object]]:
+    """Notas de um pacote na ordem em que foram gravadas (chave, nome, tamanhos)."""
+    conn = _conectar_indice(Path(pacote))
+    try:
+        linhas = conn.execute(
+            "SELECT chave, nome, tamanho, tamanho_original FROM notas ORDER BY deslocamento"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [{"chave": chave, "nome": nome, "tamanho": tamanho, "tamanho_original": original}
+            for chave, nome, tamanho, original in linhas]
+
+
+def iterar_notas(pacote: Path) -> Iterator[Tuple[str, bytes]]:
+    """Percorre todas as notas indexadas do pacote em uma leitura sequencial: gera (chave, conteúdo)."""
+    conn = _conectar_indice(Path(pacote))
+    try:
+        linhas = conn.execute("SELECT chave, deslocamento, tamanho FROM notas ORDER BY deslocamento").fetchall()
+    finally:
+        conn.close()
+    with open(pacote, 'rb') as f:
+        for chave, deslocamento, tamanho in linhas:
+            f.seek(deslocamento)
+            yield chave, gzip.decompress(f.read(tamanho))
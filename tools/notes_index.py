@@ -0,0 +1,172 @@
+import re
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+_SQL_CRIAR_TABELAS = """
+CREATE TABLE IF NOT EXISTS notas (
+    id INTEGER PRIMARY KEY,
+    chave TEXT NOT NULL UNIQUE,
+    chave_acesso TEXT,
+    numero_nf TEXT,
+    data_emissao TEXT,
+    valor_total REAL,
+    emitente_cnpj TEXT,
+    emitente_nome TEXT,
+    destinatario_cpf_cnpj TEXT,
+    destinatario_nome TEXT,
+    ramo TEXT,
+    cfop TEXT,
+    caminho TEXT,
+    origem TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_notas_chave_acesso ON notas (chave_acesso);
+CREATE INDEX IF NOT EXISTS idx_notas_emitente_cnpj ON notas (emitente_cnpj);
+CREATE INDEX IF NOT EXISTS idx_notas_destinatario ON notas (destinatario_cpf_cnpj);
+CREATE INDEX IF NOT EXISTS idx_notas_cfop ON notas (cfop);
+CREATE TABLE IF NOT EXISTS itens_cfop (
+    nota_id INTEGER NOT NULL,
+    cfop TEXT NOT NULL,
+    PRIMARY KEY (cfop, nota_id)
+) WITHOUT ROWID;
+-- O rowid de cada linha do FTS é o id da nota correspondente.
+CREATE VIRTUAL TABLE IF NOT EXISTS busca_texto USING fts5(
+    texto, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# Colunas devolvidas pelas buscas.
+COLUNAS_RESULTADO = ('chave_acesso', 'numero_nf', 'data_emissao', 'valor_total', 'emitente_cnpj',
+                     'emitente_nome', 'destinatario_cpf_cnpj', 'destinatario_nome', 'ramo', 'cfop',
+                     'caminho', 'origem')
+
+_RE_CFOP = re.compile(r'^\d\.?\d{3}$')
+
+
+def _somente_digitos(valor: Optional[str]) -> Optional[str]:
+    if not valor:
+        return valor
+    return re.sub(r'\D', '', valor) or None
+
+
+def _normalizar_cfop(valor: Optional[str]) -> Optional[str]:
+    digitos = _somente_digitos(valor)
+    if digitos and len(digitos) == 4:
+        return f"{digitos[0]}.{digitos[1:]}"
+    return valor
+
+
+class IndiceNotas:
+    """
+    Índice de busca das notas processadas em lote (SQLite + FTS5).
+
+    Campos de cabeçalho (chave de acesso, CNPJs, CFOP) ficam em colunas indexadas
+    por B-tree; nomes e descrições dos itens vão para uma tabela FTS5. Assim uma
+    consulta por chave, CNPJ, CFOP ou palavra da descrição responde em milissegundos
+    sem percorrer 'output/' nem reabrir os arquivos.
+    """
+
+    def __init__(self, caminho_db: Path):
+        self.caminho_db = Path(caminho_db)
+        self.caminho_db.parent.mkdir(parents=True, exist_ok=True)
+        # Tolera a espera pelo bloqueio quando vários trabalhadores de um lote distribuído gravam no índice.
+        self.conn = sqlite3.connect(self.caminho_db, timeout=60)
+        self.conn.executescript(_SQL_CRIAR_TABELAS)
+
+    def indexar(self, documento: Dict[str, Any], analise: Dict[str, Any], caminho: str, origem: str):
+        """
+        Adiciona (ou substitui) uma nota no índice, sem fazer commit.
+        A nota é identificada pela chave de acesso ou, na falta dela, pela origem.
+        """
+        cabecalho = documento.get('cabecalho', {})
+        itens = documento.get('itens', [])
+        chave_acesso = _somente_digitos(cabecalho.get('chave_acesso'))
+        chave = chave_acesso or origem
+
+        # Remove a versão anterior já na primeira instrução: por ser uma escrita, ela obtém o
+        # bloqueio do banco antes da inserção, e outro processo não insere a mesma chave no meio.
+        for (antigo,) in self.conn.execute("DELETE FROM notas WHERE chave = ? RETURNING id", (chave,)).fetchall():
+            self._remover_dependentes(antigo)
+
+        cursor = self.conn.execute(
+            "INSERT INTO notas (chave, chave_acesso, numero_nf, data_emissao, valor_total, emitente_cnpj, "
+            "emitente_nome, destinatario_cpf_cnpj, destinatario_nome, ramo, cfop, caminho, origem) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (chave, chave_acesso, cabecalho.get('numero_nf'), cabecalho.get('data_emissao'),
+             cabecalho.get('valor_total'), _somente_digitos(cabecalho.get('emitente_cnpj')),
+             cabecalho.get('emitente_nome'), _somente_digitos(cabecalho.get('destinatario_cpf_cnpj')),
+             cabecalho.get('destinatario_nome'), analise.get('ramo_empresa_detectado'),
+             analise.get('cfop_info', {}).get('cfop'), caminho, origem)
+        )
+        nota_id = cursor.lastrowid
+
+        cfops_itens = {_normalizar_cfop(item.get('cfop')) for item in itens if item.get('cfop')}
+        self.conn.executemany("INSERT OR IGNORE INTO itens_cfop VALUES (?, ?)",
+                              [(nota_id, cfop) for cfop in cfops_itens])
+
+        textos = [cabecalho.get('emitente_nome'), cabecalho.get('destinatario_nome')]
+        textos.extend(item.get('descricao') for item in itens)
+        self.conn.execute("INSERT INTO busca_texto (rowid, texto) VALUES (?, ?)",
+                          (nota_id, '\n'.join(t for t in textos if t)))
+
+    def _remover_dependentes(self, nota_id: int):
+        self.conn.execute("DELETE FROM itens_cfop WHERE nota_id = ?", (nota_id,))
+        self.conn.execute("DELETE FROM busca_texto WHERE rowid = ?", (nota_id,))
+
+    def salvar(self):
+        self.conn.commit()
+
+    def fechar(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def buscar_notas(caminho_db: Path, termo: str, limite: int = 100) -> List[Dict[str, Any]]:
+    """
+    Busca notas no índice. O tipo de consulta é deduzido do termo:
+    44 dígitos → chave de acesso; 11 ou 14 dígitos → CPF/CNPJ do emitente ou destinatário;
+    'X.XXX' ou 4 dígitos → CFOP (de qualquer item); demais termos → busca textual
+    (prefixo) nos nomes e nas descrições dos itens. Notas mais recentes primeiro.
+    """
+    caminho_db = Path(caminho_db)
+    termo = (termo or '').strip()
+    if not termo or not caminho_db.is_file():
+        return []
+
+    conn = sqlite3.connect(f"{caminho_db.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        conn.row_factory = sqlite3.Row
+        colunas = ', '.join(f"n.{coluna}" for coluna in COLUNAS_RESULTADO)
+        digitos = _somente_digitos(termo)
+
+        # As consultas percorrem os índices do mais recente para o mais antigo e param no limite,
+        # sem ordenar nem pontuar todas as ocorrências (um CFOP comum aparece em milhões de itens).
+        if _RE_CFOP.match(termo):
+            # O CFOP da nota é o do primeiro item, então 'itens_cfop' cobre os dois casos.
+            linhas = conn.execute(
+                f"SELECT {colunas} FROM itens_cfop i JOIN notas n ON n.id = i.nota_id "
+                f"WHERE i.cfop = ? ORDER BY i.nota_id DESC LIMIT ?", (_normalizar_cfop(termo), limite))
+        elif digitos and len(digitos) == 44 and re.fullmatch(r'[\d\s]+', termo):
+            linhas = conn.execute(f"SELECT {colunas} FROM notas n WHERE n.chave_acesso = ? LIMIT ?",
+                                  (digitos, limite))
+        elif digitos and len(digitos) in (11, 14) and re.fullmatch(r'[\d./\-\s]+', termo):
+            # Com o id nas duas consultas, o UNION vira uma intercalação dos dois índices na ordem do id
+            # (sem ordenação temporária), e uma nota emitida e recebida pelo mesmo CNPJ aparece uma vez.
+            linhas = conn.execute(
+                f"SELECT n.id, {colunas} FROM notas n WHERE n.emitente_cnpj = ? "
+                f"UNION SELECT n.id, {colunas} FROM notas n WHERE n.destinatario_cpf_cnpj = ? "
+                f"ORDER BY 1 DESC LIMIT ?", (digitos, digitos, limite))
+            return [{coluna: linha[coluna] for coluna in COLUNAS_RESULTADO} for linha in linhas]
+        else:
+            # Cada palavra vira um termo de prefixo entre aspas: operadores e pontuação do FTS5
+            # digitados na busca ficam de fora, e o MATCH nunca recebe uma consulta inválida.
+            palavras = re.findall(r'\w+', termo)
+            if not palavras:
+                return []
+            consulta = ' '.join(f'"{palavra}"*' for palavra in palavras)
+            linhas = conn.execute(
+                f"SELECT {colunas} FROM busca_texto b JOIN notas n ON n.id = b.rowid "
+                f"WHERE busca_texto MATCH ? ORDER BY b.rowid DESC LIMIT ?", (consulta, limite))
+        return [dict(linha) for linha in linhas]
+    finally:
+        conn.close()
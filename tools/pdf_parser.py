@@ -3,15 +3,49 @@ import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
 import io
-from typing import Dict, Any
+import time
+from contextlib import contextmanager
+from typing import Container, Dict, Any, List, Optional, Tuple, Union
+
+from tools.document_model import CabecalhoNota, DocumentoFiscal, ItemNota, LeituraOCR
+from tools.document_source import DocumentSource, abrir_conteudo, is_caminho
+from tools.resource_governor import GovernadorRecursos
 
 
 # Nota: A biblioteca 'pytesseract' requer que o Tesseract-OCR esteja instalado no sistema.
 # Consulte a documentação para instalar no seu SO: https://github.com/tesseract-ocr/tesseract
 
-def _run_ocr_on_page(page):
-    """Converte uma página de PDF em imagem e executa OCR."""
-    zoom = 2  # Aumenta a resolução para melhorar a precisão do OCR
+# Zoom da renderização no OCR de resolução fixa (2 = 144 DPI).
+ZOOM_OCR_PADRAO = 2
+# Zooms do OCR adaptativo, do mais rápido ao mais nítido: o seguinte só é tentado quando os
+# campos lidos no anterior não passam na validação (108, 144 e 216 DPI).
+ZOOMS_OCR_ADAPTATIVO = (1.5, 2, 3)
+# Pesos do dígito verificador (módulo 11) da chave de acesso e do CNPJ, da direita para a esquerda.
+_PESOS_CHAVE = (2, 3, 4, 5, 6, 7, 8, 9) * 6
+_PESOS_CNPJ = (2, 3, 4, 5, 6, 7, 8, 9, 2, 3, 4, 5, 6)
+
+
+class PrazoExcedido(Exception):
+    """O processamento do PDF passou do prazo (orçamento de tempo) definido pelo chamador."""
+
+
+def _tempo_restante(prazo: Optional[float]) -> Optional[float]:
+    """Segundos até o prazo (em time.monotonic()); lança PrazoExcedido se ele já passou."""
+    if prazo is None:
+        return None
+    restante = prazo - time.monotonic()
+    if restante <= 0:
+        raise PrazoExcedido()
+    return restante
+
+
+def _run_ocr_on_page(page, timeout: Optional[float] = None, zoom: float = ZOOM_OCR_PADRAO):
+    """
+    Converte uma página de PDF em imagem e executa OCR.
+    `zoom` multiplica a resolução da renderização (1 = 72 DPI); mais zoom melhora a
+    precisão do OCR, ao custo de mais tempo.
+    Com `timeout` (segundos), o processo do Tesseract é encerrado ao fim do tempo.
+    """
     mat = fitz.Matrix(zoom, zoom)
     pix = page.get_pixmap(matrix=mat)
 
@@ -19,49 +53,90 @@ def _run_ocr_on_page(page):
     image = Image.open(io.BytesIO(img_data))
 
     # Executa OCR em português
-    return pytesseract.image_to_string(image, lang='por')
+    try:
+        return pytesseract.image_to_string(image, lang='por', timeout=timeout or 0)
+    except RuntimeError as e:
+        # O pytesseract sinaliza o timeout com RuntimeError('Tesseract process timeout').
+        if 'timeout' in str(e).lower():
+            raise PrazoExcedido() from e
+        raise
 
 
-def parse_pdf_to_structured_data(file_path: str) -> Dict[str, Any]:
-    """
-    Extrai texto de um PDF, usando OCR como fallback, e o parseia
-    em uma estrutura de dados similar à extração de XML.
-    """
-    full_text = ""
-    try:
-        doc = fitz.open(file_path)
+def _digito_modulo_11(digitos: str, pesos: Tuple[int, ...]) -> int:
+    """Dígito verificador módulo 11 (restos 0 e 1 valem 0), com os pesos aplicados da direita."""
+    soma = sum(int(digito) * peso for digito, peso in zip(reversed(digitos), pesos))
+    resto = soma % 11
+    return 0 if resto < 2 else 11 - resto
 
-        # 1. Tenta extrair texto diretamente
-        for page in doc:
-            full_text += page.get_text("text")
 
-        # 2. Se o texto for muito curto (sinal de PDF escaneado), usa OCR
-        if len(full_text.strip()) < 100:
-            print("⚠️ PDF com pouco texto, tentando OCR...")
-            full_text = ""
-            for page in doc:
-                full_text += _run_ocr_on_page(page)
+def chave_acesso_valida(chave: Optional[str]) -> bool:
+    """True se a chave de acesso tem 44 dígitos e o último confere com o módulo 11 dos demais."""
+    if not chave or len(chave) != 44 or not chave.isdigit():
+        return False
+    return _digito_modulo_11(chave[:43], _PESOS_CHAVE) == int(chave[43])
 
-    except Exception as e:
-        return {"erro": f"Falha ao ler o arquivo PDF: {str(e)}"}
 
-    if not full_text:
-        return {"erro": "Não foi possível extrair nenhum texto do PDF."}
+def cnpj_valido(cnpj: Optional[str]) -> bool:
+    """True se o CNPJ (com ou sem pontuação) tem 14 dígitos e os dois verificadores conferem."""
+    digitos = re.sub(r'\D', '', cnpj or '')
+    if len(digitos) != 14 or len(set(digitos)) == 1:
+        return False
+    return (_digito_modulo_11(digitos[:12], _PESOS_CNPJ) == int(digitos[12])
+            and _digito_modulo_11(digitos[:13], _PESOS_CNPJ) == int(digitos[13]))
 
-    # 3. Usa Regex para encontrar os campos-chave no texto extraído
-    # Expressões regulares aprimoradas para encontrar os dados
-    patterns = {
-        'chave_acesso': r'\b(\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4})\b',
-        'numero_nf': r'(?:NFC-e|NF-e|NOTA FISCAL)\s*n°\s*(\d+)',
-        'valor_total': r'(?:VALOR TOTAL|Valor a pagar)\s*R\$\s*([\d\.,]+)',
-        'emitente_nome': r'CNPJ:\s*\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}\s*([A-Z\s\d&/]+)',
-        'emitente_cnpj': r'CNPJ:\s*(\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2})',
-        'cfop': r'\b(\d{4})\b'  # Encontra o primeiro código de 4 dígitos que pode ser um CFOP
-    }
 
+def _cfop_normalizado(cfop: str) -> str:
+    return f"{cfop[0]}.{cfop[1:]}"
+
+
+@contextmanager
+def _open_pdf(source: DocumentSource):
+    """
+    Abre o PDF a partir de um caminho, do conteúdo em memória ou de um objeto de arquivo,
+    e o fecha na saída do `with`.
+    Caminhos são lidos pelo próprio MuPDF. As demais fontes são abertas com
+    `fitz.open(stream=...)` sobre bytes ou uma visão do buffer (o MuPDF lê direto da
+    memória, sem cópia); objetos de arquivo grandes são mapeados em memória.
+    """
+    if is_caminho(source):
+        doc = fitz.open(source)
+        try:
+            yield doc
+        finally:
+            doc.close()
+        return
+    with abrir_conteudo(source) as conteudo:
+        doc = fitz.open(stream=conteudo, filetype="pdf")
+        try:
+            yield doc
+        finally:
+            # O documento lê do buffer até ser fechado; só então a visão pode ser liberada.
+            doc.close()
+
+
+# Expressões regulares aprimoradas para encontrar os campos-chave no texto extraído
+_PADROES_CAMPOS = {
+    'chave_acesso': r'\b(\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4}\s?\d{4})\b',
+    'numero_nf': r'(?:NFC-e|NF-e|NOTA FISCAL)\s*n°\s*(\d+)',
+    'valor_total': r'(?:VALOR TOTAL|Valor a pagar)\s*R\$\s*([\d\.,]+)',
+    'emitente_nome': r'CNPJ:\s*\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}\s*([A-Z\s\d&/]+)',
+    'emitente_cnpj': r'CNPJ:\s*(\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2})',
+    'cfop': r'\b(\d{4})\b'  # Encontra o primeiro código de 4 dígitos que pode ser um CFOP
+}
+
+
+def _extrair_campos(texto: str, cfops_validos: Optional[Container[str]] = None) -> Dict[str, Any]:
+    """
+    Aplica as expressões regulares ao texto extraído. Com `cfops_validos` (códigos no formato
+    'X.XXX'), o CFOP é o primeiro código de 4 dígitos que existe na tabela, e não apenas o
+    primeiro código de 4 dígitos do texto.
+    """
     parsed_data = {}
-    for key, pattern in patterns.items():
-        match = re.search(pattern, full_text, re.IGNORECASE)
+    for key, pattern in _PADROES_CAMPOS.items():
+        match = re.search(pattern, texto, re.IGNORECASE)
+        if match and key == 'cfop' and cfops_validos is not None:
+            match = next((candidato for candidato in re.finditer(pattern, texto)
+                          if _cfop_normalizado(candidato.group(1)) in cfops_validos), match)
         if match:
             # Limpa e formata o resultado
             value = match.group(1).strip().replace('\n', ' ')
@@ -73,26 +148,158 @@ def parse_pdf_to_structured_data(file_path: str) -> Dict[str, Any]:
                 parsed_data[key] = value
         else:
             parsed_data[key] = None
+    return parsed_data
+
+
+def _campos_invalidos(campos: Dict[str, Any], cfops_validos: Optional[Container[str]] = None) -> List[str]:
+    """
+    Campos lidos que não passam na validação: chave de acesso (módulo 11), CNPJ do emitente
+    (dígitos verificadores) e CFOP (existente na tabela carregada, quando informada).
+    Um campo não encontrado não conta: muitos documentos (um cupom sem chave, uma página sem
+    CFOP) simplesmente não o têm, e uma resolução maior não faria o campo aparecer.
+    """
+    invalidos = []
+    chave = campos.get('chave_acesso')
+    if chave and not chave_acesso_valida(chave):
+        invalidos.append('chave_acesso')
+    cnpj = campos.get('emitente_cnpj')
+    if cnpj and not cnpj_valido(cnpj):
+        invalidos.append('emitente_cnpj')
+    cfop = campos.get('cfop')
+    if cfop and cfops_validos is not None and _cfop_normalizado(cfop) not in cfops_validos:
+        invalidos.append('cfop')
+    return invalidos
+
+
+@contextmanager
+def _vaga_pagina(governador: Optional[GovernadorRecursos], prazo: Optional[float]):
+    """Espera o governador liberar a renderização de mais uma página (sem passar do prazo)."""
+    if governador is None:
+        yield
+        return
+    if not governador.reservar_pagina(_tempo_restante(prazo)):
+        raise PrazoExcedido()
+    try:
+        yield
+    finally:
+        governador.liberar_pagina()
+
+
+def _ocr_documento(doc, zoom: float, prazo: Optional[float],
+                   governador: Optional[GovernadorRecursos] = None) -> str:
+    textos = []
+    for page in doc:
+        with _vaga_pagina(governador, prazo):
+            textos.append(_run_ocr_on_page(page, timeout=_tempo_restante(prazo), zoom=zoom))
+    return "".join(textos)
+
+
+def _ocr_adaptativo(doc, prazo: Optional[float], cfops_validos: Optional[Container[str]],
+                    zooms: Tuple[float, ...], governador: Optional[GovernadorRecursos] = None
+                    ) -> Tuple[str, LeituraOCR]:
+    """
+    Faz o OCR no primeiro zoom de `zooms` e só renderiza de novo, no zoom seguinte, enquanto
+    algum campo lido não passar na validação e o zoom anterior tiver reduzido os campos
+    inválidos (um campo que continua errado numa resolução maior em geral está errado no
+    próprio documento). Fica com a leitura que teve menos campos inválidos (no empate, a de
+    maior resolução). Se o prazo estourar depois da primeira leitura, a melhor leitura obtida
+    até ali é usada em vez de descartar o documento.
+    """
+    melhor = None
+    tentativas = 0
+    for zoom in zooms:
+        try:
+            texto = _ocr_documento(doc, zoom, prazo, governador)
+        except PrazoExcedido:
+            if melhor is None:
+                raise
+            break
+        tentativas += 1
+        invalidos = _campos_invalidos(_extrair_campos(texto, cfops_validos), cfops_validos)
+        sem_melhora = melhor is not None and len(invalidos) >= len(melhor[2])
+        if melhor is None or len(invalidos) <= len(melhor[2]):
+            melhor = (texto, zoom, invalidos)
+        if not invalidos or sem_melhora:
+            break
+    texto, zoom, invalidos = melhor
+    return texto, LeituraOCR(zoom, tentativas=tentativas, campos_invalidos=invalidos)
+
+
+def parse_pdf_to_structured_data(source: DocumentSource, permitir_ocr: bool = True,
+                                 prazo: Optional[float] = None, ocr_adaptativo: bool = True,
+                                 cfops_validos: Optional[Container[str]] = None,
+                                 governador: Optional[GovernadorRecursos] = None
+                                 ) -> Union[DocumentoFiscal, Dict[str, Any]]:
+    """
+    Extrai texto de um PDF, usando OCR como fallback, e o parseia
+    em uma estrutura de dados similar à extração de XML.
+    Aceita o caminho do arquivo, o conteúdo em memória (bytes, bytearray, memoryview ou
+    mmap) ou um objeto de arquivo binário.
+
+    Com `permitir_ocr=False`, um PDF sem camada de texto não passa pelo OCR: o retorno é
+    {"erro": ..., "requer_ocr": True}, para que o chamador o envie a uma fila de OCR.
+    `prazo` (instante em time.monotonic()) é verificado a cada página e limita o Tesseract;
+    ao estourá-lo, o retorno é {"erro": ..., "prazo_excedido": True}.
+
+    Com `ocr_adaptativo`, o OCR começa em baixa resolução e só sobe de zoom
+    (`ZOOMS_OCR_ADAPTATIVO`) quando a chave de acesso, o CNPJ do emitente ou o CFOP lidos
+    não são válidos (um campo ausente não provoca nova leitura); `cfops_validos` é a tabela
+    de CFOPs carregada (códigos 'X.XXX') usada nessa validação (sem ela, o CFOP não é
+    validado). Sem `ocr_adaptativo`, o OCR usa sempre `ZOOM_OCR_PADRAO`. A resolução usada
+    fica em `DocumentoFiscal.ocr`.
+
+    Com um `governador`, cada página só é renderizada quando ele libera uma vaga (limite de
+    páginas em memória e de RSS do processo).
+    """
+    full_text = ""
+    leitura_ocr = None
+    try:
+        with _open_pdf(source) as doc:
+            # 1. Tenta extrair texto diretamente
+            for page in doc:
+                _tempo_restante(prazo)
+                full_text += page.get_text("text")
+
+            # 2. Se o texto for muito curto (sinal de PDF escaneado), usa OCR
+            if len(full_text.strip()) < 100:
+                if not permitir_ocr:
+                    return {"erro": "PDF sem camada de texto; requer OCR.", "requer_ocr": True}
+                print("⚠️ PDF com pouco texto, tentando OCR...")
+                zooms = ZOOMS_OCR_ADAPTATIVO if ocr_adaptativo else (ZOOM_OCR_PADRAO,)
+                full_text, leitura_ocr = _ocr_adaptativo(doc, prazo, cfops_validos, zooms, governador)
+                print(f"🔎 OCR em {leitura_ocr.dpi} DPI (zoom {leitura_ocr.zoom}, "
+                      f"{leitura_ocr.tentativas} renderização(ões)).")
+
+    except PrazoExcedido:
+        return {"erro": "Tempo limite de processamento do PDF excedido.", "prazo_excedido": True}
+    except Exception as e:
+        return {"erro": f"Falha ao ler o arquivo PDF: {str(e)}"}
+
+    if not full_text:
+        return {"erro": "Não foi possível extrair nenhum texto do PDF."}
+
+    # 3. Usa Regex para encontrar os campos-chave no texto extraído
+    parsed_data = _extrair_campos(full_text, cfops_validos if leitura_ocr is not None else None)
 
     # Monta a estrutura final para ser compatível com o resto do sistema
     # Esta é uma simplificação; um parser mais complexo poderia extrair todos os itens.
-    cabecalho = {
-        'chave_acesso': parsed_data.get('chave_acesso', 'N/A'),
-        'numero_nf': parsed_data.get('numero_nf', 'N/A'),
-        'data_emissao': 'N/A (Extrair de PDF é complexo)',
-        'valor_total': parsed_data.get('valor_total', 0.0),
-        'emitente_nome': parsed_data.get('emitente_nome', 'N/A'),
-        'emitente_cnpj': parsed_data.get('emitente_cnpj', 'N/A'),
-        'emitente_cnae': None,  # CNAE raramente está visível no DANFE PDF
-    }
-
-    itens = [{
-        'descricao': 'Item extraído de PDF (descrição genérica)',
-        'cfop': parsed_data.get('cfop', None),
-        'valor_produto': parsed_data.get('valor_total', 0.0)  # Simplificação
-    }]
+    cabecalho = CabecalhoNota(
+        chave_acesso=parsed_data.get('chave_acesso', 'N/A'),
+        numero_nf=parsed_data.get('numero_nf', 'N/A'),
+        data_emissao='N/A (Extrair de PDF é complexo)',
+        valor_total=parsed_data.get('valor_total', 0.0),
+        emitente_nome=parsed_data.get('emitente_nome', 'N/A'),
+        emitente_cnpj=parsed_data.get('emitente_cnpj', 'N/A'),
+        emitente_cnae=None,  # CNAE raramente está visível no DANFE PDF
+    )
+
+    itens = [ItemNota(
+        descricao='Item extraído de PDF (descrição genérica)',
+        cfop=parsed_data.get('cfop', None),
+        valor_produto=parsed_data.get('valor_total', 0.0)  # Simplificação
+    )]
 
     if not itens[0]['cfop']:
         return {"erro": "Não foi possível extrair o CFOP do PDF."}
 
-    return {"cabecalho": cabecalho, "itens": itens}
+    return DocumentoFiscal(cabecalho, itens, ocr=leitura_ocr)
@@ -0,0 +1,250 @@
+import gc
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Documentos lidos e ainda não concluídos (na fila das faixas ou em processamento).
+MAX_DOCUMENTOS_PADRAO = 64
+# Páginas de PDF renderizadas ao mesmo tempo para o OCR (cada uma é uma imagem inteira em memória).
+MAX_PAGINAS_PADRAO = 4
+# Fração da memória disponível (RAM ou limite do cgroup) usada como teto de RSS padrão.
+FRACAO_MEMORIA_PADRAO = 0.8
+# Intervalo (s) entre novas medições do RSS enquanto uma página espera a memória baixar.
+INTERVALO_ESPERA = 0.2
+# Idade máxima (s) de uma medição do RSS antes de lê-lo de novo (evita ler /proc a cada documento).
+INTERVALO_MEDICAO = 0.05
+# Memória (MB) reservada para cada documento em execução até que o custo real seja medido.
+CUSTO_INICIAL_DOCUMENTO_MB = 64.0
+
+MOTIVO_DOCUMENTOS = 'documentos'
+MOTIVO_PAGINAS = 'paginas'
+MOTIVO_MEMORIA = 'memoria'
+
+_TAMANHO_PAGINA = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_atual_mb() -> Optional[float]:
+    """Memória residente (RSS) atual do processo, em MB; None se o sistema não a expõe (só Linux)."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _TAMANHO_PAGINA / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def pico_rss_processo_mb() -> Optional[float]:
+    """Maior RSS do processo desde que ele começou (getrusage), em MB; None onde não existe."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # O Linux informa em KB; o macOS, em bytes.
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+
+def memoria_disponivel_mb() -> Optional[float]:
+    """Memória que o processo pode usar: a RAM física ou, se menor, o limite do cgroup (contêineres)."""
+    limites = []
+    try:
+        limites.append(os.sysconf('SC_PHYS_PAGES') * _TAMANHO_PAGINA / (1024 * 1024))
+    except (AttributeError, ValueError, OSError):
+        pass
+    for caminho in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(caminho) as f:
+                valor = f.read().strip()
+        except OSError:
+            continue
+        # 'max' (cgroup v2) ou um valor enorme (v1) significam sem limite.
+        if valor.isdigit() and int(valor) < 1 << 60:
+            limites.append(int(valor) / (1024 * 1024))
+    return min(limites) if limites else None
+
+
+def limite_rss_padrao_mb() -> Optional[float]:
+    """Teto de RSS padrão (FRACAO_MEMORIA_PADRAO da memória disponível), se for possível medir o RSS."""
+    disponivel = memoria_disponivel_mb()
+    if disponivel is None or rss_atual_mb() is None:
+        return None
+    return disponivel * FRACAO_MEMORIA_PADRAO
+
+
+class GovernadorRecursos:
+    """
+    Limita o trabalho em andamento de um lote: documentos lidos e não concluídos, páginas de
+    PDF renderizadas ao mesmo tempo e a memória residente (RSS) do processo.
+
+    Ao atingir um limite, aplica contrapressão em vez de falhar: o escalonador para de ler
+    novas entradas (`admitir` devolve False), um documento lido só começa a ser processado
+    quando cabe na memória (`iniciar_documento`) e o OCR espera uma vaga antes de renderizar a
+    próxima página (`reservar_pagina`). Para nunca travar, um documento sempre é admitido e
+    iniciado quando não há nenhum outro, e uma página sempre pode ser renderizada quando
+    nenhuma outra está em memória, mesmo com o RSS acima do teto.
+
+    Como a memória de um documento só aparece no RSS depois que ele começa, cada documento em
+    execução reserva o custo estimado de um documento (a média medida de RSS acima do início
+    do lote por documento em execução); assim várias threads livres não começam juntas
+    documentos que, somados, passariam do teto.
+
+    Registra os picos (RSS, documentos e páginas) e cada contenção: quantas vezes e por
+    quanto tempo cada limite segurou o lote (ver `relatorio`).
+    `max_rss_mb=None` usa `limite_rss_padrao_mb()`; 0 desliga o limite de memória.
+    """
+
+    def __init__(self, max_documentos: int = MAX_DOCUMENTOS_PADRAO, max_paginas: int = MAX_PAGINAS_PADRAO,
+                 max_rss_mb: Optional[float] = None):
+        self.max_documentos = max(1, max_documentos)
+        self.max_paginas = max(1, max_paginas)
+        self.max_rss_mb = limite_rss_padrao_mb() if max_rss_mb is None else (max_rss_mb or None)
+
+        self._condicao = threading.Condition()
+        self._paginas = 0
+        self._em_execucao = 0
+        self._rss_base_mb = rss_atual_mb() or 0.0
+        self._custo_documento_mb = CUSTO_INICIAL_DOCUMENTO_MB
+        self._pico_documentos = 0
+        self._pico_paginas = 0
+        self._pico_rss_mb = rss_atual_mb() or 0.0
+        self._ultimo_rss: Optional[float] = None
+        self._medido_em = 0.0
+        self._eventos = {motivo: 0 for motivo in (MOTIVO_DOCUMENTOS, MOTIVO_PAGINAS, MOTIVO_MEMORIA)}
+        self._tempo_contido = dict.fromkeys(self._eventos, 0.0)
+        # Motivo e início da contenção de entrada em curso (documentos ou memória).
+        self._contencao_entrada: Optional[str] = None
+        self._inicio_contencao = 0.0
+
+    def _medir_rss(self) -> Optional[float]:
+        agora = time.monotonic()
+        if agora - self._medido_em < INTERVALO_MEDICAO:
+            return self._ultimo_rss
+        rss = self._ultimo_rss = rss_atual_mb()
+        self._medido_em = agora
+        if rss is not None and rss > self._pico_rss_mb:
+            self._pico_rss_mb = rss
+        if rss is not None and self._em_execucao:
+            # Custo por documento: a média móvel, mas nunca abaixo da medição atual.
+            amostra = max(0.0, rss - self._rss_base_mb) / self._em_execucao
+            self._custo_documento_mb = max(amostra, 0.9 * self._custo_documento_mb + 0.1 * amostra)
+        return rss
+
+    def _acima_da_memoria(self) -> bool:
+        rss = self._medir_rss()
+        return self.max_rss_mb is not None and rss is not None and rss >= self.max_rss_mb
+
+    def admitir(self, em_andamento: int) -> bool:
+        """
+        True se o escalonador pode ler mais uma entrada, com `em_andamento` documentos ainda
+        não concluídos. Chamado só pela thread que alimenta o lote.
+        """
+        self._pico_documentos = max(self._pico_documentos, em_andamento)
+        if em_andamento == 0:
+            motivo = None
+        elif em_andamento >= self.max_documentos:
+            motivo = MOTIVO_DOCUMENTOS
+        elif self._acima_da_memoria():
+            motivo = MOTIVO_MEMORIA
+        else:
+            motivo = None
+
+        with self._condicao:
+            if motivo != self._contencao_entrada:
+                agora = time.monotonic()
+                if self._contencao_entrada is not None:
+                    self._tempo_contido[self._contencao_entrada] += agora - self._inicio_contencao
+                if motivo is not None:
+                    self._eventos[motivo] += 1
+                    self._inicio_contencao = agora
+                    if motivo == MOTIVO_MEMORIA:
+                        # Devolve ao alocador os ciclos de objetos já descartados antes de esperar.
+                        gc.collect()
+                self._contencao_entrada = motivo
+        return motivo is None
+
+    def iniciar_documento(self):
+        """
+        Espera até que mais um documento caiba no teto de memória, contando a reserva dos que
+        já estão em execução, e o registra como em execução. Depois, chame `concluir_documento`.
+        """
+        with self._condicao:
+            inicio = None
+            while self._em_execucao and self.max_rss_mb is not None:
+                rss = self._medir_rss()
+                if rss is None:
+                    break
+                reservado = self._rss_base_mb + self._em_execucao * self._custo_documento_mb
+                if max(rss, reservado) + self._custo_documento_mb <= self.max_rss_mb:
+                    break
+                if inicio is None:
+                    inicio = time.monotonic()
+                    self._eventos[MOTIVO_MEMORIA] += 1
+                self._condicao.wait(INTERVALO_ESPERA)
+            if inicio is not None:
+                self._tempo_contido[MOTIVO_MEMORIA] += time.monotonic() - inicio
+            self._em_execucao += 1
+
+    def concluir_documento(self):
+        with self._condicao:
+            self._em_execucao -= 1
+            self._condicao.notify_all()
+
+    def reservar_pagina(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera uma vaga para renderizar uma página (no máximo `timeout` segundos, se informado).
+        Retorna False se o tempo acabou; depois de True, chame `liberar_pagina`.
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._condicao:
+            motivo = None
+            inicio = time.monotonic()
+            try:
+                while True:
+                    if self._paginas >= self.max_paginas:
+                        atual = MOTIVO_PAGINAS
+                    elif self._paginas > 0 and self._acima_da_memoria():
+                        atual = MOTIVO_MEMORIA
+                    else:
+                        break
+                    if motivo is None:
+                        motivo = atual
+                        self._eventos[motivo] += 1
+                    espera = INTERVALO_ESPERA
+                    if limite is not None:
+                        espera = min(espera, limite - time.monotonic())
+                        if espera <= 0:
+                            return False
+                    # Acorda quando uma página é liberada ou, com a memória alta, para medir de novo.
+                    self._condicao.wait(espera)
+            finally:
+                if motivo is not None:
+                    self._tempo_contido[motivo] += time.monotonic() - inicio
+            self._paginas += 1
+            self._pico_paginas = max(self._pico_paginas, self._paginas)
+        return True
+
+    def liberar_pagina(self):
+        with self._condicao:
+            self._paginas -= 1
+            self._condicao.notify_all()
+
+    def relatorio(self) -> Dict[str, Any]:
+        """Limites usados, picos observados e contenções (quantidade e segundos) por limite."""
+        with self._condicao:
+            self._medir_rss()
+            pico_processo = pico_rss_processo_mb()
+            tempo_contido = dict(self._tempo_contido)
+            if self._contencao_entrada is not None:
+                tempo_contido[self._contencao_entrada] += time.monotonic() - self._inicio_contencao
+            return {
+                "limites": {"documentos": self.max_documentos, "paginas": self.max_paginas,
+                            "rss_mb": round(self.max_rss_mb, 1) if self.max_rss_mb else None},
+                "pico_rss_mb": round(self._pico_rss_mb, 1),
+                "pico_rss_processo_mb": round(pico_processo, 1) if pico_processo is not None else None,
+                "custo_documento_mb": round(self._custo_documento_mb, 1),
+                "pico_documentos": self._pico_documentos,
+                "pico_paginas": self._pico_paginas,
+                "contencoes": dict(self._eventos),
+                "segundos_contidos": {motivo: round(segundos, 2) for motivo, segundos in tempo_contido.items()},
+            }
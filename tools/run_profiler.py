@@ -0,0 +1,252 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import thread as _thread_futures
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+# Intervalo (s) entre duas amostras das pilhas de todas as threads (para o flamegraph).
+INTERVALO_AMOSTRAGEM = 0.005
+# Intervalo (s) entre as verificações da memória rastreada à procura de um novo pico.
+INTERVALO_MEMORIA = 1.0
+# Um novo snapshot das alocações só é tirado quando a memória rastreada cresce esta fração além do último.
+CRESCIMENTO_SNAPSHOT = 0.25
+# Quadros guardados por alocação pelo tracemalloc (mais quadros = mais custo).
+QUADROS_ALOCACAO = 1
+# Linhas dos resumos gravados: funções do cProfile e locais de alocação.
+TOP_FUNCOES = 40
+TOP_ALOCACOES = 25
+
+# Último quadro de uma thread parada esperando (pools ociosos, a thread principal esperando
+# resultados): essas amostras não mostram trabalho e são descartadas do flamegraph.
+_QUADROS_OCIOSOS = {(threading.__file__, 'wait'), (_thread_futures.__file__, '_worker')}
+# As alocações do próprio perfil (cProfile, pstats, esta captura) não entram no relatório.
+_FILTROS_ALOCACAO = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, pstats.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+# O tracemalloc é global ao processo: capturas simultâneas (ex.: uploads em paralelo no
+# dashboard) o compartilham, e só a última a terminar o desliga.
+_trava_tracemalloc = threading.Lock()
+_usuarios_tracemalloc = 0
+
+
+def _iniciar_tracemalloc() -> bool:
+    global _usuarios_tracemalloc
+    with _trava_tracemalloc:
+        if _usuarios_tracemalloc == 0:
+            if tracemalloc.is_tracing():
+                # Já ligado por outra ferramenta (ex.: python -X tracemalloc): usa, mas não desliga.
+                return False
+            tracemalloc.start(QUADROS_ALOCACAO)
+        _usuarios_tracemalloc += 1
+        return True
+
+
+def _parar_tracemalloc():
+    global _usuarios_tracemalloc
+    with _trava_tracemalloc:
+        _usuarios_tracemalloc -= 1
+        if _usuarios_tracemalloc == 0:
+            tracemalloc.stop()
+
+
+def _rotulo(codigo) -> str:
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})"
+
+
+def _nome_thread(nome: str) -> str:
+    # As threads de um mesmo pool ('lote-xml_0', 'lote-xml_1'...) formam uma única raiz.
+    return re.sub(r'_\d+$', '', nome)
+
+
+class CapturaPerfil:
+    """
+    Captura sob demanda o perfil de uma execução (um lote ou um documento), como gerenciador de contexto:
+
+        with CapturaPerfil(pasta, 'lote_<run_id>', memoria=True) as captura:
+            ...
+        captura.arquivos  # {'cprofile': ..., 'resumo': ..., 'pilhas': ..., 'alocacoes': ...}
+
+    Grava em `pasta`, com o prefixo 'perfil_<nome>':
+    - '.prof': as estatísticas do cProfile (para pstats, snakeviz ou gprof2dot);
+    - '.txt': as funções com maior tempo acumulado e próprio;
+    - '.folded': as pilhas amostradas de todas as threads no formato "colapsado"
+      ('thread;f1;f2;...;fn amostras'), pronto para flamegraph.pl ou speedscope;
+    - '.alocacoes.txt' (com `memoria`): os locais com mais memória alocada pelo tracemalloc
+      no maior pico observado e ao final.
+
+    O cProfile só vê a thread em que foi ligado; o trabalho feito em outras threads (as faixas
+    do escalonador) entra no perfil quando é envolvido por `na_thread`. As pilhas do '.folded'
+    são amostradas de todas as threads por uma thread à parte; as amostras de threads
+    paradas esperando são descartadas, e as threads de um mesmo pool (ex.: uma faixa do
+    escalonador) são somadas sob o nome do pool.
+
+    Nada disso existe quando o perfil não é pedido: quem chama só cria a captura quando o
+    interruptor está ligado (ver `OrchestratorAgent.processar_lote_notas`).
+    """
+
+    def __init__(self, pasta: Union[str, Path], nome: str, memoria: bool = False):
+        self.pasta = Path(pasta)
+        self.nome = nome
+        self.memoria = memoria
+        self.arquivos: Dict[str, str] = {}
+
+        self._perfil: Optional[cProfile.Profile] = None
+        self._perfis_threads: List[cProfile.Profile] = []
+        self._local = threading.local()
+        self._trava = threading.Lock()
+        self._thread_principal: Optional[int] = None
+        self._pilhas: Counter = Counter()
+        self._parar = threading.Event()
+        self._amostrador: Optional[threading.Thread] = None
+        self._tracemalloc_proprio = False
+        self._snapshot_pico: Optional[tracemalloc.Snapshot] = None
+        self._memoria_pico = 0
+
+    def __enter__(self) -> 'CapturaPerfil':
+        self._thread_principal = threading.get_ident()
+        if self.memoria:
+            self._tracemalloc_proprio = _iniciar_tracemalloc()
+        self._amostrador = threading.Thread(target=self._amostrar, name='perfil-amostragem', daemon=True)
+        self._amostrador.start()
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+            self._perfil = perfil
+        except ValueError:
+            # Outro perfilador já está ativo (Python 3.12+ permite um só); ficam as pilhas amostradas.
+            print('⚠️ Já há um perfilador ativo no processo; o perfil terá apenas as pilhas amostradas.')
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._perfil is not None:
+            self._perfil.disable()
+        self._parar.set()
+        self._amostrador.join()
+        try:
+            self._gravar()
+        finally:
+            if self.memoria and self._tracemalloc_proprio:
+                _parar_tracemalloc()
+        return False
+
+    @contextmanager
+    def na_thread(self):
+        """Inclui no cProfile o trabalho feito no bloco, quando ele roda em outra thread."""
+        perfil = getattr(self._local, 'perfil', None)
+        if threading.get_ident() == self._thread_principal or perfil is False:
+            yield
+            return
+        if perfil is None:
+            perfil = cProfile.Profile()
+            try:
+                perfil.enable()
+            except ValueError:
+                # Python 3.12+: o perfilador da captura já vê todas as threads.
+                self._local.perfil = False
+                yield
+                return
+            perfil.disable()
+            self._local.perfil = perfil
+            with self._trava:
+                self._perfis_threads.append(perfil)
+        perfil.enable()
+        try:
+            yield
+        finally:
+            perfil.disable()
+
+    def _amostrar(self):
+        proprio = threading.get_ident()
+        proxima_memoria = 0.0
+        while not self._parar.wait(INTERVALO_AMOSTRAGEM):
+            nomes = {thread.ident: _nome_thread(thread.name) for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == proprio or (frame.f_code.co_filename, frame.f_code.co_name) in _QUADROS_OCIOSOS:
+                    continue
+                # Guarda só os objetos de código; os rótulos são montados uma vez, na gravação.
+                pilha = []
+                while frame is not None:
+                    pilha.append(frame.f_code)
+                    frame = frame.f_back
+                self._pilhas[nomes.get(ident, f'thread-{ident}'), tuple(reversed(pilha))] += 1
+
+            if self.memoria and time.monotonic() >= proxima_memoria:
+                proxima_memoria = time.monotonic() + INTERVALO_MEMORIA
+                self._verificar_pico_memoria()
+
+    def _verificar_pico_memoria(self):
+        if not tracemalloc.is_tracing():
+            return
+        atual, _ = tracemalloc.get_traced_memory()
+        if atual > self._memoria_pico * (1 + CRESCIMENTO_SNAPSHOT):
+            # Filtrado só na gravação: filtrar aqui, durante a execução, custa bem mais que o snapshot.
+            self._snapshot_pico = tracemalloc.take_snapshot()
+            self._memoria_pico = atual
+
+    def _gravar(self):
+        self.pasta.mkdir(parents=True, exist_ok=True)
+        prefixo = self.pasta / f"perfil_{self.nome}"
+
+        # As alocações primeiro: montar as estatísticas do cProfile também aloca memória.
+        if self.memoria and tracemalloc.is_tracing():
+            self._verificar_pico_memoria()
+            final = tracemalloc.take_snapshot()
+            _, pico = tracemalloc.get_traced_memory()
+            linhas = [f"Pico de memória rastreada: {pico / (1024 * 1024):.1f} MB", ""]
+            secoes = [(f"No maior pico observado ({self._memoria_pico / (1024 * 1024):.1f} MB)", self._snapshot_pico),
+                      ("Ao final da execução", final)]
+            for titulo, snapshot in secoes:
+                if snapshot is None:
+                    continue
+                linhas.append(f"== {titulo}: {TOP_ALOCACOES} locais com mais memória alocada ==")
+                for estatistica in snapshot.filter_traces(_FILTROS_ALOCACAO).statistics('lineno')[:TOP_ALOCACOES]:
+                    linhas.append(f"{estatistica.size / 1024:10.1f} KB {estatistica.count:8d} blocos  "
+                                  f"{estatistica.traceback[0]}")
+                linhas.append("")
+            Path(f"{prefixo}.alocacoes.txt").write_text("\n".join(linhas), encoding='utf-8')
+            self.arquivos['alocacoes'] = f"{prefixo}.alocacoes.txt"
+
+        perfis = ([self._perfil] if self._perfil is not None else []) + self._perfis_threads
+        if perfis:
+            estatisticas = pstats.Stats(perfis[0])
+            for perfil in perfis[1:]:
+                estatisticas.add(perfil)
+            estatisticas.dump_stats(f"{prefixo}.prof")
+            self.arquivos['cprofile'] = f"{prefixo}.prof"
+
+            resumo = io.StringIO()
+            estatisticas.stream = resumo
+            estatisticas.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCOES)
+            estatisticas.sort_stats(pstats.SortKey.TIME).print_stats(TOP_FUNCOES)
+            Path(f"{prefixo}.txt").write_text(resumo.getvalue(), encoding='utf-8')
+            self.arquivos['resumo'] = f"{prefixo}.txt"
+
+        with open(f"{prefixo}.folded", 'w', encoding='utf-8') as f:
+            rotulos = {}
+            linhas = Counter()
+            for (thread, pilha), amostras in self._pilhas.items():
+                for codigo in pilha:
+                    if codigo not in rotulos:
+                        rotulos[codigo] = _rotulo(codigo)
+                linhas[';'.join([thread, *(rotulos[codigo] for codigo in pilha)])] += amostras
+            for linha, amostras in sorted(linhas.items()):
+                f.write(f"{linha} {amostras}\n")
+        self.arquivos['pilhas'] = f"{prefixo}.folded"
+
+        print(f"🔬 Perfil salvo em {prefixo}.* ({sum(self._pilhas.values())} amostras de pilha).")
@@ -0,0 +1,523 @@
+import os
+import sqlite3
+import time
+from itertools import repeat
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tools.document_model import DocumentoFiscal
+
+# Histograma de cada chave (emitente, CFOP, produto): faixas de largura fixa em log10 do valor,
+# de R$ 0,01 a R$ 100 milhões. Valores fora do intervalo caem nas faixas das pontas.
+LOG_MINIMO = -2.0
+LOG_MAXIMO = 8.0
+LARGURA_FAIXA = 0.05
+N_FAIXAS = int(round((LOG_MAXIMO - LOG_MINIMO) / LARGURA_FAIXA))
+# Observações (ponderadas) que uma chave precisa ter no histórico para ser pontuada.
+MIN_HISTORICO = 8
+# Janela móvel: acima deste peso, o histórico da chave é reescalado, de modo que as notas
+# antigas perdem peso à medida que chegam novas (esquecimento exponencial).
+JANELA_HISTORICO = 500.0
+# Z-score robusto a partir do qual o valor é considerado anômalo (Iglewicz e Hoaglin).
+LIMIAR_Z_ROBUSTO = 3.5
+# Constante que torna o MAD comparável ao desvio padrão de uma distribuição normal.
+_FATOR_MAD = 0.6745
+# Histogramas esparsos: observações novas acumuladas antes de serem juntadas às linhas, menor
+# escala de linha aceita antes de incorporá-la às contagens e contagem abaixo da qual uma faixa
+# esquecida deixa o histórico.
+_TAMANHO_BUFFER = 65536
+_ESCALA_MINIMA = 1e-12
+_CONTAGEM_MINIMA = 1e-3
+# Identificação compacta das notas já incluídas no histórico (hash FNV-1a de 64 bits da chave).
+_TAMANHO_CHAVE = 48
+_FNV_BASE = np.uint64(0xcbf29ce484222325)
+_FNV_PRIMO = np.uint64(0x100000001b3)
+
+# Séries acompanhadas: (nome, descrição do valor, descrição da chave).
+SERIE_TOTAL_EMITENTE = "total_emitente"
+SERIE_TOTAL_CFOP = "total_cfop"
+SERIE_PRECO_PRODUTO = "preco_produto"
+SERIE_QUANTIDADE_PRODUTO = "quantidade_produto"
+_DESCRICOES = {
+    SERIE_TOTAL_EMITENTE: ("Valor total", "do emitente"),
+    SERIE_TOTAL_CFOP: ("Valor total", "do CFOP"),
+    SERIE_PRECO_PRODUTO: ("Preço unitário", "do produto"),
+    SERIE_QUANTIDADE_PRODUTO: ("Quantidade", "do produto"),
+}
+# Séries em que só valores acima do histórico são alertados (pedidos pequenos são comuns).
+_SO_ACIMA = frozenset({SERIE_QUANTIDADE_PRODUTO})
+
+
+class _SerieHistogramas:
+    """
+    Histogramas de uma série, um por chave, guardados de forma esparsa: só as faixas com
+    contagem, em ordem de (linha, faixa), com o começo de cada linha em `_inicio` (CSR). Uma
+    chave de produto costuma ocupar poucas das `N_FAIXAS` faixas, e uma matriz densa seria
+    quase toda de zeros (800 bytes por chave, com centenas de milhares de chaves de produto).
+
+    As observações novas vão para um buffer, juntado às linhas quando cresce. A janela do
+    histórico é aplicada com uma escala por linha (contagem real = armazenada x escala), de
+    modo que reescalar uma chave não exige tocar nas suas faixas; a escala é incorporada às
+    contagens quando o buffer é juntado.
+    """
+
+    def __init__(self, chaves: Sequence[str] = (), inicio: Optional[np.ndarray] = None,
+                 faixas: Optional[np.ndarray] = None, contagens: Optional[np.ndarray] = None):
+        self.chaves: List[str] = list(chaves)
+        self._indice: Dict[str, int] = {chave: i for i, chave in enumerate(self.chaves)}
+        if inicio is None:
+            inicio = np.zeros(len(self.chaves) + 1, dtype=np.int64)
+            faixas = np.zeros(0, dtype=np.uint8)
+            contagens = np.zeros(0, dtype=np.float32)
+        self._inicio = np.asarray(inicio, dtype=np.int64)
+        self._faixas = np.asarray(faixas, dtype=np.uint8)
+        self._contagens = np.asarray(contagens, dtype=np.float32)
+        capacidade = max(len(self.chaves), 64)
+        self._escala = np.ones(capacidade, dtype=np.float64)
+        self._pesos = np.zeros(capacidade, dtype=np.float64)
+        self._pesos[:len(self.chaves)] = np.bincount(self._linhas_base(), weights=self._contagens,
+                                                     minlength=len(self.chaves))
+        self._buffer: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._tamanho_buffer = 0
+
+    @classmethod
+    def de_matriz(cls, chaves: Sequence[str], contagens: np.ndarray) -> "_SerieHistogramas":
+        """Converte a matriz densa (chaves x faixas) dos históricos gravados no formato anterior."""
+        linhas, faixas = np.nonzero(contagens)
+        inicio = np.searchsorted(linhas, np.arange(len(chaves) + 1))
+        return cls(chaves, inicio, faixas, contagens[linhas, faixas])
+
+    def _linhas_base(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self._inicio) - 1, dtype=np.int64), np.diff(self._inicio))
+
+    def compactar(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Junta o buffer às linhas, com as escalas aplicadas. Retorna (inicio, faixas, contagens)."""
+        if self._buffer or len(self._inicio) <= len(self.chaves) or (self._escala[:len(self.chaves)] != 1).any():
+            n = len(self.chaves)
+            linhas = np.concatenate([self._linhas_base()] + [linhas for linhas, _, _ in self._buffer])
+            faixas = np.concatenate([self._faixas] + [faixas for _, faixas, _ in self._buffer])
+            valores = np.concatenate([self._contagens] + [valores for _, _, valores in self._buffer])
+            posicoes, inverso = np.unique(linhas * N_FAIXAS + faixas, return_inverse=True)
+            somas = np.bincount(inverso, weights=valores) * self._escala[posicoes // N_FAIXAS]
+            # Faixas que o esquecimento reduziu a quase nada saem do histórico.
+            mantidas = somas >= _CONTAGEM_MINIMA
+            posicoes, somas = posicoes[mantidas], somas[mantidas]
+            self._inicio = np.searchsorted(posicoes, np.arange(n + 1, dtype=np.int64) * N_FAIXAS)
+            self._faixas = (posicoes % N_FAIXAS).astype(np.uint8)
+            self._contagens = somas.astype(np.float32)
+            self._escala[:n] = 1.0
+            self._pesos[:n] = np.bincount(self._linhas_base(), weights=self._contagens, minlength=n)
+            self._buffer.clear()
+            self._tamanho_buffer = 0
+        return self._inicio, self._faixas, self._contagens
+
+    def indices(self, chaves: Iterable[str], criar: bool = False) -> np.ndarray:
+        """Linha de cada chave (-1 para chaves desconhecidas, a menos que `criar`)."""
+        if not criar:
+            return np.fromiter(map(self._indice.get, chaves, repeat(-1)), dtype=np.int64)
+        resultado = []
+        for chave in chaves:
+            linha = self._indice.get(chave)
+            if linha is None:
+                linha = self._indice[chave] = len(self.chaves)
+                self.chaves.append(chave)
+            resultado.append(linha)
+        if len(self.chaves) > len(self._pesos):
+            capacidade = max(len(self.chaves), 2 * len(self._pesos))
+            self._escala = np.concatenate([self._escala, np.ones(capacidade - len(self._escala))])
+            self._pesos = np.concatenate([self._pesos, np.zeros(capacidade - len(self._pesos))])
+        return np.asarray(resultado, dtype=np.int64)
+
+    def adicionar(self, linhas: np.ndarray, logs: np.ndarray):
+        """Soma as observações às linhas e reescala as que passaram da janela do histórico."""
+        if not len(linhas):
+            return
+        self._buffer.append((linhas, _faixas(logs).astype(np.uint8), 1.0 / self._escala[linhas]))
+        self._tamanho_buffer += len(linhas)
+        np.add.at(self._pesos, linhas, 1.0)
+        afetadas = np.unique(linhas)
+        pesos = self._pesos[afetadas]
+        cheias = pesos > JANELA_HISTORICO
+        if cheias.any():
+            self._escala[afetadas[cheias]] *= JANELA_HISTORICO / pesos[cheias]
+            self._pesos[afetadas[cheias]] = JANELA_HISTORICO
+        # As escalas só diminuem: são incorporadas às contagens antes de perderem precisão.
+        if self._tamanho_buffer > max(_TAMANHO_BUFFER, len(self._contagens) // 4) \
+                or self._escala[afetadas].min() < _ESCALA_MINIMA:
+            self.compactar()
+
+    def _histogramas(self, linhas: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Faixas com contagem das linhas pedidas, em ordem de (posição em `linhas`, faixa):
+        retorna a posição global de cada uma (posição * N_FAIXAS + faixa) e a contagem real.
+        """
+        # Linhas criadas depois da última compactação ainda não têm faixas na base.
+        na_base = np.minimum(linhas, len(self._inicio) - 1)
+        tamanhos = np.append(np.diff(self._inicio), 0)[na_base]
+        # Índices das faixas de todas as linhas pedidas, concatenados (sem laço por linha).
+        deslocamento = np.repeat(self._inicio[na_base] - np.cumsum(tamanhos) + tamanhos, tamanhos)
+        entradas = deslocamento + np.arange(len(deslocamento))
+        ordem = np.repeat(np.arange(len(linhas), dtype=np.int64), tamanhos)
+        posicoes = ordem * N_FAIXAS + self._faixas[entradas]
+        valores = self._contagens[entradas] * self._escala[linhas][ordem]
+        if self._buffer:
+            linhas_buffer = np.concatenate([linhas for linhas, _, _ in self._buffer])
+            faixas_buffer = np.concatenate([faixas for _, faixas, _ in self._buffer])
+            valores_buffer = np.concatenate([valores for _, _, valores in self._buffer])
+            self._buffer[:] = [(linhas_buffer, faixas_buffer, valores_buffer)]
+            ordem_linha = np.full(len(self.chaves), -1, dtype=np.int64)
+            ordem_linha[linhas] = np.arange(len(linhas))
+            pedidas = np.flatnonzero(ordem_linha[linhas_buffer] >= 0)
+            if len(pedidas):
+                linhas_pedidas = linhas_buffer[pedidas]
+                posicoes, inverso = np.unique(np.concatenate([
+                    posicoes, ordem_linha[linhas_pedidas] * N_FAIXAS + faixas_buffer[pedidas]]), return_inverse=True)
+                valores = np.bincount(inverso, weights=np.concatenate([
+                    valores, valores_buffer[pedidas] * self._escala[linhas_pedidas]]))
+        return posicoes, valores.astype(np.float64)
+
+    def estatisticas(self, linhas: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Mediana e MAD (em log10) e peso do histórico de cada linha, interpolando dentro das
+        faixas. O MAD é o menor raio r com metade do peso em [mediana - r, mediana + r]. Esse
+        peso só muda de inclinação quando mediana ± r cruza a borda de uma faixa, então uma
+        busca binária simultânea nas linhas acha o trecho entre duas bordas que contém o MAD, e
+        o valor exato sai por interpolação linear nesse trecho. A busca de cada linha começa
+        limitada às faixas ocupadas e só continua nas linhas ainda não resolvidas; as buscas
+        nas faixas de todas as linhas são um único `np.searchsorted` sobre as posições globais.
+        """
+        posicoes, contagens = self._histogramas(linhas)
+        if not len(posicoes):
+            zeros = np.zeros(len(linhas))
+            return zeros, zeros, zeros
+        acumulado = np.concatenate([[0.0], np.cumsum(contagens)])
+        ordem = np.arange(len(linhas), dtype=np.int64)
+        primeira = np.searchsorted(posicoes, ordem * N_FAIXAS)
+        ultima = np.searchsorted(posicoes, (ordem + 1) * N_FAIXAS)
+        antes_da_linha = acumulado[primeira]
+        peso = acumulado[ultima] - antes_da_linha
+        metade = peso / 2
+        ocupada = ultima > primeira
+        primeira_faixa = np.where(ocupada, posicoes[np.minimum(primeira, len(posicoes) - 1)] - ordem * N_FAIXAS, 0)
+        ultima_faixa = np.where(ocupada, posicoes[np.maximum(ultima - 1, 0)] - ordem * N_FAIXAS, 0)
+
+        # Primeira faixa da linha em que o acumulado chega à metade do peso.
+        i = np.clip(np.searchsorted(acumulado[1:], antes_da_linha + metade), primeira, np.maximum(ultima - 1, 0))
+        na_faixa = contagens[i]
+        fracao = np.divide(metade - (acumulado[i] - antes_da_linha), na_faixa,
+                           out=np.zeros_like(peso), where=na_faixa > 0)
+        posicao_mediana = np.where(ocupada, posicoes[i] - ordem * N_FAIXAS + np.clip(fracao, 0, 1), 0.0)
+
+        def acumulado_ate(posicao: np.ndarray, sub: np.ndarray) -> np.ndarray:
+            posicao = np.clip(posicao, 0, N_FAIXAS)
+            faixa = np.minimum(posicao.astype(np.int64), N_FAIXAS - 1)
+            alvo = ordem[sub] * N_FAIXAS + faixa
+            i = np.searchsorted(posicoes, alvo)
+            j = np.minimum(i, len(posicoes) - 1)
+            na_faixa = np.where(posicoes[j] == alvo, contagens[j], 0.0)
+            return acumulado[i] - antes_da_linha[sub] + (posicao - faixa) * na_faixa
+
+        # Com a mediana a uma fração d da sua faixa, as bordas ficam às distâncias d, 1 - d,
+        # 1 + d, 2 - d, ... (em faixas): a t-ésima, em ordem crescente, é `raio_da_borda(t)`.
+        fracao_borda = posicao_mediana % 1
+        perto, longe = np.minimum(fracao_borda, 1 - fracao_borda), np.maximum(fracao_borda, 1 - fracao_borda)
+
+        def raio_da_borda(t: np.ndarray, sub: np.ndarray) -> np.ndarray:
+            return np.where(t < 0, 0.0, t // 2 + np.where(t % 2 == 0, perto[sub], longe[sub]))
+
+        def cobertura(raio: np.ndarray, sub: np.ndarray) -> np.ndarray:
+            return acumulado_ate(posicao_mediana[sub] + raio, sub) - acumulado_ate(posicao_mediana[sub] - raio, sub)
+
+        # Invariante: a cobertura na borda `alto` alcança a metade do peso; na `baixo`, não. A
+        # tolerância evita que o arredondamento numa borda exata empurre o MAD para a borda seguinte.
+        alvo = metade * (1 - 1e-9)
+        # Um raio que alcança as faixas ocupadas mais distantes cobre todo o peso.
+        alcance = np.maximum(posicao_mediana - primeira_faixa, ultima_faixa + 1 - posicao_mediana)
+        alto = np.minimum(2 * np.ceil(alcance).astype(np.int64) + 1, 2 * N_FAIXAS + 1)
+        baixo = np.full(len(linhas), -1, dtype=np.int64)
+        while True:
+            sub = np.flatnonzero(alto - baixo > 1)
+            if not len(sub):
+                break
+            meio = (baixo[sub] + alto[sub]) // 2
+            cobre = cobertura(raio_da_borda(meio, sub), sub) >= alvo[sub]
+            alto[sub] = np.where(cobre, meio, alto[sub])
+            baixo[sub] = np.where(cobre, baixo[sub], meio)
+        raio_baixo, raio_alto = raio_da_borda(baixo, ordem), raio_da_borda(alto, ordem)
+        cobertura_baixo, cobertura_alto = cobertura(raio_baixo, ordem), cobertura(raio_alto, ordem)
+        subida = cobertura_alto - cobertura_baixo
+        fracao = np.clip(np.divide(alvo - cobertura_baixo, subida, out=np.zeros_like(peso), where=subida > 0), 0, 1)
+        mediana = LOG_MINIMO + posicao_mediana * LARGURA_FAIXA
+        mad = (raio_baixo + fracao * (raio_alto - raio_baixo)) * LARGURA_FAIXA
+        return mediana, mad, peso
+
+
+def _gravar_chaves(chaves: List[str]) -> np.ndarray:
+    # Em UTF-8, separadas por NUL (que não ocorre em XML): um array de texto do NumPy teria
+    # largura fixa de 4 bytes por caractere da chave mais longa.
+    return np.frombuffer('\0'.join(chaves).encode('utf-8'), dtype=np.uint8)
+
+
+def _ler_chaves(dados: np.ndarray) -> List[str]:
+    return dados.tobytes().decode('utf-8').split('\0') if len(dados) else []
+
+
+def _faixas(logs: np.ndarray) -> np.ndarray:
+    return np.clip(((logs - LOG_MINIMO) / LARGURA_FAIXA).astype(np.int64), 0, N_FAIXAS - 1)
+
+
+def _identificadores(chaves_acesso: List[str]) -> np.ndarray:
+    """Identificador de 64 bits (FNV-1a, calculado coluna a coluna) de cada chave de acesso."""
+    caracteres = np.array(chaves_acesso, dtype=f'S{_TAMANHO_CHAVE}').view(np.uint8)
+    caracteres = caracteres.reshape(len(chaves_acesso), _TAMANHO_CHAVE)
+    resultado = np.full(len(chaves_acesso), _FNV_BASE, dtype=np.uint64)
+    for coluna in caracteres.T:
+        resultado ^= coluna
+        resultado *= _FNV_PRIMO
+    return resultado
+
+
+class _Observacoes(NamedTuple):
+    """Valores de uma série em um lote: uma posição por observação, válida ou não."""
+    posicoes: np.ndarray   # posição do documento no lote
+    chaves: List[Optional[str]]
+    valores: np.ndarray
+    validas: np.ndarray    # valor > 0 e chave preenchida
+
+
+def _observacoes(documentos: Sequence[Any]) -> Dict[str, _Observacoes]:
+    """
+    Valores de cada série nos documentos (DocumentoFiscal ou o mesmo formato em dicionário).
+    Valores ausentes, zerados ou negativos e chaves vazias são marcados como inválidos.
+    """
+    # Uma compreensão por coluna: bem mais rápido que um laço com vários appends.
+    documentos = [DocumentoFiscal.from_dict(d) if isinstance(d, dict) else d for d in documentos]
+    cabecalhos = [documento.cabecalho for documento in documentos]
+    emitentes = [cabecalho.emitente_cnpj for cabecalho in cabecalhos]
+    totais = np.array([cabecalho.valor_total for cabecalho in cabecalhos], dtype=np.float64)
+    cfops = [documento.itens[0].cfop.replace('.', '') if documento.itens and documento.itens[0].cfop else None
+             for documento in documentos]
+    itens = [item for documento in documentos for item in documento.itens]
+    item_posicoes = np.repeat(np.arange(len(documentos), dtype=np.int64),
+                              [len(documento.itens) for documento in documentos])
+    produtos = [f"{emitente}|{item.codigo_produto}" if emitente and item.codigo_produto else None
+                for documento, emitente in zip(documentos, emitentes) for item in documento.itens]
+    # None vira NaN, que não passa no teste > 0.
+    precos = np.array([item.valor_unitario for item in itens], dtype=np.float64)
+    quantidades = np.array([item.quantidade for item in itens], dtype=np.float64)
+
+    def preenchidas(chaves: List[Optional[str]]) -> np.ndarray:
+        return np.fromiter(map(bool, chaves), dtype=bool, count=len(chaves))
+
+    posicoes_documentos = np.arange(len(documentos), dtype=np.int64)
+    com_emitente, com_cfop, com_produto = preenchidas(emitentes), preenchidas(cfops), preenchidas(produtos)
+    with np.errstate(invalid='ignore'):
+        return {
+            SERIE_TOTAL_EMITENTE: _Observacoes(posicoes_documentos, emitentes, totais, com_emitente & (totais > 0)),
+            SERIE_TOTAL_CFOP: _Observacoes(posicoes_documentos, cfops, totais, com_cfop & (totais > 0)),
+            SERIE_PRECO_PRODUTO: _Observacoes(item_posicoes, produtos, precos, com_produto & (precos > 0)),
+            SERIE_QUANTIDADE_PRODUTO: _Observacoes(item_posicoes, produtos, quantidades,
+                                                   com_produto & (quantidades > 0)),
+        }
+
+
+def _formatar(serie: str, valor: float) -> str:
+    if serie == SERIE_QUANTIDADE_PRODUTO:
+        return f"{valor:,.3f}".rstrip('0').rstrip('.')
+    return f"R$ {valor:,.2f}"
+
+
+class DetectorAnomalias:
+    """
+    Detecção de valores anômalos por comparação com o histórico dos lotes.
+
+    Quatro séries são acompanhadas: valor total por emitente (CNPJ), valor total por CFOP e
+    preço unitário e quantidade por produto (CNPJ do emitente + código do produto). Para cada
+    chave, o histórico é um histograma em escala logarítmica (esparso: só as faixas ocupadas),
+    atualizado de forma incremental: cada lote soma as suas observações, sem reler o histórico.
+    A pontuação de um lote é vetorizada: mediana e MAD de todas as chaves envolvidas saem do
+    histograma de uma vez e cada valor recebe um z-score robusto, 0,6745 * (log v - mediana) / MAD.
+
+    As notas já vistas (pela chave de acesso) não entram de novo no histórico, então reprocessar
+    a mesma pasta não distorce as estatísticas. O estado é gravado em um único arquivo .npz.
+    """
+
+    def __init__(self, caminho: Optional[Path] = None, limiar: float = LIMIAR_Z_ROBUSTO):
+        self.caminho = Path(caminho) if caminho else None
+        self.limiar = limiar
+        self.series: Dict[str, _SerieHistogramas] = {serie: _SerieHistogramas() for serie in _DESCRICOES}
+        # Identificadores (64 bits) das notas já incluídas no histórico, ordenados.
+        self._notas_vistas = np.zeros(0, dtype=np.uint64)
+        if self.caminho is not None and self.caminho.is_file():
+            self._carregar()
+
+    def _carregar(self):
+        with np.load(self.caminho, allow_pickle=False) as arquivo:
+            if arquivo['n_faixas'] != N_FAIXAS:
+                print(f"⚠️ Histórico de anomalias em {self.caminho.name} tem outro formato; começando do zero.")
+                return
+            for serie in _DESCRICOES:
+                if f"{serie}_chaves" not in arquivo:
+                    continue
+                if f"{serie}_inicio" not in arquivo:
+                    # Formato anterior: chaves em texto e uma matriz densa de contagens.
+                    self.series[serie] = _SerieHistogramas.de_matriz(arquivo[f"{serie}_chaves"].tolist(),
+                                                                     arquivo[f"{serie}_contagens"])
+                    continue
+                self.series[serie] = _SerieHistogramas(_ler_chaves(arquivo[f"{serie}_chaves"]),
+                                                      arquivo[f"{serie}_inicio"], arquivo[f"{serie}_faixas"],
+                                                      arquivo[f"{serie}_contagens"])
+            self._notas_vistas = arquivo['notas_vistas']
+
+    def salvar(self):
+        """Grava o histórico (arquivo temporário + rename, para nunca deixar o .npz pela metade)."""
+        if self.caminho is None:
+            return
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {"n_faixas": np.int64(N_FAIXAS), "notas_vistas": self._notas_vistas}
+        for serie, histogramas in self.series.items():
+            inicio, faixas, contagens = histogramas.compactar()
+            arrays[f"{serie}_chaves"] = _gravar_chaves(histogramas.chaves)
+            arrays[f"{serie}_inicio"] = inicio
+            arrays[f"{serie}_faixas"] = faixas
+            arrays[f"{serie}_contagens"] = contagens
+        temporario = self.caminho.with_name(self.caminho.name + '.tmp.npz')
+        np.savez(temporario, **arrays)
+        os.replace(temporario, self.caminho)
+
+    def pontuar(self, documentos: Sequence[Any]) -> List[List[str]]:
+        """Alertas de valor anômalo de cada documento, comparando-o com o histórico (sem atualizá-lo)."""
+        return self._avaliar(documentos, _observacoes(documentos))
+
+    def avaliar_lote(self, documentos: Sequence[Any]) -> List[List[str]]:
+        """Pontua os documentos contra o histórico e depois os inclui nele. Retorna os alertas de cada um."""
+        observacoes = _observacoes(documentos)
+        alertas = self._avaliar(documentos, observacoes)
+        self._atualizar(documentos, observacoes)
+        return alertas
+
+    def atualizar(self, documentos: Sequence[Any]):
+        """Inclui os documentos no histórico (notas já vistas são ignoradas)."""
+        self._atualizar(documentos, _observacoes(documentos))
+
+    def _avaliar(self, documentos: Sequence[Any], observacoes: Dict[str, _Observacoes]) -> List[List[str]]:
+        alertas: List[List[str]] = [[] for _ in documentos]
+        # Preço e quantidade usam a mesma lista de chaves: as linhas são buscadas uma vez.
+        linhas_por_lista: Dict[int, np.ndarray] = {}
+        for serie, obs in observacoes.items():
+            histogramas = self.series[serie]
+            if id(obs.chaves) not in linhas_por_lista:
+                linhas_por_lista[id(obs.chaves)] = histogramas.indices(obs.chaves)
+            linhas = linhas_por_lista[id(obs.chaves)]
+            conhecidas = np.flatnonzero(obs.validas & (linhas >= 0))
+            if not len(conhecidas):
+                continue
+            unicas, inverso = np.unique(linhas[conhecidas], return_inverse=True)
+            mediana, mad, peso = histogramas.estatisticas(unicas)
+            logs = np.log10(obs.valores[conhecidas])
+            # O MAD nunca fica abaixo da resolução do histograma (ex.: preço sempre igual).
+            z = _FATOR_MAD * (logs - mediana[inverso]) / np.maximum(mad[inverso], LARGURA_FAIXA)
+            desvio = z if serie in _SO_ACIMA else np.abs(z)
+            anomalas = (desvio >= self.limiar) & (peso[inverso] >= MIN_HISTORICO)
+            for i in np.flatnonzero(anomalas):
+                origem = conhecidas[i]
+                alertas[obs.posicoes[origem]].append(self._mensagem(
+                    serie, obs.chaves[origem], obs.valores[origem], 10 ** mediana[inverso[i]], z[i]))
+        return alertas
+
+    @staticmethod
+    def _mensagem(serie: str, chave: str, valor: float, mediana: float, z: float) -> str:
+        rotulo, de_quem = _DESCRICOES[serie]
+        direcao = "acima" if z > 0 else "abaixo"
+        identificacao = chave.split('|', 1)[1] if serie in (SERIE_PRECO_PRODUTO, SERIE_QUANTIDADE_PRODUTO) else chave
+        return (f"ALERTA VALOR: {rotulo} {_formatar(serie, valor)} muito {direcao} do histórico {de_quem} "
+                f"{identificacao} (mediana {_formatar(serie, mediana)}; z robusto {z:+.1f}).")
+
+    def _atualizar(self, documentos: Sequence[Any], observacoes: Dict[str, _Observacoes]):
+        novos = np.ones(len(documentos), dtype=bool)
+        chaves = [(d.get('cabecalho') or {}).get('chave_acesso') if isinstance(d, dict) else d.cabecalho.chave_acesso
+                  for d in documentos]
+        posicoes = np.flatnonzero(np.fromiter(map(bool, chaves), dtype=bool, count=len(chaves)))
+        if len(posicoes):
+            ids = _identificadores([chaves[i] for i in posicoes])
+            # Notas repetidas no próprio lote entram uma vez só.
+            ids_unicos, primeira = np.unique(ids, return_index=True)
+            repetidas = np.ones(len(ids), dtype=bool)
+            repetidas[primeira] = False
+            # `_notas_vistas` está ordenado: a busca binária diz quais já estão no histórico.
+            vistas = self._notas_vistas
+            lugar = np.searchsorted(vistas, ids_unicos)
+            ja_vistas = (lugar < len(vistas)) & (vistas[np.minimum(lugar, len(vistas) - 1)] == ids_unicos) \
+                if len(vistas) else np.zeros(len(ids_unicos), dtype=bool)
+            novos[posicoes[repetidas]] = False
+            novos[posicoes[primeira[ja_vistas]]] = False
+            self._notas_vistas = np.insert(vistas, lugar[~ja_vistas], ids_unicos[~ja_vistas])
+
+        for serie, obs in observacoes.items():
+            selecionadas = np.flatnonzero(obs.validas & novos[obs.posicoes])
+            if not len(selecionadas):
+                continue
+            histogramas = self.series[serie]
+            linhas = histogramas.indices((obs.chaves[i] for i in selecionadas), criar=True)
+            histogramas.adicionar(linhas, np.log10(obs.valores[selecionadas]))
+
+
+class HistoricoCompartilhado:
+    """
+    Detector sobre um histórico gravado por vários processos (trabalhadores de um lote
+    distribuído). Cada processo pontua e atualiza uma cópia local do histórico e junta os seus
+    documentos ao arquivo compartilhado a cada `a_cada_documentos` documentos ou
+    `a_cada_segundos` segundos (e em `sincronizar`/`fechar`), não a cada grupo.
+
+    Na junção, o processo relê o .npz, inclui nele os documentos pendentes (as notas já vistas,
+    inclusive as que outro trabalhador juntou antes, são ignoradas), grava o arquivo e passa a
+    usar o histórico juntado. A exclusão entre os processos é uma transação `BEGIN IMMEDIATE`
+    num banco SQLite vazio ao lado do .npz ('<arquivo>.trava'), como nos pacotes de notas; a
+    leitura fora da junção não precisa da trava, já que o .npz é gravado com rename.
+    """
+
+    def __init__(self, caminho: Path, a_cada_documentos: int = 4096, a_cada_segundos: float = 30.0,
+                 limiar: float = LIMIAR_Z_ROBUSTO):
+        self.caminho = Path(caminho)
+        self.a_cada_documentos = a_cada_documentos
+        self.a_cada_segundos = a_cada_segundos
+        self.limiar = limiar
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self.detector = DetectorAnomalias(self.caminho, limiar)
+        # Documentos já incluídos na cópia local que ainda não foram para o arquivo compartilhado.
+        self._pendentes: List[Any] = []
+        self._ultima_sincronizacao = time.monotonic()
+
+    def avaliar_lote(self, documentos: Sequence[Any]) -> List[List[str]]:
+        """Como `DetectorAnomalias.avaliar_lote`; junta ao arquivo compartilhado quando chega a hora."""
+        alertas = self.detector.avaliar_lote(documentos)
+        self._pendentes.extend(documentos)
+        if (len(self._pendentes) >= self.a_cada_documentos
+                or time.monotonic() - self._ultima_sincronizacao >= self.a_cada_segundos):
+            self.sincronizar()
+        return alertas
+
+    def sincronizar(self):
+        """Junta os documentos pendentes ao arquivo compartilhado e relê o histórico dos outros processos."""
+        if not self._pendentes:
+            return
+        trava = sqlite3.connect(self.caminho.with_name(self.caminho.name + '.trava'), timeout=60,
+                                isolation_level=None)
+        try:
+            trava.execute("BEGIN IMMEDIATE")
+            try:
+                compartilhado = DetectorAnomalias(self.caminho, self.limiar)
+                compartilhado.atualizar(self._pendentes)
+                compartilhado.salvar()
+            finally:
+                trava.execute("ROLLBACK")
+        finally:
+            trava.close()
+        self.detector = compartilhado
+        self._pendentes = []
+        self._ultima_sincronizacao = time.monotonic()
+
+    def fechar(self):
+        self.sincronizar()
@@ -0,0 +1,213 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+_SQL_CRIAR_TABELAS = """
+CREATE TABLE IF NOT EXISTS tarefas (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    arquivo TEXT NOT NULL,
+    assinatura TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pendente',
+    trabalhador TEXT,
+    lease_ate REAL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    resultado TEXT,
+    consolidada INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (run_id, arquivo)
+);
+CREATE INDEX IF NOT EXISTS idx_tarefas_status ON tarefas (status, id);
+-- Primeiro documento do run concluído com sucesso com cada chave de acesso (deduplicação).
+CREATE TABLE IF NOT EXISTS chaves_concluidas (
+    run_id TEXT NOT NULL,
+    chave TEXT NOT NULL,
+    identificador TEXT NOT NULL,
+    PRIMARY KEY (run_id, chave)
+) WITHOUT ROWID;
+"""
+
+STATUS_PENDENTE = 'pendente'
+STATUS_EM_EXECUCAO = 'em_execucao'
+STATUS_CONCLUIDA = 'concluida'
+STATUS_FALHA = 'falha'
+
+# Tempo (s) que um trabalhador detém uma tarefa sem renovar o lease.
+LEASE_PADRAO = 300.0
+# Após este número de leases expirados, a tarefa é dada como falha (ex.: arquivo que derruba o processo).
+MAX_TENTATIVAS = 3
+
+
+class Tarefa(NamedTuple):
+    """Um arquivo da pasta de entrada (documento solto ou compactado inteiro) a ser processado."""
+    id: int
+    run_id: str
+    arquivo: str
+    assinatura: str
+
+
+def identificar_trabalhador() -> str:
+    """Identificador único do processo trabalhador ('host:pid:aleatório')."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class FilaTrabalho:
+    """
+    Fila de trabalho durável em um arquivo SQLite, compartilhada por vários processos.
+
+    O coordenador enfileira os arquivos do lote; cada trabalhador reivindica tarefas com
+    um lease (prazo). A reivindicação é feita em uma transação `BEGIN IMMEDIATE` com
+    `UPDATE ... RETURNING`, então duas reivindicações simultâneas nunca recebem a mesma
+    tarefa. Se um trabalhador morre, o lease expira e a tarefa volta a ser reivindicável;
+    a conclusão só é aceita de quem ainda detém o lease.
+
+    A fila também registra, por chave de acesso, o primeiro documento do run concluído com
+    sucesso (`documento_da_chave`), para que as outras cópias da mesma nota não sejam
+    processadas de novo por nenhum trabalhador.
+
+    Com `wal=True` o banco usa journal WAL, que permite leituras concorrentes com as
+    gravações, mas exige que todos os processos estejam na mesma máquina. Para
+    trabalhadores em hosts diferentes sobre um volume compartilhado, use `wal=False`.
+    """
+
+    def __init__(self, caminho_db: Path, lease_segundos: float = LEASE_PADRAO, wal: bool = True):
+        self.caminho_db = Path(caminho_db)
+        self.caminho_db.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_segundos = lease_segundos
+        self.wal = wal
+        # isolation_level=None: as transações são abertas explicitamente (BEGIN IMMEDIATE).
+        self.conn = sqlite3.connect(self.caminho_db, timeout=60, isolation_level=None)
+        self.conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+        self.conn.execute("PRAGMA synchronous=NORMAL" if wal else "PRAGMA synchronous=FULL")
+        self.conn.executescript(_SQL_CRIAR_TABELAS)
+
+    def enfileirar(self, run_id: str, arquivos: Dict[str, str]) -> int:
+        """
+        Enfileira os arquivos do lote ({nome: assinatura}). Arquivos já enfileirados neste run
+        são mantidos, a menos que a assinatura tenha mudado (aí voltam a ficar pendentes).
+        Retorna quantas tarefas foram criadas ou reabertas.
+        """
+        antes = self.conn.total_changes
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(
+                "INSERT INTO tarefas (run_id, arquivo, assinatura) VALUES (?, ?, ?) "
+                "ON CONFLICT (run_id, arquivo) DO UPDATE SET assinatura = excluded.assinatura, "
+                "status = 'pendente', trabalhador = NULL, lease_ate = NULL, tentativas = 0, "
+                "resultado = NULL, consolidada = 0 WHERE assinatura != excluded.assinatura",
+                [(run_id, arquivo, assinatura) for arquivo, assinatura in arquivos.items()]
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return self.conn.total_changes - antes
+
+    def reivindicar(self, trabalhador: str, limite: int = 1) -> List[Tarefa]:
+        """
+        Reivindica até `limite` tarefas pendentes (ou com lease expirado) para o trabalhador.
+        Tarefas que já esgotaram as tentativas são marcadas como falha.
+        """
+        agora = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                "UPDATE tarefas SET status = ?, lease_ate = NULL, resultado = ? "
+                "WHERE status = ? AND lease_ate < ? AND tentativas >= ?",
+                (STATUS_FALHA,
+                 json.dumps({"erro": f"Lease expirado {MAX_TENTATIVAS} vezes; o arquivo foi abandonado."}),
+                 STATUS_EM_EXECUCAO, agora, MAX_TENTATIVAS)
+            )
+            linhas = self.conn.execute(
+                "UPDATE tarefas SET status = ?, trabalhador = ?, lease_ate = ?, tentativas = tentativas + 1 "
+                "WHERE id IN (SELECT id FROM tarefas WHERE status = ? OR (status = ? AND lease_ate < ?) "
+                "ORDER BY id LIMIT ?) RETURNING id, run_id, arquivo, assinatura",
+                (STATUS_EM_EXECUCAO, trabalhador, agora + self.lease_segundos,
+                 STATUS_PENDENTE, STATUS_EM_EXECUCAO, agora, limite)
+            ).fetchall()
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return sorted((Tarefa(*linha) for linha in linhas), key=lambda tarefa: tarefa.id)
+
+    def renovar(self, tarefa_id: int, trabalhador: str) -> bool:
+        """Estende o lease da tarefa. Retorna False se o trabalhador já não a detém."""
+        cursor = self.conn.execute(
+            "UPDATE tarefas SET lease_ate = ? WHERE id = ? AND status = ? AND trabalhador = ?",
+            (time.time() + self.lease_segundos, tarefa_id, STATUS_EM_EXECUCAO, trabalhador)
+        )
+        return cursor.rowcount == 1
+
+    def concluir(self, tarefa_id: int, trabalhador: str, resultado: Dict[str, Any],
+                 chaves: Optional[Dict[str, str]] = None) -> bool:
+        """
+        Grava o resultado da tarefa. Só é aceito se o trabalhador ainda detém o lease;
+        caso contrário (lease expirado e reivindicado por outro) retorna False.
+        `chaves` ({chave de acesso: identificador}) são as notas concluídas com sucesso na
+        tarefa; na mesma transação, cada uma é registrada se nenhum outro documento do run
+        a registrou antes.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self.conn.execute(
+                "UPDATE tarefas SET status = ?, lease_ate = NULL, resultado = ? "
+                "WHERE id = ? AND status = ? AND trabalhador = ? RETURNING run_id",
+                (STATUS_CONCLUIDA, json.dumps(resultado, ensure_ascii=False), tarefa_id,
+                 STATUS_EM_EXECUCAO, trabalhador)
+            )
+            linha = cursor.fetchone()
+            if linha is not None and chaves:
+                self.conn.executemany("INSERT OR IGNORE INTO chaves_concluidas VALUES (?, ?, ?)",
+                                      [(linha[0], chave, identificador) for chave, identificador in chaves.items()])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return linha is not None
+
+    def documento_da_chave(self, run_id: str, chave: str) -> Optional[str]:
+        """Identificador do primeiro documento do run concluído com sucesso com a chave de acesso (ou None)."""
+        linha = self.conn.execute("SELECT identificador FROM chaves_concluidas WHERE run_id = ? AND chave = ?",
+                                  (run_id, chave)).fetchone()
+        return linha[0] if linha else None
+
+    def contar_status(self, run_id: Optional[str] = None) -> Dict[str, int]:
+        """Quantidade de tarefas por status (de um run ou da fila inteira)."""
+        if run_id is None:
+            linhas = self.conn.execute("SELECT status, COUNT(*) FROM tarefas GROUP BY status")
+        else:
+            linhas = self.conn.execute("SELECT status, COUNT(*) FROM tarefas WHERE run_id = ? GROUP BY status",
+                                       (run_id,))
+        return dict(linhas.fetchall())
+
+    def ha_trabalho(self, run_id: Optional[str] = None) -> bool:
+        """True enquanto houver tarefas pendentes ou em execução."""
+        contagem = self.contar_status(run_id)
+        return bool(contagem.get(STATUS_PENDENTE) or contagem.get(STATUS_EM_EXECUCAO))
+
+    def finalizadas_nao_consolidadas(self, run_id: str) -> List[tuple]:
+        """Tarefas concluídas ou com falha do run cujo resultado ainda não foi consolidado: (id, arquivo, assinatura, resultado)."""
+        linhas = self.conn.execute(
+            "SELECT id, arquivo, assinatura, resultado FROM tarefas "
+            "WHERE run_id = ? AND status IN (?, ?) AND consolidada = 0 ORDER BY id",
+            (run_id, STATUS_CONCLUIDA, STATUS_FALHA)
+        ).fetchall()
+        return [(tarefa_id, arquivo, assinatura, json.loads(resultado or '{}'))
+                for tarefa_id, arquivo, assinatura, resultado in linhas]
+
+    def marcar_consolidadas(self, ids: List[int]):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("UPDATE tarefas SET consolidada = 1 WHERE id = ?", [(i,) for i in ids])
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def fechar(self):
+        self.conn.close()
@@ -0,0 +1,161 @@
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from tools.document_source import DocumentSource, abrir_conteudo, is_caminho
+
+# Tamanho de cada bloco entregue ao parser incremental. O cabeçalho de uma NF-e costuma
+# caber em 1-2 blocos; blocos maiores fariam o parser analisar itens que serão descartados.
+TAMANHO_BLOCO = 2 * 1024
+# Quanto do início do arquivo pode ser lido à procura do cabeçalho antes de desistir.
+LIMITE_BYTES_PADRAO = 256 * 1024
+# Sem o elemento infNFe até aqui, o arquivo não é tratado como NF-e.
+LIMITE_SEM_INFNFE = 16 * 1024
+
+# Elementos de infNFe cujo conteúdo interessa ao cabeçalho (ide/emit/dest).
+_SECOES_CABECALHO = {'ide', 'emit', 'dest'}
+# Campos lidos em cada seção: (seção, elemento) -> campo do CabecalhoPrevio.
+_CAMPOS = {
+    ('ide', 'nNF'): 'numero_nf',
+    ('ide', 'dhEmi'): 'data_emissao',
+    ('ide', 'dEmi'): 'data_emissao',
+    ('emit', 'CNPJ'): 'emitente_cnpj',
+    ('emit', 'CPF'): 'emitente_cnpj',
+    ('emit', 'CNAE'): 'emitente_cnae',
+    ('dest', 'CNPJ'): 'destinatario_cpf_cnpj',
+    ('dest', 'CPF'): 'destinatario_cpf_cnpj',
+}
+
+
+class CabecalhoPrevio(NamedTuple):
+    """
+    Cabeçalho de uma NF-e lido só do início do XML (até ide/emit/dest), sem os itens.
+    Basta para agrupar, deduplicar e ordenar o lote antes da extração completa.
+    """
+    chave_acesso: Optional[str]
+    numero_nf: Optional[str]
+    data_emissao: Optional[str]
+    emitente_cnpj: Optional[str]
+    emitente_cnae: Optional[str]
+    destinatario_cpf_cnpj: Optional[str]
+    bytes_lidos: int
+
+    @property
+    def ano_mes(self) -> str:
+        """'AAAA-MM' da emissão (vazio se a data não foi lida)."""
+        return self.data_emissao[:7] if self.data_emissao else ''
+
+    @property
+    def chave_completa(self) -> bool:
+        """True se a chave de acesso tem os 44 dígitos (só então serve para deduplicar)."""
+        return bool(self.chave_acesso) and len(self.chave_acesso) == 44 and self.chave_acesso.isdigit()
+
+
+def _nome_local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _blocos(source: DocumentSource, limite_bytes: int) -> Iterable[bytes]:
+    """Blocos do início da fonte: de um caminho, só o que for lido; do conteúdo em memória, fatias sem cópia."""
+    if is_caminho(source):
+        with open(source, 'rb') as f:
+            lidos = 0
+            while lidos < limite_bytes:
+                bloco = f.read(TAMANHO_BLOCO)
+                if not bloco:
+                    return
+                lidos += len(bloco)
+                yield bloco
+        return
+    with abrir_conteudo(source) as conteudo, memoryview(conteudo) as visao:
+        for inicio in range(0, min(len(visao), limite_bytes), TAMANHO_BLOCO):
+            # Cada fatia é liberada antes da seguinte (um mmap não fecha com fatias exportadas).
+            with visao[inicio:inicio + TAMANHO_BLOCO] as fatia:
+                yield fatia
+
+
+def ler_cabecalho(source: DocumentSource, limite_bytes: int = LIMITE_BYTES_PADRAO) -> Optional[CabecalhoPrevio]:
+    """
+    Lê o cabeçalho de uma NF-e com um parser incremental (XMLPullParser), bloco a bloco, e
+    para assim que 'dest' termina ou o primeiro item ('det') começa, sem ler o restante do
+    arquivo. Aceita as mesmas fontes dos extratores (caminho, bytes, memoryview, mmap ou
+    objeto de arquivo).
+    Retorna None se o XML for inválido, não for uma NF-e ou o cabeçalho não aparecer nos
+    primeiros `limite_bytes`; nesses casos a extração completa decide o que fazer.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    campos: Dict[str, Optional[str]] = {}
+    chave = None
+    secao = None
+    lidos = 0
+    blocos = _blocos(source, limite_bytes)
+    try:
+        for bloco in blocos:
+            lidos += len(bloco)
+            parser.feed(bloco)
+            for evento, elemento in parser.read_events():
+                nome = _nome_local(elemento.tag)
+                if evento == 'start':
+                    if nome == 'infNFe':
+                        chave = elemento.attrib.get('Id', '').replace('NFe', '')
+                    elif nome == 'det':
+                        return _montar(chave, campos, lidos)
+                    elif nome in _SECOES_CABECALHO and secao is None:
+                        secao = nome
+                    continue
+                if nome == secao:
+                    if nome == 'dest':
+                        return _montar(chave, campos, lidos)
+                    secao = None
+                elif secao is not None:
+                    campo = _CAMPOS.get((secao, nome))
+                    if campo and campo not in campos:
+                        campos[campo] = elemento.text
+                    # O elemento já foi lido: libera o texto para o parser não acumular a árvore.
+                    elemento.clear()
+            if chave is None and lidos >= LIMITE_SEM_INFNFE:
+                # Sem infNFe nos primeiros blocos: não é uma NF-e (ou é um evento/protocolo avulso).
+                return None
+        return _montar(chave, campos, lidos) if chave is not None and campos else None
+    except (ET.ParseError, OSError, ValueError):
+        return None
+    finally:
+        # Fecha o arquivo (ou libera a visão) mesmo quando a leitura para no meio.
+        blocos.close()
+
+
+def _montar(chave: Optional[str], campos: Dict[str, Optional[str]], lidos: int) -> Optional[CabecalhoPrevio]:
+    if chave is None:
+        return None
+    return CabecalhoPrevio(
+        chave_acesso=chave or None,
+        numero_nf=campos.get('numero_nf'),
+        data_emissao=campos.get('data_emissao'),
+        emitente_cnpj=campos.get('emitente_cnpj'),
+        emitente_cnae=campos.get('emitente_cnae'),
+        destinatario_cpf_cnpj=campos.get('destinatario_cpf_cnpj'),
+        bytes_lidos=lidos,
+    )
+
+
+def planejar_documentos(documentos: List[Path]) -> Tuple[List[Path], Dict[Path, Optional[CabecalhoPrevio]]]:
+    """
+    Pré-lê o cabeçalho dos XMLs soltos e devolve (documentos na ordem do lote, cabeçalhos).
+
+    Os XMLs com cabeçalho legível vêm primeiro, agrupados por mês de emissão, CNAE e CNPJ do
+    emitente: notas que vão para a mesma pasta (ou pacote mensal) e para o mesmo agente
+    setorial são processadas em sequência. XMLs sem cabeçalho legível (que provavelmente vão
+    falhar) vêm depois, e os PDFs, que não têm pré-leitura, por último, na ordem recebida.
+    """
+    cabecalhos = {documento: ler_cabecalho(documento)
+                  for documento in documentos if documento.suffix.lower() == '.xml'}
+
+    def ordem(documento: Path):
+        cabecalho = cabecalhos[documento]
+        if cabecalho is None:
+            return (1, '', '', '', documento.name)
+        return (0, cabecalho.ano_mes, cabecalho.emitente_cnae or '', cabecalho.emitente_cnpj or '', documento.name)
+
+    xmls = sorted(cabecalhos, key=ordem)
+    outros = [documento for documento in documentos if documento not in cabecalhos]
+    return xmls + outros, cabecalhos